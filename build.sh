@@ -32,19 +32,17 @@ rsync -apt --mkpath data/content/ "${OUT}/content/"
 # Web site artefacts: waypoints
 ./script/build/waypoints_js.py  data/content/waypoint/country/ "${OUT}/content/waypoint/0_META/"
 
-# Concatenate all waypoints to xcsoar-waypoints.cup
-CUPHEADER="name,code,country,lat,lon,elev,style,rwdir,rwlen,freq,desc"
-XCSWAYPOINTSDIR="${OUT}/content/waypoint/global"
-XCSWAYPOINTS="${XCSWAYPOINTSDIR}/xcsoar_waypoints.cup"
-XCSWAYPOINTSTMP="$(mktemp)"
-while IFS= read -r -d '' each; do
-  dos2unix < "${each}" | grep -v "${CUPHEADER}" >> "${XCSWAYPOINTSTMP}"
-done < <(find data/content/waypoint/country/ -name "*.cup" -print0)
-mkdir -p "${XCSWAYPOINTSDIR}"
-echo "${CUPHEADER}" > "${XCSWAYPOINTS}"
-sort -bu "${XCSWAYPOINTSTMP}" >> "${XCSWAYPOINTS}"
-rm "${XCSWAYPOINTSTMP}"
+# Merge all waypoints into xcsoar_waypoints.cup (sorted, deduplicated)
+./script/build/merge_waypoints.py data/content/waypoint/country/ "${OUT}/content/waypoint/global/xcsoar_waypoints.cup"
 
+# Waypoint tiles for partial downloads (listed in the repository from their index)
+./script/build/waypoint_tiles.py data/content/waypoint/country/ "${OUT}/content/waypoint/tile/"
+
+# Memory-mappable waypoint store for tools (not listed in the repository)
+./script/build/waypoint_store.py data/content/waypoint/country/ "${OUT}/content/waypoint/0_META/xcsoar_waypoints.wpstore"
+
+# SQLite database of all waypoints and airspaces (incl. generated OpenAIP files)
+./script/build/sqlite_export.py "${OUT}/xcsoar.sqlite" data/content/ "${OUT}/content/"
 
 # Web site artefacts: maps
 ./script/build/maps_config_js.py "${OUT}/source/map/0_META/"
@@ -58,3 +56,8 @@ bash -x ./script/build/generate_maps.sh "${OUT}"
 ./script/build/repository.py "${OUT}"
 ./script/build/sortrepo.py "${OUT}"/repository > "${OUT}"/repository.sorted
 mv "${OUT}"/repository.sorted "${OUT}"/repository
+
+## COMPRESS Stage
+
+# .gz (and .zst) siblings of the text artefacts, for the web server to send as they are
+./script/build/precompress.py "${OUT}"
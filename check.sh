@@ -9,22 +9,41 @@ if [ -z "${OUT}" ]; then
   OUT="./output/content"
 fi
 
+# JSON reports of the checks
+REPORT_DIR="${2:-.}"
+
+# Files unchanged since their last check are skipped; set CHECK_FULL=1 to check everything.
+# Their results are kept in the build cache (.cache), so this helps repeated local runs only.
+FULL=()
+if [ -n "${CHECK_FULL}" ]; then
+  FULL=(--full)
+fi
+
 # report all errors don't halt.
-if ! ./script/check/check_waypoints_country.py "${OUT}"/waypoint/country/*.cup; then
+# Format and country code names of all waypoint files, parsed once by a process pool
+if ! ./script/check/check_waypoints.py "${OUT}/waypoint/" --report "${REPORT_DIR}/check-waypoints.json" "${FULL[@]}"; then
+  ERROR=1
+fi
+
+# Waypoints of the national files lie in (or near) their country
+if ! ./script/check/check_waypoints_country.py "${OUT}/waypoint/country/" --report "${REPORT_DIR}/check-country.json" "${FULL[@]}"; then
   ERROR=1
 fi
 
-while IFS= read -r -d '' each; do
-  if ! ./script/check/check_waypoints.py "${each}"; then
-    ERROR=1
-  fi
-done < <(find "${OUT}/waypoint/" -type f -name "*.cup" -print0)
+# Parsing and geometry of all airspace files
+if ! ./script/check/check_airspaces.py "${OUT}/airspace/" --report "${REPORT_DIR}/check-airspaces.json" "${FULL[@]}"; then
+  ERROR=1
+fi
 
-if ! ./script/check/check_airspaces.py "${OUT}"/airspace/; then
+# The fast bbox scanners agree with aerofiles (files aerofiles cannot read are listed as skipped)
+if ! ./script/build/cup_scan.py "${OUT}/waypoint/"; then
+  ERROR=1
+fi
+if ! ./script/build/openair_scan.py "${OUT}/airspace/"; then
   ERROR=1
 fi
 
-if ! ./script/check/check_urls.py "${OUT}"/repository; then
+if ! ./script/check/check_urls.py "${OUT}"/repository "${FULL[@]}"; then
   ERROR=1
 fi
 
@@ -44,12 +44,41 @@ set -x
 
 ssh-keyscan -p "${DEPLOY_PORT}" "${DEPLOY_HOST}" > "${KH_FILE}"
 
-# Rsync the "repository" file and map to the web root (NB: no --delete!):
-rsync -avze "${SSH_CMD}" "${BUILD_DIR}"/repository "${DEPLOY_USER}"@"${DEPLOY_HOST}":"${DEPLOY_PATH}"/repository
-rsync -avze "${SSH_CMD}" "${BUILD_DIR}"/source/ "${DEPLOY_USER}"@"${DEPLOY_HOST}":"${DEPLOY_PATH}"/source/
+REMOTE="${DEPLOY_USER}"@"${DEPLOY_HOST}":"${DEPLOY_PATH}"
+PREVIOUS_MANIFEST="$(mktemp)"
+UPLOAD_LIST="$(mktemp)"
+DELETE_LIST="$(mktemp)"
 
-# the following dir is fully managed by this repo, hence --delete
-rsync -avze "${SSH_CMD}" --delete "${BUILD_DIR}"/content/ "${DEPLOY_USER}"@"${DEPLOY_HOST}":"${DEPLOY_PATH}"/content/
+if rsync -avze "${SSH_CMD}" "${REMOTE}"/SHA256SUMS "${PREVIOUS_MANIFEST}"; then
+  # Incremental deploy: transfer only what changed since the deployed manifest.
+  ./script/build/deploy_manifest.py "${BUILD_DIR}" --previous "${PREVIOUS_MANIFEST}" \
+    --upload-list "${UPLOAD_LIST}" --delete-list "${DELETE_LIST}"
+  rsync -avze "${SSH_CMD}" --files-from="${UPLOAD_LIST}" "${BUILD_DIR}"/ "${REMOTE}"/
+  rsync -avze "${SSH_CMD}" --files-from="${DELETE_LIST}" --delete-missing-args "${BUILD_DIR}"/ "${REMOTE}"/
+else
+  # First deploy with a manifest: full transfer, as before.
+  ./script/build/deploy_manifest.py "${BUILD_DIR}"
+
+  # Rsync the "repository" file (and its precompressed siblings) and map to the web root (NB: no --delete!):
+  REPOSITORY_FILES=("${BUILD_DIR}"/repository)
+  for suffix in gz zst; do
+    if [ -f "${BUILD_DIR}/repository.${suffix}" ]; then
+      REPOSITORY_FILES+=("${BUILD_DIR}/repository.${suffix}")
+    fi
+  done
+  # and the SQLite database of all waypoints and airspaces
+  if [ -f "${BUILD_DIR}/xcsoar.sqlite" ]; then
+    REPOSITORY_FILES+=("${BUILD_DIR}/xcsoar.sqlite")
+  fi
+  rsync -avze "${SSH_CMD}" "${REPOSITORY_FILES[@]}" "${REMOTE}"/
+  rsync -avze "${SSH_CMD}" "${BUILD_DIR}"/source/ "${REMOTE}"/source/
+
+  # the following dir is fully managed by this repo, hence --delete
+  rsync -avze "${SSH_CMD}" --delete "${BUILD_DIR}"/content/ "${REMOTE}"/content/
+fi
+
+# The manifest goes last, so that it never lists files that are not there yet.
+rsync -avze "${SSH_CMD}" "${BUILD_DIR}"/SHA256SUMS "${REMOTE}"/SHA256SUMS
 
 # In any case remove ssh id/kh and build artifacts
-rm -rf "${KH_FILE}" "${ID_FILE}" "${BUILD_DIR}"
+rm -rf "${KH_FILE}" "${ID_FILE}" "${PREVIOUS_MANIFEST}" "${UPLOAD_LIST}" "${DELETE_LIST}" "${BUILD_DIR}"
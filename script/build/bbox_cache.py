@@ -0,0 +1,102 @@
+"""
+Persistent cache of bounding boxes computed from waypoint and airspace files.
+
+Entries are keyed by parser name/version and the SHA-256 of the file content
+(as file_hash.FileHashCache computes it, usually passed in by the caller), so
+an unchanged file is never parsed twice, wherever it lives.  Failed
+computations are not cached.  The cache is a single JSON file loaded once per
+run and written back (pruned) at the end.
+"""
+
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from build_cache import cache_file, load_json, save_json
+from file_hash import FileHashCache
+
+CACHE_FORMAT = 1
+
+# (path, key, bbox, hit) as recorded by a worker process
+Record = Tuple[str, str, Optional[str], bool]
+
+
+class BBoxCache:
+    """Content-hash keyed bbox cache with hit/miss counters."""
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        data = load_json(path, {})
+        if data.get("format") != CACHE_FORMAT:
+            data = {}
+        # path -> key of its current content, key -> bbox (None: no bbox)
+        self.files = data.get("files", {})
+        self.bboxes = data.get("bboxes", {})
+        self.hits = 0
+        self.misses = 0
+        # Lookups made in a worker process, to be absorbed by the parent
+        self._journal: Optional[List[Record]] = None
+
+    @classmethod
+    def load(cls) -> "BBoxCache":
+        """Return the cache stored in the build cache directory."""
+        return cls(cache_file("bbox-cache.json"))
+
+    def get(self, path: Path, parser: str, compute: Callable[[Path], Optional[str]],
+            sha256: Optional[str] = None) -> Optional[str]:
+        """Return the bbox of path, calling compute(path) only on a cache miss.
+
+        parser names the parser and its version (e.g. "cup-1"); bump it when the
+        parser's results change, so that stale entries are not reused.  sha256
+        is the digest of path's content, hashed here if not given.  Exceptions
+        of compute() are passed on, and nothing is cached for them.
+        """
+        if sha256 is None:
+            sha256 = FileHashCache().digest(path)[1]
+        key = f"{parser}:{sha256}"
+        hit = key in self.bboxes
+        bbox = self.bboxes[key] if hit else compute(path)
+        self._record(str(path), key, bbox, hit)
+        if self._journal is not None:
+            self._journal.append((str(path), key, bbox, hit))
+        return bbox
+
+    def _record(self, path: str, key: str, bbox: Optional[str], hit: bool) -> None:
+        self.files[path] = key
+        self.bboxes[key] = bbox
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def start_journal(self) -> None:
+        """Record lookups from now on (call in worker processes)."""
+        self._journal = []
+
+    def drain_journal(self) -> List[Record]:
+        """Return and clear the lookups recorded since the last call."""
+        records = self._journal or []
+        if self._journal is not None:
+            self._journal = []
+        return records
+
+    def absorb(self, records: List[Record]) -> None:
+        """Apply lookups made by a worker process to this cache."""
+        for record in records:
+            self._record(*record)
+
+    def prune(self) -> int:
+        """Evict entries of files that no longer exist; return the eviction count."""
+        gone = [p for p in self.files if not Path(p).exists()]
+        for p in gone:
+            del self.files[p]
+        live = set(self.files.values())
+        stale = [k for k in self.bboxes if k not in live]
+        for k in stale:
+            del self.bboxes[k]
+        return len(stale)
+
+    def save(self) -> None:
+        """Prune and write the cache back to disk."""
+        evicted = self.prune()
+        print(f"bbox cache: {self.hits} hits, {self.misses} misses, {evicted} evicted")
+        save_json(self.path, {"format": CACHE_FORMAT, "files": self.files, "bboxes": self.bboxes})
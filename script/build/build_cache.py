@@ -0,0 +1,66 @@
+"""
+Location and helpers for the on-disk build cache.
+
+The cache lives outside the build output directory (which build.sh wipes on
+every run), by default in ./.cache relative to the git repository root dir.
+Set XCSOAR_CACHE_DIR to move it, or to an empty string to disable caching.
+"""
+
+import json
+import os
+from pathlib import Path
+import tempfile
+from typing import Any, Optional
+
+CACHE_DIR_ENV = "XCSOAR_CACHE_DIR"
+DEFAULT_CACHE_DIR = Path(".cache")
+
+
+def cache_dir() -> Optional[Path]:
+    """Return the cache directory (created if needed), or None if caching is disabled."""
+    value = os.environ.get(CACHE_DIR_ENV)
+    if value is None:
+        path = DEFAULT_CACHE_DIR
+    elif not value:
+        return None
+    else:
+        path = Path(value)
+    try:
+        path.mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        print(f"Warning: Could not create cache directory {path}: {e}")
+        return None
+    return path
+
+
+def cache_file(name: str) -> Optional[Path]:
+    """Return the path of cache file name, or None if caching is disabled."""
+    directory = cache_dir()
+    if directory is None:
+        return None
+    return directory / name
+
+
+def load_json(path: Optional[Path], default: Any = None) -> Any:
+    """Return the JSON content of path, or default if it is missing or unreadable."""
+    if path is None or not path.exists():
+        return default
+    try:
+        with path.open(encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Ignoring unreadable cache file {path}: {e}")
+        return default
+
+
+def save_json(path: Optional[Path], data: Any) -> None:
+    """Atomically write data as compact JSON to path (no-op if path is None)."""
+    if path is None:
+        return
+    try:
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"), sort_keys=True)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Warning: Could not write cache file {path}: {e}")
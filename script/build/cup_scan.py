@@ -0,0 +1,155 @@
+#!/bin/env python3
+"""
+Fast coordinate scanner for SeeYou .cup waypoint files.
+
+Decodes only the lat/lon columns (with aerofiles' DDMM.mmm semantics) and
+keeps running min/max/mean/count, without building a waypoint dict per row.
+
+Verify that it agrees with aerofiles on every .cup file below some dirs
+(files aerofiles cannot read are reported as skipped):
+
+    ./script/build/cup_scan.py data/content/waypoint/
+"""
+
+import csv
+from pathlib import Path
+import re
+import sys
+from typing import Iterable, Optional, TextIO, Union
+
+from aerofiles.errors import ParserError
+from aerofiles.seeyou.common import SeeYouFileFormat
+from aerofiles.seeyou.reader import Reader as CupReader
+
+# Same patterns as aerofiles.seeyou.reader
+RE_LATITUDE = re.compile(r'^([\d]{2})([\d]{2}\.[\d]{3})([NS])$', re.I)
+RE_LONGITUDE = re.compile(r'^([\d]{3})([\d]{2}\.[\d]{3})([EW])$', re.I)
+
+TASK_SECTION = ["-----Related Tasks-----"]
+
+
+def decode_latitude(latitude: str) -> float:
+    """Decode a DDMM.mmm[NS] latitude exactly like aerofiles."""
+    match = RE_LATITUDE.match(latitude)
+    if not match:
+        raise ParserError('Reading latitude failed')
+    value = int(match.group(1)) + float(match.group(2)) / 60.
+    if not (0 <= value <= 90):
+        raise ParserError('Latitude out of bounds')
+    if match.group(3).upper() == 'S':
+        value = -value
+    return value
+
+
+def decode_longitude(longitude: str) -> float:
+    """Decode a DDDMM.mmm[EW] longitude exactly like aerofiles."""
+    match = RE_LONGITUDE.match(longitude)
+    if not match:
+        raise ParserError('Reading longitude failed')
+    value = int(match.group(1)) + float(match.group(2)) / 60.
+    if not (0 <= value <= 180):
+        raise ParserError('Longitude out of bounds')
+    if match.group(3).upper() == 'W':
+        value = -value
+    return value
+
+
+class CoordStats:
+    """Running count, min/max and sum of waypoint coordinates."""
+
+    def __init__(self):
+        self.count = 0
+        self.min_lat = self.min_lon = float("inf")
+        self.max_lat = self.max_lon = float("-inf")
+        self.sum_lat = self.sum_lon = 0.0
+
+    def add(self, lat: float, lon: float) -> None:
+        self.count += 1
+        self.sum_lat += lat
+        self.sum_lon += lon
+        if lat < self.min_lat:
+            self.min_lat = lat
+        if lat > self.max_lat:
+            self.max_lat = lat
+        if lon < self.min_lon:
+            self.min_lon = lon
+        if lon > self.max_lon:
+            self.max_lon = lon
+
+    def add_fields(self, fields: list, columns: dict) -> None:
+        """Add a waypoint row; columns maps header names to field indexes."""
+        self.add(decode_latitude(fields[columns["lat"]].strip()),
+                 decode_longitude(fields[columns["lon"]].strip()))
+
+    def mean(self) -> tuple:
+        """Return the (latitude, longitude) mean."""
+        return self.sum_lat / self.count, self.sum_lon / self.count
+
+    def bbox(self) -> Optional[str]:
+        """Return 'min_lon,min_lat,max_lon,max_lat', or None if empty."""
+        if not self.count:
+            return None
+        return f"{self.min_lon},{self.min_lat},{self.max_lon},{self.max_lat}"
+
+
+def scan_rows(rows: Iterable[list], stats: Optional[CoordStats] = None) -> CoordStats:
+    """Add the waypoint rows of a .cup file (as csv rows) to stats.
+
+    Rows are skipped like aerofiles does (header, empty and '*' comment rows);
+    scanning stops at the task section.
+    """
+    if stats is None:
+        stats = CoordStats()
+    columns = {name: i for i, name in enumerate(SeeYouFileFormat.HEADER_11)}
+    for fields in rows:
+        if fields == TASK_SECTION:
+            break
+        if all(f in fields for f in SeeYouFileFormat.HEADER_11):
+            columns = {name: fields.index(name) for name in fields}
+            continue
+        if not fields or fields[0].startswith("*"):
+            continue
+        stats.add_fields(fields, columns)
+    return stats
+
+
+def scan_cup(cup_file: Union[Path, TextIO]) -> CoordStats:
+    """Return the CoordStats of a .cup file (path or open text file)."""
+    if isinstance(cup_file, Path):
+        with open(cup_file, encoding="utf-8", newline="") as fp:
+            return scan_rows(csv.reader(fp))
+    return scan_rows(csv.reader(cup_file))
+
+
+def verify_file(cup_file: Path) -> Optional[bool]:
+    """Return True if scan_cup() agrees with aerofiles on cup_file, None if aerofiles fails."""
+    try:
+        with open(cup_file, encoding="utf-8") as fp:
+            waypoints = CupReader().read(fp)["waypoints"]
+    except (ValueError, IndexError, ParserError) as e:
+        print(f"Skipped (aerofiles: {e}): {cup_file}")
+        return None
+
+    expected = CoordStats()
+    for wp in waypoints:
+        expected.add(wp["latitude"], wp["longitude"])
+    stats = scan_cup(cup_file)
+
+    fields = ("count", "min_lat", "max_lat", "min_lon", "max_lon", "sum_lat", "sum_lon")
+    mismatches = [f for f in fields if getattr(stats, f) != getattr(expected, f)]
+    if mismatches:
+        print(f"MISMATCH {', '.join(mismatches)}: {cup_file}")
+        return False
+    print(f"Match ({stats.count} waypoints): {cup_file}")
+    return True
+
+
+if __name__ == "__main__":
+    results = []
+    for arg in sys.argv[1:]:
+        path = Path(arg)
+        for p in sorted(path.rglob("*.cup")) if path.is_dir() else [path]:
+            results.append(verify_file(p))
+    print(f"{len(results)} files: {results.count(True)} match, {results.count(False)} mismatch, "
+          f"{results.count(None)} skipped")
+    sys.exit(0 if False not in results else 1)
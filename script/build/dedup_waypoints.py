@@ -0,0 +1,318 @@
+#!/bin/env python3
+"""
+Find near-duplicate waypoints across .cup sources (e.g. the national files
+and the generated *-WPT-National-OpenAIP.cup files):
+
+    ./script/build/dedup_waypoints.py data/content/waypoint/country/ output/content/waypoint/country/ \\
+        --report dedup_report.json --output xcsoar_waypoints_dedup.cup
+
+Two waypoints are duplicates when they lie within --distance metres of each
+other and their codes match or their names are similar.  Candidates are found
+with a spatial hash grid of cells about --distance wide, so each waypoint is
+only compared with its neighbours: the run time is roughly linear in the
+number of waypoints.  Duplicates are grouped transitively, but unless
+--same-source a group never holds two waypoints of one file: distinct
+waypoints of a file are not merged through a common match in another one.  Of
+each group the waypoint of the earliest source (in command line order) is
+kept.
+"""
+
+import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import csv
+from difflib import SequenceMatcher
+import io
+import json
+import math
+import os
+from pathlib import Path
+import re
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from aerofiles.errors import ParserError
+from aerofiles.seeyou.common import SeeYouFileFormat
+from aerofiles.seeyou.reader import Reader as CupReader
+
+from merge_waypoints import CUP_HEADER, sort_key
+
+TASK_SECTION = ["-----Related Tasks-----"]
+
+# Mean earth radius in metres
+EARTH_RADIUS = 6371000.0
+# Metres per degree of latitude
+M_PER_DEG = math.pi * EARTH_RADIUS / 180
+
+# Metres per foot
+FT = 0.3048
+
+RE_NOT_ALNUM = re.compile(r"[\W_]+")
+
+
+class Waypoint(NamedTuple):
+    """A waypoint with the .cup line it came from (in the standard column layout)."""
+
+    source: int
+    name: str
+    code: str
+    latitude: float
+    longitude: float
+    line: str
+    # Metres, None if unknown
+    elevation: Optional[float] = None
+    style: int = 0
+
+
+def csv_rows(fp) -> Iterator[Tuple[list, str]]:
+    """Yield (fields, raw text) of each csv row of fp; rows may span several lines."""
+    consumed = []
+
+    def lines():
+        for line in fp:
+            consumed.append(line)
+            yield line
+
+    for fields in csv.reader(lines()):
+        text = "".join(consumed)
+        consumed.clear()
+        yield fields, text
+
+
+def standard_line(fields: list, headers: list) -> str:
+    """Return fields (laid out as headers) as a .cup line with the standard columns."""
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerow([fields[headers.index(name)] for name in SeeYouFileFormat.HEADER_11])
+    return out.getvalue()
+
+
+def decode_rows(path: Path) -> Iterator[Tuple[dict, list, str, list]]:
+    """Yield (aerofiles waypoint dict, fields, raw text, headers) of each waypoint row of .cup file path.
+
+    Rows aerofiles rejects are reported and skipped.
+    """
+    reader = CupReader()
+    with open(path, encoding="utf-8-sig", newline="") as fp:
+        for fields, text in csv_rows(fp):
+            if fields == TASK_SECTION:
+                break
+            try:
+                wp = reader.decode_waypoint(fields)
+            except (ParserError, ValueError, IndexError) as e:
+                print(f"Warning: skipped row of {path} ({e}): {text.strip()}")
+                continue
+            if wp is not None:
+                yield wp, fields, text, reader.headers
+
+
+def elevation_m(wp: dict) -> Optional[float]:
+    """Return the elevation of an aerofiles waypoint in metres, None if unknown."""
+    elevation = wp["elevation"]["value"]
+    if elevation is not None and (wp["elevation"]["unit"] or "").lower() == "ft":
+        elevation *= FT
+    return elevation
+
+
+def read_waypoints(path: Path, source: int) -> List[Waypoint]:
+    """Return the waypoints of .cup file path, parsed row by row with aerofiles."""
+    waypoints = []
+    for wp, fields, text, headers in decode_rows(path):
+        if headers == SeeYouFileFormat.HEADER_11:
+            line = text.rstrip("\r\n") + "\n"
+        else:
+            line = standard_line(fields, headers)
+        waypoints.append(Waypoint(
+            source, wp["name"], wp["code"] or "", wp["latitude"], wp["longitude"], line,
+            elevation_m(wp), wp["style"],
+        ))
+    return waypoints
+
+
+def distance(a: Waypoint, b: Waypoint) -> float:
+    """Return the great circle distance between a and b in metres."""
+    lat1, lat2 = math.radians(a.latitude), math.radians(b.latitude)
+    dlat = lat2 - lat1
+    dlon = math.radians(b.longitude - a.longitude)
+    h = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+
+def normalize_name(name: str) -> str:
+    """Return name reduced to lower case letters and digits."""
+    return RE_NOT_ALNUM.sub("", name.casefold())
+
+
+def similar(a: Waypoint, b: Waypoint, name_ratio: float) -> bool:
+    """Return True if a and b have the same code or similar names."""
+    if a.code and a.code.casefold() == b.code.casefold():
+        return True
+    name_a, name_b = normalize_name(a.name), normalize_name(b.name)
+    if not name_a or not name_b:
+        return False
+    if name_a in name_b or name_b in name_a:
+        return True
+    return SequenceMatcher(None, name_a, name_b).ratio() >= name_ratio
+
+
+class SpatialGrid:
+    """Hash grid of waypoints in cells of cell_m metres of latitude.
+
+    Columns wrap around at the antimeridian.
+    """
+
+    def __init__(self, cell_m: float):
+        self.cell = cell_m / M_PER_DEG
+        self.columns = math.ceil(360 / self.cell)
+        self.cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+
+    def key(self, wp: Waypoint) -> Tuple[int, int]:
+        return math.floor(wp.latitude / self.cell), math.floor((wp.longitude + 180) / self.cell) % self.columns
+
+    def add(self, index: int, wp: Waypoint) -> None:
+        self.cells[self.key(wp)].append(index)
+
+    def neighbours(self, wp: Waypoint) -> Iterator[int]:
+        """Yield the indexes of the waypoints in the cells within cell_m of wp."""
+        row, col = self.key(wp)
+        # A degree of longitude shrinks with cos(latitude): look further east/west.
+        coslat = max(math.cos(math.radians(abs(wp.latitude) + self.cell)), 1e-3)
+        reach = math.ceil(1 / coslat)
+        columns = {c % self.columns for c in range(col - reach, col + reach + 1)}
+        for r in (row - 1, row, row + 1):
+            for c in columns:
+                yield from self.cells.get((r, c), ())
+
+
+def find_duplicates(
+    waypoints: List[Waypoint],
+    max_distance: float,
+    name_ratio: float,
+    same_source: bool = False,
+) -> List[List[int]]:
+    """Return the groups (lists of indexes, sorted) of near-duplicate waypoints.
+
+    Unless same_source, groups that have a source in common are not joined.
+    """
+    grid = SpatialGrid(max_distance)
+    parent = list(range(len(waypoints)))
+    # root -> sources of its group
+    sources = {i: {wp.source} for i, wp in enumerate(waypoints)}
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, wp in enumerate(waypoints):
+        for j in grid.neighbours(wp):
+            other = waypoints[j]
+            if not same_source and other.source == wp.source:
+                continue
+            if distance(wp, other) <= max_distance and similar(wp, other, name_ratio):
+                root_i, root_j = find(i), find(j)
+                if root_i == root_j or not (same_source or sources[root_i].isdisjoint(sources[root_j])):
+                    continue
+                root, child = min(root_i, root_j), max(root_i, root_j)
+                parent[child] = root
+                sources[root] |= sources.pop(child)
+        grid.add(i, wp)
+
+    groups = defaultdict(list)
+    for i in range(len(waypoints)):
+        groups[find(i)].append(i)
+    return [g for g in groups.values() if len(g) > 1]
+
+
+def load_sources(sources: List[Path], jobs: int = 1) -> Tuple[List[Path], List[Waypoint]]:
+    """Return the .cup files given by sources (files or directories) and all their waypoints."""
+    paths = []
+    for source in sources:
+        paths.extend(sorted(source.rglob("*.cup")) if source.is_dir() else [source])
+    if jobs > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(read_waypoints, paths, range(len(paths))))
+    else:
+        results = [read_waypoints(p, i) for i, p in enumerate(paths)]
+    return paths, [wp for waypoints in results for wp in waypoints]
+
+
+def gen_report(paths: List[Path], waypoints: List[Waypoint], groups: List[List[int]], out_path: Path) -> None:
+    """Write the duplicate groups as JSON; the first waypoint of each group is the one kept."""
+
+    def describe(i: int) -> dict:
+        wp = waypoints[i]
+        return {
+            "file": str(paths[wp.source]),
+            "name": wp.name,
+            "code": wp.code,
+            "lat": wp.latitude,
+            "lon": wp.longitude,
+        }
+
+    report = {
+        "files": len(paths),
+        "waypoints": len(waypoints),
+        "duplicates": sum(len(g) - 1 for g in groups),
+        "groups": [
+            {
+                "keep": describe(g[0]),
+                "drop": [dict(describe(i), distance=round(distance(waypoints[g[0]], waypoints[i]), 1))
+                         for i in g[1:]],
+            }
+            for g in groups
+        ],
+    }
+    with open(out_path, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Created: {out_path}")
+
+
+def gen_dedup_cup(waypoints: List[Waypoint], groups: List[List[int]], out_path: Path) -> None:
+    """Write the waypoints without the dropped duplicates, sorted like xcsoar_waypoints.cup."""
+    dropped = {i for g in groups for i in g[1:]}
+    lines = sorted(
+        (wp.line.encode() for i, wp in enumerate(waypoints) if i not in dropped),
+        key=lambda line: sort_key(line[:-1]),
+    )
+    with open(out_path, "wb") as f:
+        f.write(CUP_HEADER + b"\n")
+        previous = None
+        for line in lines:
+            key = sort_key(line[:-1])
+            if key != previous:
+                f.write(line)
+                previous = key
+    print(f"Created: {out_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find near-duplicate waypoints across .cup files.")
+    parser.add_argument(
+        "sources", type=Path, nargs="+",
+        help=".cup files or directories; of duplicates, the earliest source wins",
+    )
+    parser.add_argument("--distance", type=float, default=500.0, help="Maximum distance in metres (default: 500)")
+    parser.add_argument(
+        "--name-ratio", type=float, default=0.8,
+        help="Minimum name similarity (0..1) of waypoints without matching codes (default: 0.8)",
+    )
+    parser.add_argument(
+        "--same-source", action="store_true",
+        help="Also look for duplicates within a single file",
+    )
+    parser.add_argument("--report", type=Path, help="Write the duplicate groups to this JSON file")
+    parser.add_argument("--output", type=Path, help="Write the deduplicated waypoints to this .cup file")
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=os.cpu_count() or 1,
+        help="Worker processes for parsing (default: CPU count, 1: serial)",
+    )
+    args = parser.parse_args()
+
+    paths, waypoints = load_sources(args.sources, args.jobs)
+    groups = find_duplicates(waypoints, args.distance, args.name_ratio, args.same_source)
+    print(f"{len(waypoints)} waypoints in {len(paths)} files: "
+          f"{sum(len(g) - 1 for g in groups)} duplicates in {len(groups)} groups")
+    if args.report:
+        gen_report(paths, waypoints, groups, args.report)
+    if args.output:
+        gen_dedup_cup(waypoints, groups, args.output)
@@ -0,0 +1,138 @@
+#!/bin/env python3
+"""
+Compute what a deploy has to transfer, from content hashes:
+
+    ./script/build/deploy_manifest.py output/ --previous deployed-SHA256SUMS \\
+        --upload-list upload.txt --delete-list delete.txt
+
+The deployed files of the build output directory (DEPLOY_PATHS) are hashed in
+parallel and compared with the manifest of the previous deploy.  Files that
+are new or changed go to the upload list, files that are gone to the delete
+list (both relative paths, one per line, for rsync --files-from).  The new
+manifest is written to output/SHA256SUMS, in `sha256sum -c` format; upload it
+after the files.
+
+Files below KEEP_PREFIXES are only ever added: maps are built only when they
+change, so a map missing from the build output stays deployed (and in the
+manifest).
+
+To try it without a server, let a local directory stand in for the remote
+host; --apply copies and deletes the files and the manifest there:
+
+    ./script/build/deploy_manifest.py output/ --remote-dir /tmp/remote --apply
+"""
+
+import argparse
+from pathlib import Path
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from file_hash import FileHashCache
+from http_pool import TIMEOUT
+
+MANIFEST = "SHA256SUMS"
+
+# Files and directories of the output directory that are deployed
+DEPLOY_PATHS = ("repository", "repository.gz", "repository.zst", "xcsoar.sqlite", "content", "source")
+
+# Deployed files below these are never deleted
+KEEP_PREFIXES = ("source/",)
+
+Manifest = Dict[str, str]
+
+
+def parse_manifest(text: str) -> Manifest:
+    """Return {relative path: sha256} of a SHA256SUMS text."""
+    rv = {}
+    for line in text.splitlines():
+        digest, sep, path = line.partition("  ")
+        if sep and len(digest) == 64:
+            rv[path] = digest
+    return rv
+
+
+def format_manifest(manifest: Manifest) -> str:
+    return "".join(f"{manifest[path]}  {path}\n" for path in sorted(manifest))
+
+
+def load_previous(path: Optional[Path] = None, url: Optional[str] = None) -> Manifest:
+    """Return the manifest at path or url; an empty one if there is none yet."""
+    if path is not None:
+        return parse_manifest(path.read_text(encoding="utf-8")) if path.exists() else {}
+    if url is not None:
+        response = requests.get(url, timeout=TIMEOUT)
+        if response.status_code == 404:
+            return {}
+        response.raise_for_status()
+        return parse_manifest(response.text)
+    return {}
+
+
+def build_manifest(out_dir: Path, hashes: FileHashCache) -> Manifest:
+    """Return the manifest of the deployed files of out_dir."""
+    paths = []
+    for name in DEPLOY_PATHS:
+        path = out_dir / name
+        if path.is_file():
+            paths.append(path)
+        elif path.is_dir():
+            paths.extend(sorted(p for p in path.rglob("*") if p.is_file()))
+    return {p.relative_to(out_dir).as_posix(): sha256 for p, (_, sha256) in hashes.digests(paths).items()}
+
+
+def diff_manifests(previous: Manifest, current: Manifest) -> Tuple[List[str], List[str], Manifest]:
+    """Return (upload list, delete list, new manifest) to go from previous to current."""
+    upload = sorted(path for path, digest in current.items() if previous.get(path) != digest)
+    kept = {path: digest for path, digest in previous.items()
+            if path not in current and path.startswith(KEEP_PREFIXES)}
+    delete = sorted(path for path in previous if path not in current and path not in kept)
+    return upload, delete, {**kept, **current}
+
+
+def apply_local(out_dir: Path, remote_dir: Path, upload: List[str], delete: List[str]) -> None:
+    """Perform a deploy to the local directory remote_dir."""
+    for path in upload + [MANIFEST]:
+        target = remote_dir / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(out_dir / path, target)
+    for path in delete:
+        (remote_dir / path).unlink(missing_ok=True)
+
+
+def write_list(path: Optional[Path], paths: List[str]) -> None:
+    if path is not None:
+        path.write_text("".join(p + "\n" for p in paths), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute the upload/delete lists and manifest of a deploy.")
+    parser.add_argument("out_dir", type=Path, help="Build output directory")
+    previous_group = parser.add_mutually_exclusive_group()
+    previous_group.add_argument("--previous", type=Path, help="Manifest of the deployed files (missing: first deploy)")
+    previous_group.add_argument("--previous-url", help="URL of the manifest of the deployed files")
+    previous_group.add_argument("--remote-dir", type=Path, help="Local directory standing in for the deploy target")
+    parser.add_argument("--upload-list", type=Path, help="Write the paths to upload to this file")
+    parser.add_argument("--delete-list", type=Path, help="Write the paths to delete to this file")
+    parser.add_argument("--apply", action="store_true", help="Deploy to --remote-dir")
+    args = parser.parse_args()
+    if args.apply and args.remote_dir is None:
+        parser.error("--apply requires --remote-dir")
+
+    previous_path = args.remote_dir / MANIFEST if args.remote_dir else args.previous
+    previous = load_previous(previous_path, args.previous_url)
+    hashes = FileHashCache.load()
+    current = build_manifest(args.out_dir, hashes)
+    hashes.save()
+
+    upload, delete, manifest = diff_manifests(previous, current)
+    (args.out_dir / MANIFEST).write_text(format_manifest(manifest), encoding="utf-8")
+    write_list(args.upload_list, upload)
+    write_list(args.delete_list, delete)
+    print(f"{len(current)} files: {len(upload)} to upload, {len(delete)} to delete, "
+          f"{len(current) - len(upload)} unchanged")
+
+    if args.apply:
+        apply_local(args.out_dir, args.remote_dir, upload, delete)
+        print(f"Deployed to {args.remote_dir}")
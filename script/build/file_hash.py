@@ -0,0 +1,82 @@
+"""
+Sizes and SHA-256 digests of build files, cached between runs.
+
+Files are hashed from memory-mapped reads by a thread pool (hashlib releases
+the GIL while hashing large buffers).  Digests are cached in the build cache
+by path, mtime and size, so unchanged files are not read again.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import mmap
+import os
+from pathlib import Path
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from build_cache import cache_file, load_json, save_json
+
+CACHE_FORMAT = 1
+
+# Threads hashing files (I/O bound, the GIL is released while hashing)
+HASH_JOBS = min(32, (os.cpu_count() or 1) * 2)
+
+
+def mmap_sha256(path: Path) -> str:
+    """Return the hex SHA-256 digest of path's content, read through mmap."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return hashlib.sha256(m).hexdigest()
+
+
+class FileHashCache:
+    """(size, sha256) of files, keyed by path and validated by mtime and size."""
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        data = load_json(path, {})
+        if data.get("format") != CACHE_FORMAT:
+            data = {}
+        # path -> [mtime_ns, size, sha256]
+        self.files = data.get("files", {})
+        self.hits = 0
+        self.misses = 0
+        # digest() runs in pool threads
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls) -> "FileHashCache":
+        """Return the cache stored in the build cache directory."""
+        return cls(cache_file("file-hashes.json"))
+
+    def digest(self, path: Path) -> Tuple[int, str]:
+        """Return (size, sha256) of path, hashing it only if it changed."""
+        stat = path.stat()
+        key = str(path)
+        cached = self.files.get(key)
+        if cached and cached[:2] == [stat.st_mtime_ns, stat.st_size]:
+            with self.lock:
+                self.hits += 1
+            return stat.st_size, cached[2]
+        sha256 = mmap_sha256(path)
+        with self.lock:
+            self.misses += 1
+            self.files[key] = [stat.st_mtime_ns, stat.st_size, sha256]
+        return stat.st_size, sha256
+
+    def digests(self, paths: Iterable[Path], jobs: int = HASH_JOBS) -> Dict[Path, Tuple[int, str]]:
+        """Return {path: (size, sha256)} of paths, hashed by up to jobs threads."""
+        paths = list(paths)
+        if jobs <= 1 or len(paths) <= 1:
+            return {p: self.digest(p) for p in paths}
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            return dict(zip(paths, pool.map(self.digest, paths)))
+
+    def save(self) -> None:
+        """Drop entries of missing files and write the cache back to disk."""
+        for key in [k for k in self.files if not Path(k).exists()]:
+            del self.files[key]
+        print(f"file hash cache: {self.hits} hits, {self.misses} misses")
+        save_json(self.path, {"format": CACHE_FORMAT, "files": self.files})
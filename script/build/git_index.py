@@ -0,0 +1,118 @@
+"""
+Index of the last git commit time of every file in the repository.
+
+A single `git log --name-only` pass over the history replaces one `git log -1`
+subprocess per file.  The resulting path -> timestamp map is cached on disk,
+keyed by the HEAD commit, so repeated builds of the same commit skip git
+entirely.
+"""
+
+import datetime
+from pathlib import Path
+import subprocess
+from typing import Dict, Optional
+
+from build_cache import cache_file, load_json, save_json
+
+# Marks a commit line in the `git log` output; paths never contain NUL.
+_COMMIT_FORMAT = "%x00%ct"
+_COMMIT_MARKER = "\0"
+
+
+def _git(*args: str, cwd: Optional[Path] = None) -> Optional[str]:
+    """Return stdout of a git command, or None if it failed."""
+    try:
+        p = subprocess.run(
+            ["git", "-c", "core.quotePath=false", *args],
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            encoding="utf-8",
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return p.stdout
+
+
+class GitCommitIndex:
+    """Map repository paths to the unix timestamp of their last commit."""
+
+    def __init__(self, toplevel: Optional[Path], timestamps: Dict[str, int]):
+        self.toplevel = toplevel
+        self.timestamps = timestamps
+
+    @classmethod
+    def build(cls, use_cache: bool = True) -> "GitCommitIndex":
+        """Walk the git history once (or load the cached index for HEAD)."""
+        toplevel = _git("rev-parse", "--show-toplevel")
+        head = _git("rev-parse", "HEAD")
+        if toplevel is None or head is None:
+            print("Warning: Not a git repository, using current time for all files")
+            return cls(None, {})
+        toplevel_path = Path(toplevel.strip()).resolve()
+        head = head.strip()
+
+        path = cache_file("git-index.json") if use_cache else None
+        cached = load_json(path, {})
+        if cached.get("head") == head:
+            return cls(toplevel_path, cached["timestamps"])
+
+        timestamps = cls._walk_history(toplevel_path)
+        save_json(path, {"head": head, "timestamps": timestamps})
+        return cls(toplevel_path, timestamps)
+
+    @staticmethod
+    def _walk_history(toplevel: Path) -> Dict[str, int]:
+        """Return {path: timestamp} of each path's newest commit."""
+        out = _git("log", "--name-only", f"--format={_COMMIT_FORMAT}", cwd=toplevel)
+        timestamps = {}
+        timestamp = 0
+        for line in (out or "").splitlines():
+            if line.startswith(_COMMIT_MARKER):
+                timestamp = int(line[1:])
+            elif line:
+                # git log is newest first: keep the first timestamp seen.
+                timestamps.setdefault(line, timestamp)
+        return timestamps
+
+    def timestamp(self, filename: Path) -> Optional[int]:
+        """Return the unix timestamp of filename's last commit, or None if untracked."""
+        if self.toplevel is None:
+            return None
+        try:
+            rel = Path(filename).resolve().relative_to(self.toplevel)
+        except ValueError:
+            return None
+        return self.timestamps.get(rel.as_posix())
+
+    def commit_datetime(self, filename: Path) -> datetime.datetime:
+        """Return naive UTC datetime of filename's last git commit (now if untracked)."""
+        timestamp = self.timestamp(filename)
+        if timestamp is None:
+            dt = datetime.datetime.now(datetime.UTC)
+        else:
+            dt = datetime.datetime.fromtimestamp(timestamp, datetime.UTC)
+        return dt.replace(tzinfo=None)
+
+
+_index: Optional[GitCommitIndex] = None
+
+
+def get_index() -> GitCommitIndex:
+    """Return the process-wide index, building it on first use."""
+    global _index
+    if _index is None:
+        _index = GitCommitIndex.build()
+    return _index
+
+
+def set_index(index: GitCommitIndex) -> None:
+    """Use index as the process-wide index (e.g. one built by a parent process)."""
+    global _index
+    _index = index
+
+
+def git_commit_datetime(filename: Path) -> datetime.datetime:
+    """Return naive UTC datetime of filename's last git commit."""
+    return get_index().commit_datetime(filename)
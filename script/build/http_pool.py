@@ -0,0 +1,45 @@
+"""
+Pooled HTTP session and bounded concurrent fetching for the build scripts.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeout in seconds for every request
+TIMEOUT = (10, 60)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def make_session(pool_size: int = 16, retries: int = 3, backoff: float = 0.5) -> requests.Session:
+    """Return a session with pool_size keep-alive connections per host.
+
+    Connection errors and 429/5xx responses of GET/HEAD requests are retried
+    up to retries times, with exponential backoff (backoff, 2 * backoff, ...).
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET", "HEAD"),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def map_ordered(func: Callable[[T], R], items: Iterable[T], jobs: int) -> Iterator[R]:
+    """Yield func(item) for each item, run by up to jobs threads, in the order of items."""
+    if jobs <= 1:
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(func, items)
@@ -1,21 +1,13 @@
 #!/bin/env python3
 """Auto-generate https://github.com/XCSoar/xcsoar-data-repository/blob/master/data/maps.json."""
 
-import datetime
 import json
 from pathlib import Path
-import subprocess
 import sys
 
 from iso3166 import countries
 
-
-def git_commit_datetime(filename: Path) -> datetime.datetime:
-    """Return naive UTC datetime of filename's last git commit."""
-    cmd = ["git", "log", "-1", "--format=%ct", "--", filename]
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    out, _ = p.communicate()
-    return datetime.datetime.utcfromtimestamp(int(out))
+from git_index import git_commit_datetime
 
 
 def guess_area(name: str) -> str:
@@ -0,0 +1,113 @@
+#!/bin/env python3
+"""
+Merge the country .cup files into the global xcsoar_waypoints.cup:
+
+    ./script/build/merge_waypoints.py data/content/waypoint/country/ output/content/waypoint/global/xcsoar_waypoints.cup
+
+Every file is read once, its line endings normalised (like dos2unix) and its
+header lines dropped, then sorted into a run file by a worker process.  The
+sorted runs are combined with a streaming k-way merge that drops duplicate
+lines, so memory is bounded by the largest input file, not by their total.
+
+The result is byte-identical to `sort -bu` over the concatenated files in
+the C / C.UTF-8 locale: lines are ordered by their bytes, ignoring leading
+blanks, and of lines comparing equal only the first one is kept.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import os
+from pathlib import Path
+import tempfile
+from typing import Iterator, List, Tuple
+
+CUP_HEADER = b"name,code,country,lat,lon,elev,style,rwdir,rwlen,freq,desc"
+BOM = b"\xef\xbb\xbf"
+
+
+def sort_key(line: bytes) -> bytes:
+    """Return the `sort -b` key of line (without its newline): leading blanks stripped."""
+    return line.lstrip(b" \t")
+
+
+def read_lines(path: Path) -> List[bytes]:
+    """Return path's lines without newlines, CRLF normalised and header lines dropped."""
+    data = path.read_bytes()
+    if data.startswith(BOM):
+        data = data[len(BOM):]
+    data = data.replace(b"\r\n", b"\n")
+    if data.endswith(b"\n"):
+        data = data[:-1]
+    if not data:
+        return []
+    return [line for line in data.split(b"\n") if CUP_HEADER not in line]
+
+
+def sort_run(path: Path, run_path: Path) -> int:
+    """Write path's sorted, deduplicated lines to run_path; return their count."""
+    lines = sorted(read_lines(path), key=sort_key)
+    count = 0
+    with open(run_path, "wb") as f:
+        previous = None
+        for line in lines:
+            key = sort_key(line)
+            if key != previous:
+                f.write(line + b"\n")
+                previous = key
+                count += 1
+    return count
+
+
+def read_run(run_path: Path) -> Iterator[Tuple[bytes, bytes]]:
+    """Yield (key, line) of a run file, line including its newline."""
+    with open(run_path, "rb") as f:
+        for line in f:
+            yield sort_key(line[:-1]), line
+
+
+def merge_runs(run_paths: List[Path], out) -> int:
+    """Merge the sorted runs into the binary file out, dropping duplicates; return the line count.
+
+    Of equal lines the one from the earliest run wins, as with `sort -u`.
+    """
+    count = 0
+    previous = None
+    for key, line in heapq.merge(*(read_run(p) for p in run_paths), key=lambda item: item[0]):
+        if key != previous:
+            out.write(line)
+            previous = key
+            count += 1
+    return count
+
+
+def merge_waypoints(in_dir: Path, out_path: Path, jobs: int = 1) -> int:
+    """Merge the .cup files below in_dir into out_path; return the waypoint line count."""
+    paths = sorted(in_dir.rglob("*.cup"))
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="merge-waypoints-") as tmp:
+        run_paths = [Path(tmp) / f"{i}.run" for i in range(len(paths))]
+        if jobs > 1 and len(paths) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                list(pool.map(sort_run, paths, run_paths))
+        else:
+            for p, run_path in zip(paths, run_paths):
+                sort_run(p, run_path)
+
+        with open(out_path, "wb") as out:
+            out.write(CUP_HEADER + b"\n")
+            count = merge_runs(run_paths, out)
+    print(f"Created: {out_path} ({count} lines from {len(paths)} files)")
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge .cup files into one sorted, deduplicated .cup file.")
+    parser.add_argument("wp_dir", type=Path, help="Directory of the .cup files (searched recursively)")
+    parser.add_argument("output", type=Path, help="Merged .cup file")
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=os.cpu_count() or 1,
+        help="Worker processes (default: CPU count, 1: serial)",
+    )
+    args = parser.parse_args()
+    merge_waypoints(args.wp_dir, args.output, args.jobs)
@@ -0,0 +1,126 @@
+"""
+Client for the OpenAIP Google Cloud Storage bucket listing.
+
+The paginated XML listing is parsed as a stream into typed IndexEntry tuples,
+page by page, while the next page is already being fetched.  A complete
+listing is cached on disk for CACHE_TTL seconds, so all OpenAIP scripts of a
+build share a single fetch.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import time
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from xml.etree.ElementTree import XMLPullParser
+
+import requests
+
+from build_cache import cache_file, load_json, save_json
+from http_pool import TIMEOUT, make_session
+
+OPENAIP_URL = "https://storage.googleapis.com/29f98e10-a489-4c82-ae5e-489dbcd4912f/"
+
+# Seconds a cached listing stays valid (about the duration of a build)
+CACHE_TTL = 3600
+
+
+class IndexEntry(NamedTuple):
+    """One object of the bucket listing."""
+
+    key: str
+    size: int
+    last_modified: str
+    etag: str
+
+
+def _local_name(tag: str) -> str:
+    """Return tag without its XML namespace."""
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_listing(chunks) -> Tuple[List[IndexEntry], Optional[str]]:
+    """Parse one listing page from an iterable of bytes chunks.
+
+    Returns (entries, next_marker); next_marker is None on the last page.
+    """
+    parser = XMLPullParser(events=("end",))
+    entries = []
+    next_marker = None
+
+    def drain():
+        nonlocal next_marker
+        for _, elem in parser.read_events():
+            name = _local_name(elem.tag)
+            if name == "Contents":
+                fields = {_local_name(child.tag): (child.text or "") for child in elem}
+                entries.append(IndexEntry(
+                    key=fields.get("Key", ""),
+                    size=int(fields.get("Size") or 0),
+                    last_modified=fields.get("LastModified", ""),
+                    etag=fields.get("ETag", "").strip('"'),
+                ))
+                elem.clear()
+            elif name == "NextMarker":
+                next_marker = elem.text or None
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        drain()
+    parser.close()
+    drain()
+    return entries, next_marker
+
+
+class OpenAIPIndex:
+    """Iterate over the OpenAIP bucket listing, fetched at most once per CACHE_TTL."""
+
+    def __init__(
+        self,
+        base_url: str = OPENAIP_URL,
+        session: Optional[requests.Session] = None,
+        cache_ttl: float = CACHE_TTL,
+    ):
+        self.base_url = base_url
+        self.session = session or make_session()
+        self.cache_ttl = cache_ttl
+        url_hash = hashlib.sha1(base_url.encode()).hexdigest()[:12]
+        self.cache_path = cache_file(f"openaip-index-{url_hash}.json") if cache_ttl > 0 else None
+
+    def _fetch_page(self, marker: Optional[str]) -> Tuple[List[IndexEntry], Optional[str]]:
+        params = {"marker": marker} if marker else None
+        with self.session.get(self.base_url, params=params, timeout=TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            return parse_listing(response.iter_content(1 << 16))
+
+    def _cached_pages(self) -> Optional[List[List[IndexEntry]]]:
+        cached = load_json(self.cache_path, {})
+        if cached.get("url") != self.base_url or time.time() - cached.get("fetched", 0) > self.cache_ttl:
+            return None
+        return [[IndexEntry(*e) for e in page] for page in cached["pages"]]
+
+    def pages(self) -> Iterator[List[IndexEntry]]:
+        """Yield the entries of each listing page in order."""
+        cached = self._cached_pages()
+        if cached is not None:
+            yield from cached
+            return
+
+        fetched = []
+        with ThreadPoolExecutor(max_workers=1) as prefetch:
+            future = prefetch.submit(self._fetch_page, None)
+            while future is not None:
+                entries, marker = future.result()
+                # Fetch the next page while the caller processes this one.
+                future = prefetch.submit(self._fetch_page, marker) if marker else None
+                fetched.append(entries)
+                yield entries
+
+        save_json(self.cache_path, {"url": self.base_url, "fetched": time.time(), "pages": fetched})
+
+    def __iter__(self) -> Iterator[IndexEntry]:
+        for page in self.pages():
+            yield from page
+
+    def url(self, entry: IndexEntry) -> str:
+        """Return the download URL of entry."""
+        return self.base_url + entry.key
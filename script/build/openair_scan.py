@@ -0,0 +1,213 @@
+#!/bin/env python3
+"""
+Single-pass bounding box scanner for OpenAir airspace files.
+
+Only the geometry and label lines (DP, V X=, V D=, DC, DA, DB, AT) are decoded, with the
+coordinate parser of aerofiles; every other line is skipped without building
+airspace records.  Circles and arcs extend the bbox by their radius (up to
+the extremes the arc actually sweeps), not just their center.
+
+The input may be a file path, the file content, an open (text or binary)
+file, or an iterable of str/bytes chunks such as requests' iter_content().
+
+Verify that its bboxes contain what aerofiles reads from every OpenAir file
+below some dirs (records aerofiles rejects, and files it cannot read at all,
+are reported as skipped):
+
+    ./script/build/openair_scan.py data/content/airspace/
+"""
+
+import codecs
+import math
+from pathlib import Path
+import sys
+from typing import Iterable, List, Optional, Union
+
+from aerofiles.openair import Reader as OpenAirReader
+from aerofiles.openair.reader import coordinate
+
+# Nautical miles per degree of latitude
+NM_PER_DEG = 60.0
+
+Source = Union[Path, str, bytes, Iterable]
+
+
+def _bearing_point(center: list, radius: float, bearing: float) -> tuple:
+    """Return (lat, lon) at radius (NM) and bearing (degrees) from center."""
+    lat, lon = center
+    rad = math.radians(bearing)
+    coslat = max(math.cos(math.radians(lat)), 1e-6)
+    return (lat + radius / NM_PER_DEG * math.cos(rad),
+            lon + radius / (NM_PER_DEG * coslat) * math.sin(rad))
+
+
+def _bearing_distance(center: list, point: list) -> tuple:
+    """Return (bearing in degrees, distance in NM) from center to point."""
+    coslat = math.cos(math.radians(center[0]))
+    dy = (point[0] - center[0]) * NM_PER_DEG
+    dx = (point[1] - center[1]) * NM_PER_DEG * coslat
+    return math.degrees(math.atan2(dx, dy)) % 360, math.hypot(dx, dy)
+
+
+class OpenAirBBox:
+    """Incrementally extend a bbox with OpenAir lines or text chunks."""
+
+    def __init__(self):
+        self.min_lat = self.min_lon = float("inf")
+        self.max_lat = self.max_lon = float("-inf")
+        self.center = None
+        self.clockwise = True
+        self._pending = ""
+
+    def _add(self, lat: float, lon: float) -> None:
+        self.min_lat = min(self.min_lat, lat)
+        self.max_lat = max(self.max_lat, lat)
+        self.min_lon = min(self.min_lon, lon)
+        self.max_lon = max(self.max_lon, lon)
+
+    def _add_arc(self, radius: float, start: float, end: float) -> None:
+        """Add the arc around self.center from bearing start to end."""
+        start %= 360
+        end %= 360
+        # Sweep in increasing bearings: clockwise from start, else from end.
+        first, last = (start, end) if self.clockwise else (end, start)
+        sweep = (last - first) % 360
+        self._add(*_bearing_point(self.center, radius, start))
+        self._add(*_bearing_point(self.center, radius, end))
+        for cardinal in (0, 90, 180, 270):
+            if (cardinal - first) % 360 <= sweep:
+                self._add(*_bearing_point(self.center, radius, cardinal))
+
+    def feed_line(self, line: str) -> None:
+        """Extend the bbox with one OpenAir line (malformed lines are ignored)."""
+        line = line.split("*", 1)[0].strip()
+        if len(line) < 2:
+            return
+        kind, _, value = line.partition(" ")
+        try:
+            if kind in ("DP", "AT"):
+                self._add(*coordinate(value))
+            elif kind == "V":
+                name, _, value = value.partition("=")
+                name, value = name.strip(), value.strip()
+                if name == "X":
+                    # A malformed center must not leave the previous one in place.
+                    self.center = None
+                    self.center = coordinate(value)
+                elif name == "D":
+                    self.clockwise = not value.startswith("-")
+            elif kind == "AC":
+                self.clockwise = True
+            elif kind == "DC" and self.center:
+                radius = float(value)
+                for cardinal in (0, 90, 180, 270):
+                    self._add(*_bearing_point(self.center, radius, cardinal))
+            elif kind == "DA" and self.center:
+                radius, start, end = (float(v) for v in value.split(","))
+                self._add_arc(radius, start, end)
+            elif kind == "DB" and self.center:
+                p1, p2 = (coordinate(v) for v in value.split(","))
+                start, radius = _bearing_distance(self.center, p1)
+                end, _ = _bearing_distance(self.center, p2)
+                self._add(*p1)
+                self._add(*p2)
+                self._add_arc(radius, start, end)
+        except ValueError:
+            pass
+
+    def feed(self, chunk: str) -> None:
+        """Extend the bbox with a text chunk (lines may span chunks)."""
+        lines = (self._pending + chunk).split("\n")
+        self._pending = lines.pop()
+        for line in lines:
+            self.feed_line(line)
+
+    def close(self) -> None:
+        """Process the last, unterminated line."""
+        if self._pending:
+            self.feed_line(self._pending)
+            self._pending = ""
+
+    def bbox(self) -> Optional[str]:
+        """Return 'min_lon,min_lat,max_lon,max_lat', or None if no geometry was seen."""
+        if self.min_lat > self.max_lat:
+            return None
+        return f"{self.min_lon},{self.min_lat},{self.max_lon},{self.max_lat}"
+
+
+def scan_openair(source: Source) -> OpenAirBBox:
+    """Scan an OpenAir path, content string, bytes, file or chunk iterable."""
+    scanner = OpenAirBBox()
+    if isinstance(source, Path):
+        with open(source, "rb") as fp:
+            return scan_openair(fp)
+    if isinstance(source, (str, bytes)):
+        source = [source]
+    elif hasattr(source, "read"):
+        fp = source
+        source = iter(lambda: fp.read(1 << 16), fp.read(0))
+
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    for chunk in source:
+        scanner.feed(decoder.decode(chunk) if isinstance(chunk, bytes) else chunk)
+    scanner.feed(decoder.decode(b"", final=True))
+    scanner.close()
+    return scanner
+
+
+def _record_points(record: dict) -> List[tuple]:
+    """Return the points of an aerofiles record that its bbox must contain."""
+    points = [tuple(label) for label in record.get("labels", [])]
+    for element in record.get("elements", []):
+        if element["type"] == "point":
+            points.append(tuple(element["location"]))
+        elif element["type"] == "circle":
+            points.extend(_bearing_point(element["center"], element["radius"], b) for b in (0, 90, 180, 270))
+        elif element["type"] == "arc" and "radius" in element:
+            points.extend(_bearing_point(element["center"], element["radius"], b)
+                          for b in (element["start"], element["end"]))
+        elif element["type"] == "arc":
+            points.extend((tuple(element["start"]), tuple(element["end"])))
+    return points
+
+
+def verify_file(openair_file: Path) -> Optional[bool]:
+    """Return True if scan_openair()'s bbox contains the geometry aerofiles reads from openair_file.
+
+    None if aerofiles reads no record of it.
+    """
+    points = []
+    records = errors = 0
+    with open(openair_file, encoding="utf-8-sig", errors="replace") as fp:
+        for record, error in OpenAirReader(fp):
+            if error:
+                if not errors:
+                    first_error = error
+                errors += 1
+                continue
+            records += 1
+            points.extend(_record_points(record))
+    if not records:
+        print(f"Skipped (aerofiles: {first_error}): {openair_file}")
+        return None
+
+    scanner = scan_openair(openair_file)
+    outside = [p for p in points if not (scanner.min_lat <= p[0] <= scanner.max_lat
+                                         and scanner.min_lon <= p[1] <= scanner.max_lon)]
+    if outside:
+        print(f"MISMATCH {len(outside)} points outside {scanner.bbox()}, e.g. {outside[0]}: {openair_file}")
+        return False
+    skipped = f", {errors} skipped (aerofiles: {first_error})" if errors else ""
+    print(f"Match ({records} records{skipped}): {openair_file}")
+    return True
+
+
+if __name__ == "__main__":
+    results = []
+    for arg in sys.argv[1:]:
+        path = Path(arg)
+        for p in sorted(path.rglob("*.txt")) if path.is_dir() else [path]:
+            results.append(verify_file(p))
+    print(f"{len(results)} files: {results.count(True)} match, {results.count(False)} mismatch, "
+          f"{results.count(None)} skipped")
+    sys.exit(0 if False not in results else 1)
@@ -0,0 +1,178 @@
+#!/bin/env python3
+"""
+Write precompressed siblings (.gz, and .zst if the zstandard module is
+installed) of the text artefacts in a build output directory:
+
+    ./script/build/precompress.py output/
+
+Web servers can then send them as they are (e.g. nginx gzip_static), instead
+of compressing on the fly or not at all.  Files are compressed in parallel by
+worker processes.  Compressed data is cached by content hash in the build
+cache, so an unchanged file is never compressed twice; cached data of files
+that are not part of the build any more is deleted (unless --keep-cache).  A
+sibling is only written if it is smaller than the file.
+"""
+
+import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import hashlib
+import os
+from pathlib import Path
+import shutil
+from typing import Dict, List, NamedTuple, Optional
+
+from build_cache import cache_dir
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressed suffixes of text artefacts (and "repository", which has none)
+TEXT_SUFFIXES = (".cup", ".txt", ".js", ".json", ".tsk", ".xci", ".xcc")
+
+# Files smaller than this are not worth compressing
+MIN_SIZE = 1024
+
+GZIP_LEVEL = 9
+ZSTD_LEVEL = 19
+
+# (algorithm, sibling suffix, cache key suffix)
+ENCODINGS = [("gzip", ".gz", f"gz{GZIP_LEVEL}")]
+if zstandard is not None:
+    ENCODINGS.append(("zstd", ".zst", f"zst{ZSTD_LEVEL}"))
+
+
+class Result(NamedTuple):
+    """Outcome of precompressing one file."""
+
+    path: Path
+    size: int
+    digest: str
+    # suffix -> compressed size, None if the sibling was not worth writing
+    sizes: Dict[str, Optional[int]]
+    hits: int
+
+
+def compress(algorithm: str, data: bytes) -> bytes:
+    if algorithm == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def is_text_artefact(path: Path, min_size: int) -> bool:
+    return ((path.suffix.lower() in TEXT_SUFFIXES or path.name == "repository")
+            and path.stat().st_size >= min_size)
+
+
+def find_artefacts(out_dir: Path, min_size: int) -> List[Path]:
+    """Return the files of out_dir to precompress."""
+    return sorted(p for p in out_dir.rglob("*") if p.is_file() and is_text_artefact(p, min_size))
+
+
+def precompress_file(path: Path, cache: Optional[Path]) -> Result:
+    """Write the compressed siblings of path, reusing cached data of the same content."""
+    data = path.read_bytes()
+    digest = hashlib.sha256(data).hexdigest()
+    sizes = {}
+    hits = 0
+    for algorithm, suffix, key in ENCODINGS:
+        sibling = path.with_name(path.name + suffix)
+        cached = cache / f"{digest}.{key}" if cache else None
+        if cached is not None and cached.exists():
+            compressed = cached.read_bytes()
+            hits += 1
+        else:
+            compressed = compress(algorithm, data)
+            if cached is not None:
+                tmp = cached.with_name(f"{cached.name}.{os.getpid()}.tmp")
+                tmp.write_bytes(compressed)
+                os.replace(tmp, cached)
+        if len(compressed) < len(data):
+            sibling.write_bytes(compressed)
+            shutil.copystat(path, sibling)
+            sizes[suffix] = len(compressed)
+        else:
+            if sibling.exists():
+                sibling.unlink()
+            sizes[suffix] = None
+    return Result(path, len(data), digest, sizes, hits)
+
+
+def _artefact_type(path: Path) -> str:
+    return path.suffix.lower() or path.name
+
+
+def print_report(results: List[Result]) -> None:
+    """Print the bytes saved per artefact type."""
+    totals = defaultdict(lambda: defaultdict(int))
+    for path, size, _, sizes, _ in results:
+        for row in (_artefact_type(path), "total"):
+            totals[row]["files"] += 1
+            totals[row]["raw"] += size
+            for suffix, compressed in sizes.items():
+                totals[row][suffix] += size if compressed is None else compressed
+
+    header = f"{'type':<12}{'files':>7}{'raw':>14}"
+    for _, suffix, _ in ENCODINGS:
+        header += f"{suffix + ' saved':>20}"
+    print(header)
+    for row in sorted(totals, key=lambda r: (r == "total", r)):
+        t = totals[row]
+        line = f"{row:<12}{t['files']:>7}{t['raw']:>14,}"
+        for _, suffix, _ in ENCODINGS:
+            saved = t["raw"] - t[suffix]
+            line += f"{saved:>13,} ({saved / t['raw']:4.0%})" if t["raw"] else f"{'':>20}"
+        print(line)
+
+
+def prune_cache(cache: Path, results: List[Result]) -> int:
+    """Delete cached data not used by this run; return the number of deleted entries."""
+    live = {f"{r.digest}.{key}" for r in results for _, _, key in ENCODINGS}
+    stale = [p for p in cache.iterdir() if p.name not in live]
+    for p in stale:
+        p.unlink()
+    return len(stale)
+
+
+def precompress(out_dir: Path, min_size: int = MIN_SIZE, jobs: int = 1, prune: bool = True) -> List[Result]:
+    """Precompress the text artefacts of out_dir and print a report."""
+    cache = cache_dir()
+    if cache is not None:
+        cache = cache / "precompress"
+        cache.mkdir(exist_ok=True)
+    paths = find_artefacts(out_dir, min_size)
+    if jobs > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(precompress_file, paths, [cache] * len(paths)))
+    else:
+        results = [precompress_file(p, cache) for p in paths]
+
+    print_report(results)
+    hits = sum(r.hits for r in results)
+    print(f"precompress cache: {hits} hits, {len(results) * len(ENCODINGS) - hits} misses"
+          + (f", {prune_cache(cache, results)} evicted" if prune and cache is not None else ""))
+    if zstandard is None:
+        print("Note: zstandard is not installed, no .zst files written")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write .gz/.zst siblings of the text artefacts of a build.")
+    parser.add_argument("out_dir", type=Path, help="Build output directory")
+    parser.add_argument(
+        "--min-size", type=int, default=MIN_SIZE,
+        help=f"Skip files smaller than this many bytes (default: {MIN_SIZE})",
+    )
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=os.cpu_count() or 1,
+        help="Worker processes (default: CPU count, 1: serial)",
+    )
+    parser.add_argument(
+        "--keep-cache", action="store_true",
+        help="Keep cached compressed data of files that are no longer part of the build",
+    )
+    args = parser.parse_args()
+    precompress(args.out_dir, args.min_size, args.jobs, not args.keep_cache)
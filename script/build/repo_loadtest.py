@@ -0,0 +1,103 @@
+#!/bin/env python3
+"""
+Load test an HTTP server (e.g. repo_server.py) and report requests per second:
+
+    ./script/build/repo_server.py output/ --port 8000 &
+    ./script/build/repo_loadtest.py http://127.0.0.1:8000 /repository "/repository?type=airspace&area=de" \\
+        --connections 32 --duration 10 --gzip --revalidate
+
+Each connection sends keep-alive GET requests for the given paths in turn.
+With --revalidate, requests carry the ETag of the previous response of the
+same path in If-None-Match, as a caching client would.
+"""
+
+import argparse
+import asyncio
+from collections import Counter
+import statistics
+import sys
+import time
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+
+async def read_response(reader: asyncio.StreamReader) -> Tuple[int, Dict[str, str], int]:
+    """Read one response; return (status, headers, body length)."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(":")
+        if name:
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length:
+        await reader.readexactly(length)
+    return int(status_line.split(" ")[1]), headers, length
+
+
+async def worker(host: str, port: int, paths: List[str], args, deadline: float,
+                 latencies: List[float], statuses: Counter, received: List[int]) -> None:
+    etags: Dict[str, str] = {}
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        i = 0
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            lines = [f"GET {path} HTTP/1.1", f"Host: {host}:{port}"]
+            if args.gzip:
+                lines.append("Accept-Encoding: gzip")
+            if args.revalidate and path in etags:
+                lines.append(f"If-None-Match: {etags[path]}")
+            start = time.perf_counter()
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+            status, headers, length = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+            received[0] += length
+            if "etag" in headers:
+                etags[path] = headers["etag"]
+            if headers.get("connection", "").lower() == "close":
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+    finally:
+        writer.close()
+
+
+async def run(args) -> bool:
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    received = [0]
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(
+        worker(host, port, args.paths, args, deadline, latencies, statuses, received)
+        for _ in range(args.connections)
+    ))
+    elapsed = time.perf_counter() - start
+
+    if not latencies:
+        print("No responses")
+        return False
+    latencies.sort()
+    print(f"{len(latencies)} requests in {elapsed:.1f} s over {args.connections} connections")
+    print(f"  {len(latencies) / elapsed:.0f} requests/s, {received[0] / elapsed / 1e6:.1f} MB/s of bodies")
+    print(f"  latency: median {statistics.median(latencies) * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms, max {latencies[-1] * 1000:.2f} ms")
+    print("  status: " + ", ".join(f"{s}: {n}" for s, n in sorted(statuses.items())))
+    return all(s in (200, 304) for s in statuses)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test an HTTP server.")
+    parser.add_argument("url", help="Server URL, e.g. http://127.0.0.1:8000")
+    parser.add_argument("paths", nargs="*", default=["/repository"], help="Request paths (default: /repository)")
+    parser.add_argument("--connections", "-c", type=int, default=16, help="Concurrent connections (default: 16)")
+    parser.add_argument("--duration", "-d", type=float, default=5.0, help="Seconds to run (default: 5)")
+    parser.add_argument("--gzip", action="store_true", help="Accept gzip-encoded responses")
+    parser.add_argument("--revalidate", action="store_true", help="Send If-None-Match with the last ETag")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
@@ -0,0 +1,328 @@
+#!/bin/env python3
+"""
+Serve a build output directory over HTTP, with filtered repository views:
+
+    ./script/build/repo_server.py output/ --port 8000
+
+    GET /repository                               the repository file as built
+    GET /repository?type=airspace&area=de         records of that type and area
+    GET /repository?bbox=5.9,47.3,15.0,55.1       records whose bbox overlaps
+    GET /content/..., /source/...                 files of the output directory
+
+Filters combine; type and area (in any case) may be repeated or
+comma-separated.  Filtered views are rendered with sortrepo.format_records()
+from a RepositoryIndex built once at startup, and kept (with their gzip
+encoding) in a bounded cache.  Static files are sent with their precompressed
+.gz sibling if there is one, else compressed once and kept in memory.  The
+views of each type and each area, and the text files, are prepared at
+startup; other views, and files that are new, changed or too large to keep,
+are read and compressed in a worker thread, never in the event loop.  Every
+response has a strong ETag; If-None-Match is answered with 304.  Only the
+standard library is used (asyncio, HTTP/1.1 keep-alive).
+
+Measure it with repo_loadtest.py.
+"""
+
+import argparse
+import asyncio
+from collections import OrderedDict
+from email.utils import formatdate
+import gzip
+import hashlib
+from pathlib import Path
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from repoquery import RepositoryIndex, parse_bbox
+from sortrepo import format_records, parse_file
+
+# Maximum number of filtered views kept in memory
+VIEW_CACHE_SIZE = 256
+
+# Maximum size of a request head (request line and headers)
+MAX_HEAD = 16 * 1024
+
+# Larger static files are read for every request, not kept in memory
+MAX_CACHED_FILE = 64 * 1024 * 1024
+
+CONTENT_TYPES = {
+    ".cup": "text/plain; charset=utf-8",
+    ".txt": "text/plain; charset=utf-8",
+    ".js": "application/javascript",
+    ".json": "application/json",
+    ".xcm": "application/octet-stream",
+}
+
+STATUS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+class Body(NamedTuple):
+    """A response body with its gzip encoding and strong ETags."""
+
+    data: bytes
+    gzipped: Optional[bytes]
+    etag: str
+    content_type: str
+
+    @classmethod
+    def make(cls, data: bytes, content_type: str, gzipped: Optional[bytes] = None, compress: bool = True) -> "Body":
+        """Return the body of data; gzipped defaults to compressing data (if compress)."""
+        if gzipped is None and compress:
+            gzipped = gzip.compress(data, mtime=0)
+        if gzipped is not None and len(gzipped) >= len(data):
+            gzipped = None
+        return cls(data, gzipped, '"' + hashlib.sha256(data).hexdigest()[:32] + '"', content_type)
+
+    def variant(self, accept_gzip: bool) -> Tuple[bytes, str, Optional[str]]:
+        """Return (data, etag, content encoding) of the variant for the client."""
+        if accept_gzip and self.gzipped is not None:
+            return self.gzipped, self.etag[:-1] + '-gzip"', "gzip"
+        return self.data, self.etag, None
+
+
+def accepts_gzip(value: str) -> bool:
+    """Return True if an Accept-Encoding header value allows gzip."""
+    for item in value.split(","):
+        coding, _, params = item.strip().partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            q = params.strip()
+            try:
+                return not (q.startswith("q=") and float(q[2:] or 0) == 0)
+            except ValueError:
+                return False
+    return False
+
+
+def etag_matches(value: str, etag: str) -> bool:
+    """Return True if an If-None-Match header value matches etag."""
+    tags = [t.strip() for t in value.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+class RepositoryService:
+    """Repository views and static files of a build output directory."""
+
+    def __init__(self, out_dir: Path, view_cache_size: int = VIEW_CACHE_SIZE):
+        self.out_dir = out_dir.resolve()
+        repository = self.out_dir / "repository"
+        self.records = parse_file(repository)
+        self.index = RepositoryIndex(self.records)
+        self.position = {id(r): i for i, r in enumerate(self.records)}
+        self.repository = Body.make(repository.read_bytes(), "text/plain; charset=utf-8")
+        self.views: "OrderedDict[tuple, Body]" = OrderedDict()
+        self.view_cache_size = view_cache_size
+        # Views are rendered in worker threads too
+        self.views_lock = threading.Lock()
+        # path -> (mtime_ns, size, Body) of static files
+        self.files: Dict[Path, Tuple[int, int, Body]] = {}
+
+    def preload(self) -> None:
+        """Prepare the views of each type and area, and the text files to keep in memory."""
+        for xcs_type in self.index.by_type:
+            self.view({"type": [xcs_type]})
+        for area in self.index.by_area:
+            self.view({"area": [area]})
+        for path in sorted(self.out_dir.rglob("*")):
+            if (path.suffix.lower() in CONTENT_TYPES and CONTENT_TYPES[path.suffix.lower()] != "application/octet-stream"
+                    and path.is_file() and path.stat().st_size <= MAX_CACHED_FILE):
+                self.file(path.relative_to(self.out_dir).as_posix())
+
+    @staticmethod
+    def view_key(query: Dict[str, List[str]]) -> tuple:
+        """Return the (types, areas, bbox) filter of the query parameters."""
+        types = frozenset(t for v in query.get("type", []) for t in v.split(",") if t)
+        areas = frozenset(a.lower() for v in query.get("area", []) for a in v.split(","))
+        bbox = None
+        if "bbox" in query:
+            bbox = parse_bbox(query["bbox"][-1])
+            if bbox is None:
+                raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+        return types, areas, bbox
+
+    def cached_view(self, key: tuple) -> Optional[Body]:
+        with self.views_lock:
+            body = self.views.get(key)
+            if body is not None:
+                self.views.move_to_end(key)
+            return body
+
+    def view(self, query: Dict[str, List[str]]) -> Body:
+        """Return the repository filtered by the type, area and bbox query parameters."""
+        key = self.view_key(query)
+        types, areas, bbox = key
+        body = self.cached_view(key)
+        if body is not None:
+            return body
+
+        if bbox is not None:
+            records = self.index.intersecting(*bbox, types=types or None)
+        elif types:
+            records = [r for t in sorted(types) for r in self.index.select(type=t)]
+            records.sort(key=lambda r: self.position[id(r)])
+        else:
+            records = self.records
+        if areas:
+            records = [r for r in records if r["area"].lower() in areas]
+        body = Body.make(format_records(records).encode(), "text/plain; charset=utf-8")
+        with self.views_lock:
+            self.views[key] = body
+            if len(self.views) > self.view_cache_size:
+                self.views.popitem(last=False)
+        return body
+
+    def _static_path(self, url_path: str) -> Optional[Path]:
+        path = (self.out_dir / unquote(url_path).lstrip("/")).resolve()
+        if not path.is_relative_to(self.out_dir) or not path.is_file():
+            return None
+        return path
+
+    def cached_file(self, path: Path) -> Optional[Body]:
+        """Return the kept body of the static file path, None if it is not kept or changed."""
+        stat = path.stat()
+        cached = self.files.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        return None
+
+    def file(self, url_path: str) -> Optional[Body]:
+        """Return the static file at url_path, None if there is none."""
+        path = self._static_path(url_path)
+        if path is None:
+            return None
+        body = self.cached_file(path)
+        if body is not None:
+            return body
+        stat = path.stat()
+        gz_path = path.with_name(path.name + ".gz")
+        gzipped = gz_path.read_bytes() if gz_path.is_file() else None
+        content_type = CONTENT_TYPES.get(path.suffix.lower(), "application/octet-stream")
+        body = Body.make(path.read_bytes(), content_type, gzipped, compress=content_type != "application/octet-stream")
+        if stat.st_size <= MAX_CACHED_FILE:
+            self.files[path] = (stat.st_mtime_ns, stat.st_size, body)
+        return body
+
+    def lookup(self, target: str) -> Optional[Tuple[int, Optional[Body], str]]:
+        """Return resolve(target) if that needs no file reads or rendering, else None."""
+        url = urlsplit(target)
+        if url.path == "/repository":
+            if not url.query:
+                return 200, self.repository, ""
+            try:
+                body = self.cached_view(self.view_key(parse_qs(url.query)))
+            except ValueError as e:
+                return 400, None, str(e)
+            return None if body is None else (200, body, "")
+        path = self._static_path(url.path)
+        if path is None:
+            return 404, None, f"Not found: {url.path}"
+        body = self.cached_file(path)
+        return None if body is None else (200, body, "")
+
+    def resolve(self, target: str) -> Tuple[int, Optional[Body], str]:
+        """Return (status, body, error message) for a request target."""
+        url = urlsplit(target)
+        if url.path == "/repository":
+            if not url.query:
+                return 200, self.repository, ""
+            try:
+                return 200, self.view(parse_qs(url.query)), ""
+            except ValueError as e:
+                return 400, None, str(e)
+        body = self.file(url.path)
+        if body is None:
+            return 404, None, f"Not found: {url.path}"
+        return 200, body, ""
+
+
+def response_head(status: int, headers: Dict[str, str]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {STATUS[status]}"]
+    lines += [f"{k}: {v}" for k, v in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def handle(service: RepositoryService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Serve the requests of one connection until the client closes it."""
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                break
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, version = request_line.split(" ")
+            except ValueError:
+                writer.write(response_head(400, {"Content-Length": "0", "Connection": "close"}))
+                break
+            headers = {}
+            for line in header_lines:
+                name, _, value = line.partition(":")
+                if name:
+                    headers[name.strip().lower()] = value.strip()
+            keep_alive = (headers.get("connection", "").lower() != "close"
+                          and (version == "HTTP/1.1" or headers.get("connection", "").lower() == "keep-alive"))
+
+            common = {
+                "Date": formatdate(usegmt=True),
+                "Connection": "keep-alive" if keep_alive else "close",
+            }
+            if method not in ("GET", "HEAD") or "content-length" in headers or "transfer-encoding" in headers:
+                writer.write(response_head(405, {**common, "Allow": "GET, HEAD", "Content-Length": "0",
+                                                 "Connection": "close"}))
+                break
+
+            resolved = service.lookup(target)
+            if resolved is None:
+                resolved = await asyncio.to_thread(service.resolve, target)
+            status, body, error = resolved
+            if body is None:
+                message = (error + "\n").encode()
+                writer.write(response_head(status, {**common, "Content-Type": "text/plain; charset=utf-8",
+                                                    "Content-Length": str(len(message))}))
+                if method == "GET":
+                    writer.write(message)
+            else:
+                data, etag, encoding = body.variant(accepts_gzip(headers.get("accept-encoding", "")))
+                response = {**common, "ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+                if etag_matches(headers.get("if-none-match", ""), etag):
+                    writer.write(response_head(304, response))
+                else:
+                    response["Content-Type"] = body.content_type
+                    response["Content-Length"] = str(len(data))
+                    if encoding:
+                        response["Content-Encoding"] = encoding
+                    writer.write(response_head(200, response))
+                    if method == "GET":
+                        writer.write(data)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(service: RepositoryService, host: str, port: int) -> None:
+    server = await asyncio.start_server(
+        lambda r, w: handle(service, r, w), host, port, limit=MAX_HEAD,
+    )
+    print(f"Serving {service.out_dir} on http://{host}:{port}/ ({len(service.records)} records)")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a build output directory with filtered repository views.")
+    parser.add_argument("out_dir", type=Path, help="Build output directory (with the repository file)")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
+    args = parser.parse_args()
+
+    service = RepositoryService(args.out_dir)
+    service.preload()
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
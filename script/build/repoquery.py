@@ -0,0 +1,223 @@
+#!/bin/env python3
+"""
+Query a built repository file by type, area and location:
+
+    index = RepositoryIndex.load(Path("output/repository"))
+    index.covering(50.8, 6.2, types=("airspace", "waypoint"))
+    index.intersecting(5.9, 50.3, 15.0, 55.1, types=("waypoint",))
+    index.select(type="map", area="de")
+
+Records are read with sortrepo.parse_file().  Their bboxes are registered in
+a uniform lat/lon grid, so a query only checks the records of the cells it
+touches instead of every record.  A bbox with min_lon > max_lon crosses the
+antimeridian.
+
+Compare the grid with a linear scan on a synthetic repository:
+
+    ./script/build/repoquery.py --benchmark 100000
+"""
+
+import argparse
+from collections import defaultdict
+import math
+from pathlib import Path
+import random
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sortrepo import parse_file
+
+# Default grid cell size in degrees
+CELL_SIZE = 5.0
+
+BBox = Tuple[float, float, float, float]
+
+
+def parse_bbox(value: str) -> Optional[BBox]:
+    """Return (min_lon, min_lat, max_lon, max_lat) of a bbox= value, None if missing or malformed."""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in value.split(","))
+    except ValueError:
+        return None
+    if min_lat > max_lat:
+        return None
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def _lon_ranges(min_lon: float, max_lon: float) -> List[Tuple[float, float]]:
+    """Split a longitude range crossing the antimeridian in two."""
+    if min_lon <= max_lon:
+        return [(min_lon, max_lon)]
+    return [(min_lon, 180.0), (-180.0, max_lon)]
+
+
+def intersects(a: BBox, b: BBox) -> bool:
+    """Return True if bboxes a and b overlap (edges included)."""
+    if a[1] > b[3] or b[1] > a[3]:
+        return False
+    return any(
+        a_min <= b_max and b_min <= a_max
+        for a_min, a_max in _lon_ranges(a[0], a[2])
+        for b_min, b_max in _lon_ranges(b[0], b[2])
+    )
+
+
+class RepositoryIndex:
+    """Records of a repository file, indexed by type, area and bbox."""
+
+    def __init__(self, records: List[dict], cell_size: float = CELL_SIZE):
+        self.records = records
+        self.cell_size = cell_size
+        self.columns = math.ceil(360 / cell_size)
+        self.rows = math.ceil(180 / cell_size)
+        self.by_type: Dict[str, List[int]] = defaultdict(list)
+        self.by_area: Dict[str, List[int]] = defaultdict(list)
+        self.bboxes: List[Optional[BBox]] = []
+        self.grid: Dict[int, List[int]] = defaultdict(list)
+
+        for i, record in enumerate(records):
+            self.by_type[record["type"]].append(i)
+            self.by_area[record["area"].lower()].append(i)
+            bbox = parse_bbox(record["bbox"])
+            self.bboxes.append(bbox)
+            if bbox is not None:
+                for cell in self._cells(bbox):
+                    self.grid[cell].append(i)
+
+    @classmethod
+    def load(cls, path: Path, cell_size: float = CELL_SIZE) -> "RepositoryIndex":
+        """Return the index of repository file path."""
+        return cls(parse_file(path), cell_size)
+
+    def _row(self, lat: float) -> int:
+        return min(max(math.floor((lat + 90) / self.cell_size), 0), self.rows - 1)
+
+    def _column(self, lon: float) -> int:
+        return min(max(math.floor((lon + 180) / self.cell_size), 0), self.columns - 1)
+
+    def _cells(self, bbox: BBox) -> Iterable[int]:
+        """Yield the grid cells bbox overlaps."""
+        for row in range(self._row(bbox[1]), self._row(bbox[3]) + 1):
+            for min_lon, max_lon in _lon_ranges(bbox[0], bbox[2]):
+                for column in range(self._column(min_lon), self._column(max_lon) + 1):
+                    yield row * self.columns + column
+
+    def _filter(self, indexes: Iterable[int], types: Optional[Iterable[str]]) -> List[dict]:
+        if types is not None:
+            types = set(types)
+            indexes = (i for i in indexes if self.records[i]["type"] in types)
+        return [self.records[i] for i in sorted(indexes)]
+
+    def covering(self, lat: float, lon: float, types: Optional[Iterable[str]] = None) -> List[dict]:
+        """Return the records (of types, if given) whose bbox contains the point."""
+        point = (lon, lat, lon, lat)
+        cell = self._row(lat) * self.columns + self._column(lon)
+        hits = (i for i in self.grid.get(cell, ()) if intersects(self.bboxes[i], point))
+        return self._filter(hits, types)
+
+    def intersecting(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float,
+                     types: Optional[Iterable[str]] = None) -> List[dict]:
+        """Return the records (of types, if given) whose bbox overlaps the given one."""
+        bbox = (min_lon, min_lat, max_lon, max_lat)
+        candidates = set()
+        for cell in self._cells(bbox):
+            candidates.update(self.grid.get(cell, ()))
+        return self._filter((i for i in candidates if intersects(self.bboxes[i], bbox)), types)
+
+    def select(self, type: Optional[str] = None, area: Optional[str] = None) -> List[dict]:
+        """Return the records of type and/or area (in any case)."""
+        if area is not None:
+            area = area.lower()
+        if type is not None and area is not None:
+            indexes = set(self.by_type.get(type, ())) & set(self.by_area.get(area, ()))
+        elif type is not None:
+            indexes = self.by_type.get(type, ())
+        elif area is not None:
+            indexes = self.by_area.get(area, ())
+        else:
+            indexes = range(len(self.records))
+        return self._filter(indexes, None)
+
+
+def linear_covering(records: List[dict], lat: float, lon: float, types: Optional[Iterable[str]] = None) -> List[dict]:
+    """Reference implementation of RepositoryIndex.covering(): scan every record."""
+    point = (lon, lat, lon, lat)
+    rv = []
+    for record in records:
+        if types is not None and record["type"] not in types:
+            continue
+        bbox = parse_bbox(record["bbox"])
+        if bbox is not None and intersects(bbox, point):
+            rv.append(record)
+    return rv
+
+
+def synthetic_records(count: int, seed: int = 1) -> List[dict]:
+    """Return count random records with bboxes from a few km to a few thousand km wide."""
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        lat = rng.uniform(-80, 80)
+        lon = rng.uniform(-180, 180)
+        size = min(10 ** rng.uniform(-2, 1.5), 60)
+        min_lon = lon - size / 2
+        max_lon = lon + size / 2
+        min_lon += 360 if min_lon < -180 else 0
+        max_lon -= 360 if max_lon > 180 else 0
+        records.append({
+            "name": f"R{i}",
+            "uri": f"http://example.org/{i}",
+            "type": rng.choice(("airspace", "waypoint", "map", "task")),
+            "area": rng.choice(("de", "fr", "us", "za", "")),
+            "description": "",
+            "update": "2024-01-01",
+            "bbox": f"{min_lon},{max(lat - size / 2, -90)},{max_lon},{min(lat + size / 2, 90)}",
+        })
+    return records
+
+
+def benchmark(count: int, queries: int = 1000) -> bool:
+    """Time point queries with the grid index and a linear scan; return True if their results agree."""
+    records = synthetic_records(count)
+    start = time.perf_counter()
+    index = RepositoryIndex(records)
+    build = time.perf_counter() - start
+
+    rng = random.Random(2)
+    points = [(rng.uniform(-80, 80), rng.uniform(-180, 180)) for _ in range(queries)]
+    types = ("airspace", "waypoint")
+
+    start = time.perf_counter()
+    indexed = [index.covering(lat, lon, types) for lat, lon in points]
+    grid_time = time.perf_counter() - start
+
+    linear_points = points[:max(1, queries // 100)]
+    start = time.perf_counter()
+    linear = [linear_covering(records, lat, lon, types) for lat, lon in linear_points]
+    linear_time = (time.perf_counter() - start) * len(points) / len(linear_points)
+
+    ok = indexed[:len(linear)] == linear
+    print(f"{count} records, index built in {build * 1000:.0f} ms")
+    print(f"grid:   {grid_time / queries * 1e6:9.1f} us/query")
+    print(f"linear: {linear_time / queries * 1e6:9.1f} us/query ({linear_time / grid_time:.0f}x slower)")
+    print("results agree" if ok else "RESULTS DIFFER")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query a repository file by location.")
+    parser.add_argument("repository", type=Path, nargs="?", help="Repository file")
+    parser.add_argument("--point", type=float, nargs=2, metavar=("LAT", "LON"), help="List records covering this point")
+    parser.add_argument("--type", action="append", dest="types", help="Only records of this type (repeatable)")
+    parser.add_argument("--benchmark", type=int, metavar="N", help="Benchmark against a linear scan with N synthetic records")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        sys.exit(0 if benchmark(args.benchmark) else 1)
+    if args.repository is None or args.point is None:
+        parser.error("repository and --point are required unless --benchmark is given")
+
+    index = RepositoryIndex.load(args.repository)
+    for record in index.covering(*args.point, types=args.types):
+        print(f"{record['type']}\t{record['name']}\t{record['uri']}")
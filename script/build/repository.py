@@ -5,35 +5,37 @@ Generate XCSoar's repository file (https://download.xcsoar.org/repository).
 Execute in the git repository root dir.
 """
 
-import datetime
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import json
+import os
 from pathlib import Path
-import subprocess
-import sys
 import requests
-import re
-from typing import Optional
+from typing import Callable, Iterable, List, Optional, Tuple, Union
 
 from iso3166 import countries
-from aerofiles.seeyou.reader import Reader as CupReader
-from aerofiles.openair.reader import Reader as OpenAirReader
 from aerofiles.errors import ParserError
 
+from bbox_cache import BBoxCache
+from file_hash import FileHashCache
+from cup_scan import scan_cup
+from openair_scan import scan_openair
+import git_index
+from git_index import get_index, git_commit_datetime
+from http_pool import TIMEOUT, make_session, map_ordered
+from openaip_index import OPENAIP_URL, OpenAIPIndex
+from waypoint_tiles import TILE_INDEX
 
-def git_commit_datetime(filename: Path) -> datetime.datetime:
-    """Return naive UTC datetime of filename's last git commit."""
-    cmd = ["git", "log", "-1", "--format=%ct", "--", filename]
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    out, _ = p.communicate()
-    try:
-        # Use timezone-aware conversion then convert to naive UTC
-        timestamp = int(out)
-        dt = datetime.datetime.fromtimestamp(timestamp, datetime.UTC)
-        # Return naive datetime (as documented) by removing timezone info
-        return dt.replace(tzinfo=None)
-    except (ValueError, OSError):
-        # Return naive UTC datetime
-        return datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+# Parser name/version of cached bboxes; bump when a parser's results change.
+BBOX_PARSER_CUP = "cup-2"
+BBOX_PARSER_AIRSPACE = "airspace-2"
+
+# Errors of the bbox scanners that leave a file without bbox
+BBOX_ERRORS_CUP = (OSError, ValueError, KeyError, ParserError, IndexError)
+BBOX_ERRORS_AIRSPACE = (OSError,)
+
+# Optional persistent bbox cache, see use_bbox_cache()
+_bbox_cache: Optional[BBoxCache] = None
 
 
 def guess_area(name: str) -> str:
@@ -51,19 +53,8 @@ def calculate_bbox_cup(cup_file: Path) -> Optional[str]:
     """Calculate bounding box from a waypoint CUP file.
     Returns bbox string in format 'min_lon,min_lat,max_lon,max_lat' or None if error."""
     try:
-        with open(cup_file, encoding='utf-8') as fp:
-            reader = CupReader()
-            data = reader.read(fp)
-        waypoints = data.get("waypoints", [])
-
-        if not waypoints:
-            return None
-
-        lats = [wp["latitude"] for wp in waypoints]
-        lons = [wp["longitude"] for wp in waypoints]
-
-        return _calculate_bbox_from_coords(lons, lats)
-    except (OSError, ValueError, KeyError, ParserError, IndexError) as e:
+        return scan_cup(cup_file).bbox()
+    except BBOX_ERRORS_CUP as e:
         print(f"Warning: Could not calculate bbox for {cup_file}: {e}")
         return None
 
@@ -107,55 +98,20 @@ def _extract_coords_from_airspace(airspace: dict, all_lons: list, all_lats: list
                     all_lons.append(float(center[1]))
 
 
-def _calculate_bbox_from_coords(all_lons: list, all_lats: list) -> Optional[str]:
-    """Calculate bbox string from coordinate lists.
-    Returns bbox string in format 'min_lon,min_lat,max_lon,max_lat' or None if empty."""
-    if not all_lats or not all_lons:
-        return None
-    return f"{min(all_lons)},{min(all_lats)},{max(all_lons)},{max(all_lats)}"
-
-
-def _parse_airspace_records(reader: OpenAirReader):
-    """Parse airspace records from OpenAirReader and extract coordinates.
-    Returns tuple of (all_lons, all_lats) lists."""
-    all_lats = []
-    all_lons = []
-
-    # Reader is an iterator that yields (record, error) tuples
-    for record, error in reader:
-        if error:
-            continue  # Skip records with errors
-        if record and record.get("type") == "airspace":
-            _extract_coords_from_airspace(record, all_lons, all_lats)
-
-    return all_lons, all_lats
-
-
 def calculate_bbox_airspace(airspace_file: Path) -> Optional[str]:
     """Calculate bounding box from an airspace OpenAir file.
     Returns bbox string in format 'min_lon,min_lat,max_lon,max_lat' or None if error."""
     try:
-        with open(airspace_file, encoding='utf-8') as fp:
-            reader = OpenAirReader(fp)
-            all_lons, all_lats = _parse_airspace_records(reader)
-        return _calculate_bbox_from_coords(all_lons, all_lats)
-    except (OSError, ValueError, KeyError) as e:
+        return scan_openair(airspace_file).bbox()
+    except BBOX_ERRORS_AIRSPACE as e:
         print(f"Warning: Could not calculate bbox for {airspace_file}: {e}")
         return None
 
 
-def calculate_bbox_airspace_from_content(content: str) -> Optional[str]:
-    """Calculate bounding box from airspace OpenAir file content (string).
+def calculate_bbox_airspace_from_content(content: Union[str, bytes, Iterable]) -> Optional[str]:
+    """Calculate bounding box from airspace OpenAir file content (string, bytes or chunks).
     Returns bbox string in format 'min_lon,min_lat,max_lon,max_lat' or None if error."""
-    try:
-        from io import StringIO
-        fp = StringIO(content)
-        reader = OpenAirReader(fp)
-        all_lons, all_lats = _parse_airspace_records(reader)
-        return _calculate_bbox_from_coords(all_lons, all_lats)
-    except (ValueError, KeyError) as e:
-        print(f"Warning: Could not calculate bbox from airspace content: {e}")
-        return None
+    return scan_openair(content).bbox()
 
 
 def get_bbox_from_map_json(json_file: Path) -> Optional[str]:
@@ -179,21 +135,103 @@ def get_bbox_from_map_json(json_file: Path) -> Optional[str]:
         return None
 
 
-def _calculate_bbox_for_file(datafile: Path, file_type: str) -> Optional[str]:
-    """Calculate bbox for a georeferencable file based on its type."""
+def use_bbox_cache(cache: Optional[BBoxCache]) -> None:
+    """Consult cache before parsing waypoint/airspace files for their bbox (None: never)."""
+    global _bbox_cache
+    _bbox_cache = cache
+
+
+def _cached_bbox(datafile: Path, parser: str, compute: Callable[[Path], Optional[str]],
+                 errors: Tuple[type, ...], sha256: Optional[str] = None) -> Optional[str]:
+    """Return compute(datafile), looked up in the bbox cache if one is in use.
+
+    If compute() raises one of errors, the file has no bbox this time; that is
+    not cached, so the next build tries again.
+    """
+    try:
+        if _bbox_cache is None:
+            return compute(datafile)
+        return _bbox_cache.get(datafile, parser, compute, sha256)
+    except errors as e:
+        print(f"Warning: Could not calculate bbox for {datafile}: {e}")
+        return None
+
+
+def _calculate_bbox_for_file(datafile: Path, file_type: str, sha256: Optional[str] = None) -> Optional[str]:
+    """Calculate bbox for a georeferencable file based on its type (sha256: of its content, if known)."""
     suffix = datafile.suffix.lower()
     if file_type == "waypoint" and suffix == ".cup":
-        return calculate_bbox_cup(datafile)
+        return _cached_bbox(datafile, BBOX_PARSER_CUP, lambda p: scan_cup(p).bbox(), BBOX_ERRORS_CUP, sha256)
     elif file_type == "airspace" and suffix == ".txt":
-        return calculate_bbox_airspace(datafile)
+        return _cached_bbox(datafile, BBOX_PARSER_AIRSPACE, lambda p: scan_openair(p).bbox(),
+                            BBOX_ERRORS_AIRSPACE, sha256)
     return None
 
 
+def _digest_lines(digest: Optional[Tuple[int, str]]) -> str:
+    """Return the size= and sha256= lines of a (size, sha256) digest."""
+    if digest is None:
+        return ""
+    return f"size={digest[0]}\nsha256={digest[1]}\n"
+
+
+def _content_entry(
+    datafile: Path, data_dir: Path, url: str, xcs_type: str, digest: Optional[Tuple[int, str]] = None
+) -> str:
+    """Return the repository entry of a single content file (with its (size, sha256) digest)."""
+    rv = f"""
+name={datafile.name}
+uri={url + str(datafile.relative_to(data_dir))}
+type={xcs_type}
+area={guess_area(datafile.stem)}
+update={git_commit_datetime(datafile).date().isoformat()}
+"""
+    description = json_description(datafile)
+    if description:
+        rv += f"description={description}\n"
+
+    # Calculate and add bbox for georeferencable files
+    bbox = _calculate_bbox_for_file(datafile, xcs_type, digest[1] if digest else None)
+    if bbox:
+        rv += f"bbox={bbox}\n"
+    return rv + _digest_lines(digest)
+
+
+def _content_task(*args) -> Tuple[str, list]:
+    """Return the _content_entry() and the bbox cache lookups it made."""
+    entry = _content_entry(*args)
+    records = _bbox_cache.drain_journal() if _bbox_cache is not None else []
+    return entry, records
+
+
+def _init_worker(index: git_index.GitCommitIndex, cache: Optional[BBoxCache]) -> None:
+    """Share the parent's git index and bbox cache with a worker process."""
+    git_index.set_index(index)
+    use_bbox_cache(cache)
+    if cache is not None:
+        cache.start_journal()
+
+
+def _map_ordered(func: Callable, tasks: List[tuple], jobs: int) -> List:
+    """Return [func(*task) for task in tasks], computed by a process pool if jobs > 1.
+
+    Results keep the order of tasks, so the output does not depend on jobs.
+    """
+    if jobs <= 1 or len(tasks) <= 1:
+        return [func(*task) for task in tasks]
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(get_index(), _bbox_cache)
+    ) as pool:
+        return list(pool.map(func, *zip(*tasks), chunksize=max(1, len(tasks) // (4 * jobs))))
+
+
 def generate_content(
     data_dir: Path,
     url: str,
     skip_openaip_cup: bool = False,
     skip_if_in_dir: Optional[Path] = None,
+    jobs: int = 1,
+    hashes: Optional[FileHashCache] = None,
 ) -> str:
     """Generate repository entries for content files.
 
@@ -202,13 +240,18 @@ def generate_content(
         url: Base URL for content files
         skip_openaip_cup: If True, skip OpenAIP CUP files (handled via remote entries)
         skip_if_in_dir: If set, skip any file that exists at the same path here (avoids duplicates)
+        jobs: Number of worker processes computing the entries (1: serial)
+        hashes: Cache of the files' size and sha256 (default: not persistent)
     """
-    rv = ""
+    # Section headers (str) and entry tasks (tuple), in output order
+    parts = []
     for xcs_type in sorted(data_dir.iterdir()):
         for geo in sorted(xcs_type.iterdir()):
             if geo.name == "0_META":
                 continue  # Web/metadata artefacts, not for repository
-            rv += f"\n# Data location: {data_dir.name}, type: {xcs_type.name}, geography: {geo.name}.\n"
+            if (geo / TILE_INDEX).exists():
+                continue  # Waypoint tiles, listed by generate_tiles()
+            parts.append(f"\n# Data location: {data_dir.name}, type: {xcs_type.name}, geography: {geo.name}.\n")
             for datafile in sorted(geo.iterdir()):
                 if datafile.name.lower().endswith(".json"):
                     continue
@@ -223,23 +266,47 @@ def generate_content(
                     datafile.suffix.lower() == ".cup" and "OpenAIP" in datafile.name):
                     continue
 
-                rv += f"""
-name={datafile.name}
-uri={url + str(datafile.relative_to(data_dir))}
-type={xcs_type.name}
-area={guess_area(datafile.stem)}
-update={git_commit_datetime(datafile).date().isoformat()}
-"""
-                description = json_description(datafile)
-                if description:
-                    rv += f"description={description}\n"
+                parts.append((datafile, data_dir, url, xcs_type.name))
 
-                # Calculate and add bbox for georeferencable files
-                bbox = _calculate_bbox_for_file(datafile, xcs_type.name)
-                if bbox:
-                    rv += f"bbox={bbox}\n"
+    tasks = [p for p in parts if isinstance(p, tuple)]
+    digests = (hashes or FileHashCache()).digests(task[0] for task in tasks)
+    tasks = [task + (digests[task[0]],) for task in tasks]
+
+    entries = []
+    for entry, records in _map_ordered(_content_task, tasks, jobs):
+        if records:
+            _bbox_cache.absorb(records)
+        entries.append(entry)
+    entries = iter(entries)
+    return "".join(p if isinstance(p, str) else next(entries) for p in parts)
+
+def generate_tiles(tile_dir: Path, url: str) -> str:
+    """Generate repository entries for the waypoint tiles indexed in tile_dir/tiles.json.
+
+    Args:
+        tile_dir: Output directory of waypoint_tiles.py
+        url: Base URL of the tile files
+    """
+    with open(tile_dir / TILE_INDEX) as f:
+        index = json.load(f)
+
+    rv = f"\n# Data location: {tile_dir.parent.parent.name}, type: waypoint, geography: {tile_dir.name}.\n"
+    for tile in index["tiles"]:
+        # Tiles of several countries have no area
+        area = f"area={tile['area']}\n" if tile.get("area") else ""
+        rv += f"""
+name={tile["name"]}
+uri={url}{tile["name"]}
+type=waypoint
+{area}description=Waypoint tile {tile["quadkey"] or "World"} ({tile["count"]} waypoints)
+update={index["update"]}
+bbox={tile["bbox"]}
+size={tile["size"]}
+sha256={tile["sha256"]}
+"""
     return rv
 
+
 def json_update(json_filename: Path) -> str:
     """Return the value of json_filename's "update" key."""
     if json_filename.suffix.lower() != ".json":
@@ -254,13 +321,30 @@ def json_update(json_filename: Path) -> str:
             return ""
     return ""
 
-def generate_source(data_dir: Path, url: str) -> str:
+def generate_source(
+    data_dir: Path,
+    url: str,
+    out_source_dir: Optional[Path] = None,
+    hashes: Optional[FileHashCache] = None,
+) -> str:
     """Generate repository entries for source files (maps).
 
     Args:
         data_dir: Directory containing source files ($TYPE/[country,region,global]/*.*)
         url: Base URL for source files
+        out_source_dir: Optional build output directory of the maps; maps built there
+                        get size and sha256 keys
+        hashes: Cache of the maps' size and sha256 (default: not persistent)
     """
+    digests = {}
+    if out_source_dir is not None and out_source_dir.exists():
+        digests = (hashes or FileHashCache()).digests(sorted(out_source_dir.rglob("*.xcm")))
+
+    def digest_lines(uri: str) -> str:
+        if out_source_dir is None:
+            return ""
+        return _digest_lines(digests.get(out_source_dir / uri))
+
     rv = ""
     for xcs_type in sorted(data_dir.iterdir()):
         for geo in sorted(xcs_type.iterdir()):
@@ -283,52 +367,47 @@ uri={url}{base_uri}_HighRes.xcm
 type={xcs_type.name}
 area={guess_area(base_name)}
 update={git_commit_datetime(datafile).date().isoformat()}
-{bbox_line}name={base_name}.xcm
+{bbox_line}{digest_lines(base_uri + "_HighRes.xcm")}name={base_name}.xcm
 uri={url}{base_uri}.xcm
 type={xcs_type.name}
 area={guess_area(base_name)}
 update={git_commit_datetime(datafile).date().isoformat()}
-{bbox_line}"""
+{bbox_line}{digest_lines(base_uri + ".xcm")}"""
     return rv
 
 
-def generate_asp_openaip():
-    """Generate OpenAIP repository entries from cloud storage (airspace files)."""
-    base_url = "https://storage.googleapis.com/29f98e10-a489-4c82-ae5e-489dbcd4912f/"
-    url = base_url
-    openaip_index = ""
-    rv = ""
+def _fetch_openaip_airspace_bbox(session: requests.Session, file_url: str, countrycode: str) -> Optional[str]:
+    """Download an OpenAIP airspace file and return its bbox, parsed while streaming."""
+    try:
+        with session.get(file_url, timeout=TIMEOUT, stream=True) as file_response:
+            if file_response.status_code == 200:
+                return calculate_bbox_airspace_from_content(file_response.iter_content(1 << 16))
+            print(f"Warning: Could not download OpenAIP airspace for {countrycode}: HTTP {file_response.status_code}")
+    except Exception as e:
+        print(f"Warning: Could not download/parse OpenAIP airspace for {countrycode}: {e}")
+    return None
 
-    # Fetch all pages of the OpenAIP index
-    while True:
-        response = requests.get(url, timeout=30)
-        xml_data = response.text
-        openaip_index += xml_data
-
-        match = re.search(r"<NextMarker>(.*?)</NextMarker>", xml_data)
-        if not match:
-            break
-        url = f"{base_url}?marker={match.group(1)}"
-
-    contents = re.findall(r"<Contents>(.*?)</Contents>", openaip_index)
-    for content in contents:
-        key_match = re.search(r"<Key>(.*?)</Key>", content)
-        if not key_match or "asp_v2.txt" not in key_match.group(1):
-            continue
 
-        size_match = re.search(r"<Size>(.*)</Size>", content)
-        if not size_match:
-            continue
+def generate_asp_openaip(base_url: str = OPENAIP_URL, jobs: int = 8) -> str:
+    """Generate OpenAIP repository entries from cloud storage (airspace files).
+
+    Args:
+        base_url: Bucket URL (with trailing slash) serving the listing and the files
+        jobs: Number of concurrent downloads
+    """
+    session = make_session(pool_size=max(jobs, 1))
+    rv = ""
 
-        size = int(size_match.group(1))
-        if size < 384:
+    # (key, countrycode, countryname, update) of each airspace file, in index order
+    airspaces = []
+    for entry in OpenAIPIndex(base_url, session=session):
+        if "asp_v2.txt" not in entry.key or entry.size < 384:
             continue
 
-        key = key_match.group(1)
-        print(f"OK: {key} {size}")
+        key = entry.key
+        print(f"OK: {key} {entry.size}")
 
-        updatedate_match = re.search(r"<LastModified>(.*?)</LastModified>", content)
-        if not updatedate_match:
+        if not entry.last_modified:
             continue
 
         countrycode = key[:2].upper()
@@ -336,17 +415,13 @@ def generate_asp_openaip():
             countryname = countries.get(countrycode).name
         except KeyError:
             continue
+        airspaces.append((key, countrycode, countryname, entry.last_modified))
 
-        # Download and parse airspace file to calculate bbox
-        bbox = None
-        try:
-            file_url = base_url + key
-            file_response = requests.get(file_url, timeout=30)
-            if file_response.status_code == 200:
-                bbox = calculate_bbox_airspace_from_content(file_response.text)
-        except Exception as e:
-            print(f"Warning: Could not download/parse OpenAIP airspace for {countrycode}: {e}")
-
+    # Download and parse airspace files concurrently to calculate their bbox
+    bboxes = map_ordered(
+        lambda a: _fetch_openaip_airspace_bbox(session, base_url + a[0], a[1]), airspaces, jobs
+    )
+    for (key, countrycode, countryname, update), bbox in zip(airspaces, bboxes):
         bbox_line = f"bbox={bbox}\n" if bbox else ""
 
         rv += f"""
@@ -355,7 +430,7 @@ uri={base_url}{key}
 type=airspace
 description={countryname} Airspace from OpenAIP
 area={countrycode}
-update={updatedate_match.group(1)}
+update={update}
 {bbox_line}"""
     return rv
 
@@ -437,7 +512,7 @@ update={json_update(datafile) or git_commit_datetime(datafile).date().isoformat(
                     # datafile.stem is already "NAME.cup" (without .json), so use it directly
                     generated_cup = out_content_dir / "waypoint" / geo.name / datafile.stem
                     if generated_cup.exists():
-                        bbox = calculate_bbox_cup(generated_cup)
+                        bbox = _cached_bbox(generated_cup, BBOX_PARSER_CUP, lambda p: scan_cup(p).bbox(), BBOX_ERRORS_CUP)
 
                 if bbox:
                     rv += f"bbox={bbox}\n"
@@ -456,14 +531,38 @@ if __name__ == "__main__":
 
     base_url = "http://download.xcsoar.org/"
 
-    out_dir = Path(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Generate XCSoar's repository file.")
+    parser.add_argument("out_dir", type=Path, help="Build output directory")
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=os.cpu_count() or 1,
+        help="Worker processes for content entries (default: CPU count, 1: serial)",
+    )
+    parser.add_argument(
+        "--no-bbox-cache", action="store_true",
+        help="Parse every waypoint/airspace file instead of reusing cached bboxes",
+    )
+    parser.add_argument(
+        "--downloads", type=int, default=8,
+        help="Concurrent OpenAIP airspace downloads (default: 8)",
+    )
+    parser.add_argument(
+        "--openaip-url", default=OPENAIP_URL,
+        help="OpenAIP bucket URL (e.g. a local stand-in server for testing)",
+    )
+    args = parser.parse_args()
+
+    if not args.no_bbox_cache:
+        use_bbox_cache(BBoxCache.load())
+    hashes = FileHashCache.load()
+
+    out_dir = args.out_dir
     out_dir.mkdir(parents=True, exist_ok=True)
 
     # Also process content from output directory (for OpenAIP generated files)
     out_content_dir = out_dir / Path("content")
 
     repo = ""
-    repo += generate_content(data_dir=content_dir, url=base_url + "content/")
+    repo += generate_content(data_dir=content_dir, url=base_url + "content/", jobs=args.jobs, hashes=hashes)
     # Process OpenAIP generated files from output directory, but skip OpenAIP CUP files
     # (they're handled via remote entries with bbox calculated from the generated files)
     if out_content_dir.exists():
@@ -472,10 +571,21 @@ if __name__ == "__main__":
             url=base_url + "content/",
             skip_openaip_cup=True,
             skip_if_in_dir=content_dir,
+            jobs=args.jobs,
+            hashes=hashes,
         )
-    repo += generate_source(data_dir=source_dir, url=base_url + "source/")
+    tile_dir = out_content_dir / "waypoint" / "tile"
+    if (tile_dir / TILE_INDEX).exists():
+        repo += generate_tiles(tile_dir, url=base_url + "content/waypoint/tile/")
+    repo += generate_source(
+        data_dir=source_dir, url=base_url + "source/", out_source_dir=out_dir / "source", hashes=hashes
+    )
     repo += generate_remote(data_dir=remote_dir, out_content_dir=out_content_dir)
-    repo += generate_asp_openaip()
+    repo += generate_asp_openaip(base_url=args.openaip_url, jobs=args.downloads)
+
+    if _bbox_cache is not None:
+        _bbox_cache.save()
+    hashes.save()
 
     out_path = out_dir / "repository"
 
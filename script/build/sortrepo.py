@@ -2,6 +2,9 @@
 
 import sys
 
+# Keys that parse_record() always returns
+FIELDS = ("name", "uri", "type", "area", "description", "update", "bbox")
+
 
 def parse_record(record_lines):
     name = ""
@@ -11,6 +14,8 @@ def parse_record(record_lines):
     description = ""
     update = ""
     bbox = ""
+    # Any other key=value lines, in order of appearance
+    extra = {}
 
     for line in record_lines:
         if line.startswith("name="):
@@ -33,6 +38,9 @@ def parse_record(record_lines):
         elif line.startswith("bbox="):
             bbox = line.split("=")[1]
             bbox = bbox.strip()
+        elif "=" in line:
+            key, _, value = line.partition("=")
+            extra[key.strip()] = value.strip()
 
     return {
         "name": name,
@@ -42,6 +50,7 @@ def parse_record(record_lines):
         "description": description,
         "update": update,
         "bbox": bbox,
+        **extra,
     }
 
 
@@ -94,6 +103,10 @@ def format_records(records):
         if record["bbox"]:
             formatted_record.append("bbox={}".format(record["bbox"]))
         formatted_record.append("update={}".format(record["update"]))
+        # Keys without a fixed place (e.g. size, sha256), in their original order
+        for key, value in record.items():
+            if key not in FIELDS and value:
+                formatted_record.append("{}={}".format(key, value))
         formatted_record.append("")
         formatted_records.append("\n".join(formatted_record))
 
@@ -0,0 +1,252 @@
+#!/bin/env python3
+"""
+Export all waypoints and airspaces into one SQLite database with R*Tree indexes:
+
+    ./script/build/sqlite_export.py output/xcsoar.sqlite data/content/ output/content/
+
+Waypoint (.cup) and airspace (OpenAir .txt) files are read from the
+waypoint/ and airspace/ directories of each content root; a file found at the
+same relative path in an earlier root is not read again.  The merged global
+waypoint file (MERGED_WAYPOINTS) is not read at all: its waypoints are those
+of the country files.  Files are parsed with the aerofiles readers in worker
+processes and bulk loaded in a single transaction.
+
+The R*Tree tables make bbox queries cheap, e.g. all waypoints within 50 km:
+
+    SELECT w.* FROM waypoints w JOIN waypoints_rtree r ON w.id = r.id
+    WHERE r.min_lat <= :north AND r.max_lat >= :south AND r.min_lon <= :east AND r.max_lon >= :west
+
+see waypoints_near().
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import math
+import os
+from pathlib import Path
+import sqlite3
+from typing import List, Optional, Tuple
+
+from aerofiles.openair.reader import Reader as OpenAirReader
+
+from dedup_waypoints import EARTH_RADIUS, M_PER_DEG, decode_rows, elevation_m
+from openair_scan import _bearing_point
+from repository import _extract_coords_from_airspace
+from waypoint_tiles import TILE_INDEX
+
+SCHEMA = """
+CREATE TABLE sources (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    type TEXT NOT NULL
+);
+CREATE TABLE waypoints (
+    id INTEGER PRIMARY KEY,
+    source_id INTEGER NOT NULL REFERENCES sources(id),
+    name TEXT NOT NULL,
+    code TEXT,
+    country TEXT,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    elevation REAL,          -- metres
+    style INTEGER NOT NULL,
+    runway_direction INTEGER,
+    runway_length REAL,      -- metres
+    frequency TEXT,
+    description TEXT
+);
+CREATE VIRTUAL TABLE waypoints_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+CREATE TABLE airspaces (
+    id INTEGER PRIMARY KEY,
+    source_id INTEGER NOT NULL REFERENCES sources(id),
+    name TEXT,
+    class TEXT,
+    airspace_type TEXT,
+    floor TEXT,
+    ceiling TEXT,
+    frequency TEXT,
+    min_lat REAL,
+    min_lon REAL,
+    max_lat REAL,
+    max_lon REAL,
+    elements TEXT            -- aerofiles elements as JSON
+);
+CREATE VIRTUAL TABLE airspaces_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+"""
+
+# Metres per runway length unit of aerofiles
+LENGTH_UNITS = {None: 1.0, "m": 1.0, "nm": 1852.0, "ml": 1609.344}
+
+# Merge of the country files by merge_waypoints.py, relative to a content root
+MERGED_WAYPOINTS = Path("waypoint/global/xcsoar_waypoints.cup")
+
+WaypointRow = Tuple
+AirspaceRow = Tuple
+
+
+def find_sources(content_dirs: List[Path]) -> List[Tuple[str, Path]]:
+    """Return (type, path) of the waypoint and airspace files of content_dirs, first root wins."""
+    seen = set()
+    rv = []
+    for content_dir in content_dirs:
+        for xcs_type, pattern in (("waypoint", "*.cup"), ("airspace", "*.txt")):
+            type_dir = content_dir / xcs_type
+            if not type_dir.is_dir():
+                continue
+            for geo in sorted(type_dir.iterdir()):
+                if not geo.is_dir() or geo.name == "0_META" or (geo / TILE_INDEX).exists():
+                    continue
+                for path in sorted(geo.glob(pattern)):
+                    relative = path.relative_to(content_dir)
+                    if relative != MERGED_WAYPOINTS and relative not in seen:
+                        seen.add(relative)
+                        rv.append((xcs_type, path))
+    return rv
+
+
+def _length_m(length: dict) -> Optional[float]:
+    if length["value"] is None:
+        return None
+    return length["value"] * LENGTH_UNITS[(length["unit"] or "m").lower()]
+
+
+def read_cup(path: Path) -> List[WaypointRow]:
+    """Return the waypoints table rows (without ids) of .cup file path."""
+    return [
+        (
+            wp["name"], wp["code"], wp["country"], wp["latitude"], wp["longitude"],
+            elevation_m(wp), wp["style"], wp["runway_direction"], _length_m(wp["runway_length"]),
+            wp["frequency"], wp["description"],
+        )
+        for wp, _, _, _ in decode_rows(path)
+    ]
+
+
+def airspace_bbox(airspace: dict) -> Optional[Tuple[float, float, float, float]]:
+    """Return (min_lat, min_lon, max_lat, max_lon) of an aerofiles airspace, None if it has no geometry.
+
+    Circles and arcs are padded by their radius around the center.
+    """
+    lons, lats = [], []
+    _extract_coords_from_airspace(airspace, lons, lats)
+    for element in airspace.get("elements", []):
+        radius = element.get("radius")
+        if element.get("type") in ("circle", "arc") and radius:
+            for bearing in (0, 90, 180, 270):
+                lat, lon = _bearing_point(element["center"], radius, bearing)
+                lats.append(lat)
+                lons.append(lon)
+        elif element.get("type") == "arc":
+            for point in (element["start"], element["end"]):
+                lats.append(point[0])
+                lons.append(point[1])
+    if not lats:
+        return None
+    return min(lats), min(lons), max(lats), max(lons)
+
+
+def read_openair(path: Path) -> List[AirspaceRow]:
+    """Return the airspaces table rows (without ids) of OpenAir file path."""
+    rows = []
+    errors = 0
+    with open(path, encoding="utf-8-sig", errors="replace") as fp:
+        for record, error in OpenAirReader(fp):
+            if error:
+                errors += 1
+                continue
+            if record["type"] != "airspace":
+                continue
+            bbox = airspace_bbox(record) or (None, None, None, None)
+            rows.append((
+                record.get("name"), record.get("class"), record.get("airspace_type"),
+                record.get("floor"), record.get("ceiling"), record.get("freq"),
+                *bbox, json.dumps(record.get("elements", [])),
+            ))
+    if errors:
+        print(f"Warning: skipped {errors} airspaces of {path} that aerofiles cannot read")
+    return rows
+
+
+def _read_source(xcs_type: str, path: Path) -> list:
+    return read_cup(path) if xcs_type == "waypoint" else read_openair(path)
+
+
+def export(content_dirs: List[Path], out_path: Path, jobs: int = 1) -> None:
+    """Write the waypoints and airspaces of content_dirs to the SQLite database out_path."""
+    sources = find_sources(content_dirs)
+    if jobs > 1 and len(sources) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_read_source, *zip(*sources)))
+    else:
+        results = [_read_source(*source) for source in sources]
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+    db = sqlite3.connect(tmp_path)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.executescript(SCHEMA)
+    waypoints = airspaces = 0
+    with db:
+        for source_id, ((xcs_type, path), rows) in enumerate(zip(sources, results), 1):
+            db.execute("INSERT INTO sources VALUES (?, ?, ?)", (source_id, str(path), xcs_type))
+            if xcs_type == "waypoint":
+                db.executemany(
+                    "INSERT INTO waypoints VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((source_id, *row) for row in rows),
+                )
+                waypoints += len(rows)
+            else:
+                db.executemany(
+                    "INSERT INTO airspaces VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((source_id, *row) for row in rows),
+                )
+                airspaces += len(rows)
+        db.execute("INSERT INTO waypoints_rtree SELECT id, lat, lat, lon, lon FROM waypoints")
+        db.execute(
+            "INSERT INTO airspaces_rtree SELECT id, min_lat, max_lat, min_lon, max_lon"
+            " FROM airspaces WHERE min_lat IS NOT NULL"
+        )
+    db.execute("ANALYZE")
+    db.close()
+    os.replace(tmp_path, out_path)
+    print(f"Created: {out_path} ({waypoints} waypoints, {airspaces} airspaces from {len(sources)} files)")
+
+
+def distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Return the great circle distance between two points in metres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    h = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+
+def waypoints_near(db: sqlite3.Connection, lat: float, lon: float, radius_m: float) -> List[tuple]:
+    """Return (distance, id, name, code) of the waypoints within radius_m of (lat, lon), nearest first."""
+    dlat = radius_m / M_PER_DEG
+    dlon = dlat / max(math.cos(math.radians(min(abs(lat) + dlat, 90.0))), 1e-6)
+    rows = db.execute(
+        "SELECT w.id, w.name, w.code, w.lat, w.lon FROM waypoints_rtree r JOIN waypoints w ON w.id = r.id"
+        " WHERE r.min_lat <= ? AND r.max_lat >= ? AND r.min_lon <= ? AND r.max_lon >= ?",
+        (lat + dlat, lat - dlat, lon + dlon, lon - dlon),
+    )
+    near = [(distance(lat, lon, w_lat, w_lon), id_, name, code) for id_, name, code, w_lat, w_lon in rows]
+    return sorted(n for n in near if n[0] <= radius_m)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export waypoints and airspaces to SQLite.")
+    parser.add_argument("output", type=Path, help="SQLite database file")
+    parser.add_argument(
+        "content_dirs", type=Path, nargs="+",
+        help="Content roots (with waypoint/ and airspace/ directories); earlier roots win",
+    )
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=os.cpu_count() or 1,
+        help="Worker processes for parsing (default: CPU count, 1: serial)",
+    )
+    args = parser.parse_args()
+    export(args.content_dirs, args.output, args.jobs)
@@ -0,0 +1,285 @@
+#!/bin/env python3
+"""
+Compile waypoint files into a memory-mappable columnar store, and read it:
+
+    ./script/build/waypoint_store.py data/content/waypoint/country/ output/content/waypoint/0_META/xcsoar_waypoints.wpstore
+
+    with WaypointStore("xcsoar_waypoints.wpstore") as store:
+        for i in store.in_bbox(6.0, 50.5, 6.5, 51.0):
+            print(store.name(i), store.lat[i], store.lon[i])
+
+File layout (little-endian, every section 8-byte aligned):
+
+    header       magic, waypoint count, grid cell size (degrees), section count
+    sections     (offset, length) in bytes of each section of SECTIONS
+    lat, lon     float64 degrees
+    elevation    float32 metres (NaN: unknown)
+    style        uint8 (aerofiles style, 0: unknown)
+    source_ids   uint16 index into the sources table
+    name_offsets uint32 * (count + 1) into strings; name i is strings[off[i]:off[i + 1]]
+    code_offsets uint32 * (count + 1) into strings
+    strings      UTF-8 names and codes
+    name_index   uint32 waypoint indexes, sorted by case-folded name
+    cell_keys    uint32 grid cell keys, sorted; waypoints are stored grouped by cell
+    cell_starts  uint32 * (cells + 1): waypoints of cell_keys[k] are cell_starts[k]:cell_starts[k + 1]
+    sources      UTF-8 JSON list of the source file names
+
+The reader maps the file and exposes the columns as zero-copy NumPy arrays
+(or memoryviews if NumPy is not installed).
+"""
+
+import argparse
+from array import array
+import bisect
+import json
+import math
+import mmap
+import os
+from pathlib import Path
+import struct
+import sys
+from typing import List, Tuple
+
+from dedup_waypoints import Waypoint, load_sources
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b"XCSWPT\x00\x01"
+HEADER = struct.Struct("<8sIdI")
+SECTION = struct.Struct("<QQ")
+
+# Section names and array typecodes (None: raw bytes)
+SECTIONS: Tuple[Tuple[str, str], ...] = (
+    ("lat", "d"),
+    ("lon", "d"),
+    ("elevation", "f"),
+    ("style", "B"),
+    ("source_ids", "H"),
+    ("name_offsets", "I"),
+    ("code_offsets", "I"),
+    ("strings", None),
+    ("name_index", "I"),
+    ("cell_keys", "I"),
+    ("cell_starts", "I"),
+    ("sources", None),
+)
+
+# Default grid cell size in degrees
+CELL_SIZE = 1.0
+
+
+def check_cell_size(cell_size: float) -> None:
+    """Raise ValueError if the grid of cell_size has no uint32 key for every cell."""
+    if not cell_size > 0:
+        raise ValueError(f"Grid cell size must be positive: {cell_size}")
+    cells = math.ceil(360 / cell_size) * math.ceil(180 / cell_size)
+    if cells > 2 ** 32:
+        raise ValueError(f"Grid cell size too small ({cells} cells, cell keys are uint32): {cell_size}")
+
+
+def cell_key(lat: float, lon: float, cell_size: float) -> int:
+    """Return the key of the grid cell containing (lat, lon)."""
+    columns = math.ceil(360 / cell_size)
+    rows = math.ceil(180 / cell_size)
+    row = min(max(math.floor((lat + 90) / cell_size), 0), rows - 1)
+    column = min(max(math.floor((lon + 180) / cell_size), 0), columns - 1)
+    return row * columns + column
+
+
+def _pad(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 8)
+
+
+def compile_store(waypoints: List[Waypoint], sources: List[str], out_path: Path,
+                  cell_size: float = CELL_SIZE) -> None:
+    """Write waypoints to out_path in the store format."""
+    check_cell_size(cell_size)
+    order = sorted(range(len(waypoints)), key=lambda i: cell_key(waypoints[i].latitude, waypoints[i].longitude, cell_size))
+    waypoints = [waypoints[i] for i in order]
+    columns = {name: array(typecode) for name, typecode in SECTIONS if typecode}
+
+    strings = bytearray()
+    codes = []
+    for wp in waypoints:
+        columns["lat"].append(wp.latitude)
+        columns["lon"].append(wp.longitude)
+        columns["elevation"].append(math.nan if wp.elevation is None else wp.elevation)
+        columns["style"].append(wp.style)
+        columns["source_ids"].append(wp.source)
+        columns["name_offsets"].append(len(strings))
+        strings += wp.name.encode()
+        codes.append(wp.code.encode())
+    columns["name_offsets"].append(len(strings))
+    for code in codes:
+        columns["code_offsets"].append(len(strings))
+        strings += code
+    columns["code_offsets"].append(len(strings))
+
+    columns["name_index"].extend(sorted(range(len(waypoints)), key=lambda i: waypoints[i].name.casefold()))
+
+    previous = None
+    for i, wp in enumerate(waypoints):
+        key = cell_key(wp.latitude, wp.longitude, cell_size)
+        if key != previous:
+            columns["cell_keys"].append(key)
+            columns["cell_starts"].append(i)
+            previous = key
+    columns["cell_starts"].append(len(waypoints))
+
+    blobs = []
+    for name, typecode in SECTIONS:
+        if name == "strings":
+            blobs.append(bytes(strings))
+        elif name == "sources":
+            blobs.append(json.dumps(sources).encode())
+        else:
+            if sys.byteorder != "little":
+                columns[name].byteswap()
+            blobs.append(columns[name].tobytes())
+
+    offset = len(_pad(HEADER.pack(MAGIC, 0, 0.0, 0) + SECTION.size * len(SECTIONS) * b"\0"))
+    table = []
+    for blob in blobs:
+        table.append(SECTION.pack(offset, len(blob)))
+        offset += len(_pad(blob))
+
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(_pad(HEADER.pack(MAGIC, len(waypoints), cell_size, len(SECTIONS)) + b"".join(table)))
+        for blob in blobs:
+            f.write(_pad(blob))
+    os.replace(tmp_path, out_path)
+
+
+class WaypointStore:
+    """Read-only, memory-mapped view of a waypoint store file."""
+
+    def __init__(self, path: Path):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.cell_size, sections = HEADER.unpack_from(self._map)
+        if magic != MAGIC or sections != len(SECTIONS):
+            raise ValueError(f"Not a waypoint store: {path}")
+        self._buffer = memoryview(self._map)
+        for k, (name, typecode) in enumerate(SECTIONS):
+            offset, length = SECTION.unpack_from(self._map, HEADER.size + k * SECTION.size)
+            setattr(self, name, self._view(offset, length, typecode))
+        self.sources = json.loads(bytes(self.sources))
+
+    def _view(self, offset: int, length: int, typecode: str):
+        data = self._buffer[offset:offset + length]
+        if typecode is None:
+            return data
+        if numpy is not None:
+            return numpy.frombuffer(data, dtype=numpy.dtype(typecode).newbyteorder("<"))
+        if sys.byteorder != "little":
+            raise ValueError("Reading a waypoint store on a big-endian host requires NumPy")
+        return data.cast(typecode)
+
+    def close(self) -> None:
+        """Release the views and unmap the file.
+
+        Arrays taken from the store (e.g. lat = store.lat) stay valid after
+        close(): the file is then unmapped when the last of them is released.
+        """
+        for name, _ in SECTIONS:
+            if name != "sources":
+                setattr(self, name, None)
+        self._buffer.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # Views are still held elsewhere: the mapping goes with the last of them
+            pass
+        self._map = None
+        self._file.close()
+
+    def __enter__(self) -> "WaypointStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _string(self, offsets, i: int) -> str:
+        return bytes(self.strings[offsets[i]:offsets[i + 1]]).decode()
+
+    def name(self, i: int) -> str:
+        """Return the name of waypoint i."""
+        return self._string(self.name_offsets, i)
+
+    def code(self, i: int) -> str:
+        """Return the code of waypoint i ("" if none)."""
+        return self._string(self.code_offsets, i)
+
+    def source(self, i: int) -> str:
+        """Return the source file name of waypoint i."""
+        return self.sources[int(self.source_ids[i])]
+
+    def find_name(self, name: str) -> List[int]:
+        """Return the indexes of the waypoints named name (case-insensitive)."""
+        key = name.casefold()
+        index = self.name_index
+        start = bisect.bisect_left(index, key, key=lambda i: self.name(i).casefold())
+        end = bisect.bisect_right(index, key, lo=start, key=lambda i: self.name(i).casefold())
+        return sorted(int(i) for i in index[start:end])
+
+    def cell(self, lat: float, lon: float) -> range:
+        """Return the indexes of the waypoints in the grid cell containing (lat, lon)."""
+        key = cell_key(lat, lon, self.cell_size)
+        k = bisect.bisect_left(self.cell_keys, key)
+        if k == len(self.cell_keys) or self.cell_keys[k] != key:
+            return range(0)
+        return range(int(self.cell_starts[k]), int(self.cell_starts[k + 1]))
+
+    def in_bbox(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> List[int]:
+        """Return the indexes of the waypoints inside the bbox, visiting only the cells it overlaps.
+
+        A bbox with min_lon > max_lon crosses the antimeridian (e.g. 170,-50,-170,-30).
+        """
+        if min_lon > max_lon:
+            return self._in_bbox(min_lon, min_lat, 180.0, max_lat) + self._in_bbox(-180.0, min_lat, max_lon, max_lat)
+        return self._in_bbox(min_lon, min_lat, max_lon, max_lat)
+
+    def _in_bbox(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> List[int]:
+        columns = math.ceil(360 / self.cell_size)
+        first, last = cell_key(min_lat, min_lon, self.cell_size), cell_key(max_lat, max_lon, self.cell_size)
+        rv = []
+        for row in range(first // columns, last // columns + 1):
+            row_start = row * columns + first % columns
+            k = bisect.bisect_left(self.cell_keys, row_start)
+            while k < len(self.cell_keys) and self.cell_keys[k] <= row * columns + last % columns:
+                for i in range(int(self.cell_starts[k]), int(self.cell_starts[k + 1])):
+                    if min_lat <= self.lat[i] <= max_lat and min_lon <= self.lon[i] <= max_lon:
+                        rv.append(i)
+                k += 1
+        return rv
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile .cup files into a memory-mappable waypoint store.")
+    parser.add_argument("sources", type=Path, nargs="+", help=".cup files or directories")
+    parser.add_argument("output", type=Path, help="Waypoint store file")
+    parser.add_argument(
+        "--cell-size", type=float, default=CELL_SIZE,
+        help=f"Grid cell size in degrees (default: {CELL_SIZE})",
+    )
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=os.cpu_count() or 1,
+        help="Worker processes for parsing (default: CPU count, 1: serial)",
+    )
+    args = parser.parse_args()
+    try:
+        check_cell_size(args.cell_size)
+    except ValueError as e:
+        parser.error(str(e))
+
+    paths, waypoints = load_sources(args.sources, args.jobs)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    compile_store(waypoints, [p.name for p in paths], args.output, args.cell_size)
+    print(f"Created: {args.output} ({len(waypoints)} waypoints from {len(paths)} files)")
@@ -0,0 +1,179 @@
+#!/bin/env python3
+"""
+Partition all waypoints into geographic tiles for partial downloads:
+
+    ./script/build/waypoint_tiles.py data/content/waypoint/country/ output/content/waypoint/tile/
+
+The world is split into an adaptive quadtree: a cell with more than
+--max-waypoints waypoints is divided into four, until every cell holds at most
+that many (or a maximum depth is reached).  Each non-empty cell becomes one
+.cup file named after its quadkey (digits 0-3 for the SW, SE, NW and NE
+quarters), and tiles.json indexes them with their bbox, waypoint count, size
+and SHA-256.  repository.generate_tiles() lists the tiles from that index.
+
+The area of a tile is the country of the input files its waypoints come from
+(e.g. "de" for DE-WPT-National-XCSoar.cup), empty if there are several.
+
+Every input file is read once, row by row, and its waypoints are inserted
+into the tree as they are parsed.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from iso3166 import countries
+
+from cup_scan import CoordStats
+from dedup_waypoints import Waypoint, read_waypoints
+from git_index import git_commit_datetime
+from merge_waypoints import CUP_HEADER, sort_key
+
+TILE_INDEX = "tiles.json"
+
+# Cells this deep (about 1 km wide) are never split further
+MAX_DEPTH = 15
+
+
+def tile_name(quadkey: str) -> str:
+    """Return the .cup file name of the tile at quadkey."""
+    return f"WPT-Tile-{quadkey or 'World'}.cup"
+
+
+def file_area(path: Path) -> str:
+    """Return the ISO 3166-1 alpha-2 code path's name starts with (lower case), else empty string."""
+    prefix = path.name.split("-")[0]
+    try:
+        country = countries.get(prefix)
+    except KeyError:
+        return ""
+    return prefix.lower() if country.alpha2.lower() == prefix.lower() else ""
+
+
+class QuadTree:
+    """Quadtree cell covering [west, east) x [south, north)."""
+
+    def __init__(self, west: float, south: float, east: float, north: float,
+                 max_waypoints: int, quadkey: str = ""):
+        self.bounds = (west, south, east, north)
+        self.max_waypoints = max_waypoints
+        self.quadkey = quadkey
+        self.waypoints: List[Waypoint] = []
+        self.children: Optional[List["QuadTree"]] = None
+
+    def _child(self, wp: Waypoint) -> "QuadTree":
+        west, south, east, north = self.bounds
+        index = (wp.longitude >= (west + east) / 2) + 2 * (wp.latitude >= (south + north) / 2)
+        return self.children[index]
+
+    def _split(self) -> None:
+        west, south, east, north = self.bounds
+        mid_lon, mid_lat = (west + east) / 2, (south + north) / 2
+        self.children = [
+            QuadTree(*bounds, self.max_waypoints, self.quadkey + str(i))
+            for i, bounds in enumerate((
+                (west, south, mid_lon, mid_lat),
+                (mid_lon, south, east, mid_lat),
+                (west, mid_lat, mid_lon, north),
+                (mid_lon, mid_lat, east, north),
+            ))
+        ]
+        waypoints, self.waypoints = self.waypoints, []
+        for wp in waypoints:
+            self._child(wp).insert(wp)
+
+    def insert(self, wp: Waypoint) -> None:
+        node = self
+        while node.children is not None:
+            node = node._child(wp)
+        node.waypoints.append(wp)
+        if len(node.waypoints) > node.max_waypoints and len(node.quadkey) < MAX_DEPTH:
+            node._split()
+
+    def leaves(self) -> Iterator["QuadTree"]:
+        """Yield the non-empty leaf cells in quadkey order."""
+        if self.children is None:
+            if self.waypoints:
+                yield self
+            return
+        for child in self.children:
+            yield from child.leaves()
+
+
+def world(max_waypoints: int) -> QuadTree:
+    """Return an empty quadtree covering the whole world."""
+    return QuadTree(-180.0, -90.0, 180.0, 90.0, max_waypoints)
+
+
+def write_tile(leaf: QuadTree, out_dir: Path, areas: List[str]) -> dict:
+    """Write leaf's waypoints (sorted like xcsoar_waypoints.cup) and return its index entry.
+
+    areas holds the area of each input file, by waypoint source.
+    """
+    lines = sorted({wp.line.encode() for wp in leaf.waypoints}, key=lambda line: (sort_key(line[:-1]), line))
+    data = CUP_HEADER + b"\n" + b"".join(lines)
+    path = out_dir / tile_name(leaf.quadkey)
+    path.write_bytes(data)
+
+    stats = CoordStats()
+    for wp in leaf.waypoints:
+        stats.add(wp.latitude, wp.longitude)
+    tile_areas = {areas[wp.source] for wp in leaf.waypoints}
+    return {
+        "name": path.name,
+        "quadkey": leaf.quadkey,
+        "bounds": list(leaf.bounds),
+        "bbox": stats.bbox(),
+        "count": len(lines),
+        "size": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "area": tile_areas.pop() if len(tile_areas) == 1 else "",
+    }
+
+
+def build_tiles(in_dir: Path, out_dir: Path, max_waypoints: int, jobs: int = 1) -> List[dict]:
+    """Write the tiles of in_dir's .cup files and their index to out_dir; return the index entries."""
+    paths = sorted(in_dir.glob("*.cup"))
+    tree = world(max_waypoints)
+    if jobs > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for waypoints in pool.map(read_waypoints, paths, range(len(paths))):
+                for wp in waypoints:
+                    tree.insert(wp)
+    else:
+        for i, p in enumerate(paths):
+            for wp in read_waypoints(p, i):
+                tree.insert(wp)
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for stale in out_dir.glob("WPT-Tile-*.cup"):
+        stale.unlink()
+    areas = [file_area(p) for p in paths]
+    tiles = [write_tile(leaf, out_dir, areas) for leaf in tree.leaves()]
+
+    update = max(git_commit_datetime(p) for p in paths).date().isoformat() if paths else ""
+    index = {"max_waypoints": max_waypoints, "update": update, "tiles": tiles}
+    with open(out_dir / TILE_INDEX, "w") as f:
+        json.dump(index, f, indent=2)
+    print(f"Created: {len(tiles)} tiles and {out_dir / TILE_INDEX}")
+    return tiles
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Partition waypoints into quadtree tiles.")
+    parser.add_argument("wp_dir", type=Path, help="Directory of the .cup files")
+    parser.add_argument("tile_dir", type=Path, help="Output directory of the tiles and their index")
+    parser.add_argument(
+        "--max-waypoints", "-n", type=int, default=2000,
+        help="Split tiles holding more waypoints than this (default: 2000)",
+    )
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=os.cpu_count() or 1,
+        help="Worker processes for parsing (default: CPU count, 1: serial)",
+    )
+    args = parser.parse_args()
+    build_tiles(args.wp_dir, args.tile_dir, args.max_waypoints, args.jobs)
@@ -8,56 +8,111 @@ xcsoar-data-content/waypoints/waypoints_compact.js
 (partially) http://download.xcsoar.org/repository
 """
 
-import datetime
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import io
 import json
+import os
 from pathlib import Path
-import subprocess
 import sys
+from typing import Dict, Optional
 
-from aerofiles.seeyou.reader import Reader as CupReader
+from aerofiles.errors import ParserError
+from aerofiles.seeyou.reader import RE_ELEVATION
 from iso3166 import countries
 
+from cup_scan import CoordStats, scan_rows
+
+
+# Metres per foot, for elevations given in ft
+FT = 0.3048
+
+
+class WaypointStats(CoordStats):
+    """Everything the waypoint artefacts need from one .cup file, gathered in one pass."""
+
+    def __init__(self):
+        super().__init__()
+        self.lines = 0
+        self.styles = Counter()
+        self.min_elevation = float("inf")
+        self.max_elevation = float("-inf")
+
+    def add_fields(self, fields: list, columns: dict) -> None:
+        super().add_fields(fields, columns)
+        # Style and elevation only feed the statistics: ignore values aerofiles would reject.
+        try:
+            style = int(fields[columns["style"]].strip())
+            self.styles[style if 1 <= style <= 17 else 0] += 1
+        except (IndexError, ValueError):
+            pass
+        match = RE_ELEVATION.match(fields[columns["elev"]].strip()) if len(fields) > columns["elev"] else None
+        if match and match.group(1) not in ("", "-"):
+            elevation = float(match.group(1))
+            if (match.group(2) or "").lower() == "ft":
+                elevation *= FT
+            self.min_elevation = min(self.min_elevation, elevation)
+            self.max_elevation = max(self.max_elevation, elevation)
+
+    def as_json(self) -> dict:
+        """Return the statistics as a JSON-serialisable dict."""
+        has_elevation = self.min_elevation <= self.max_elevation
+        return {
+            "lines": self.lines,
+            "waypoints": self.count,
+            "average": self.mean() if self.count else None,
+            "bbox": [self.min_lon, self.min_lat, self.max_lon, self.max_lat] if self.count else None,
+            "styles": {str(k): v for k, v in sorted(self.styles.items())},
+            "elevation": [self.min_elevation, self.max_elevation] if has_elevation else None,
+        }
 
-def file_length(in_file: Path) -> int:
-    """Return in_file's line count."""
-    with open(in_file) as fp:
-        x = len(fp.readlines())
-    return x
-
-
-def git_commit_datetime(filename: Path) -> datetime.datetime:
-    """Return naive UTC datetime of filename's last git commit."""
-    cmd = ["git", "log", "-1", "--format=%ct", "--", filename]
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    out, _ = p.communicate()
-    return datetime.datetime.utcfromtimestamp(int(out))
 
+def count_lines(text: str) -> int:
+    """Return text's line count, as readlines() with universal newlines would."""
+    lines = text.count("\n") + text.count("\r") - text.count("\r\n")
+    if text and not text.endswith(("\n", "\r")):
+        lines += 1
+    return lines
 
-def waypoint_mean(filename: Path) -> tuple:
-    """Return the (latitude, longitude) tuple mean of waypoint filename."""
 
+def waypoint_stats(filename: Path) -> Optional[WaypointStats]:
+    """Return the WaypointStats of waypoint filename (read once), or None if it fails to parse."""
     try:
-        waypoints = CupReader().read(open(filename))["waypoints"]
-    except:
-        print("Failing file: " + str(filename))
-        sys.exit()
+        text = filename.read_text(encoding="utf-8")
+        stats = scan_rows(csv.reader(io.StringIO(text, newline="")), WaypointStats())
+    except (OSError, ValueError, IndexError, ParserError):
+        return None
+    stats.lines = count_lines(text)
+    return stats
+
+
+def gather_stats(in_dir: Path, jobs: int = 1) -> Dict[str, WaypointStats]:
+    """Return {stem: WaypointStats} of in_dir's .cup files, computed by jobs processes."""
+    paths = sorted(in_dir.glob("*.cup"))
+    if jobs > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(waypoint_stats, paths))
+    else:
+        results = [waypoint_stats(p) for p in paths]
 
-    cum_lat, cum_lon, count = 0.0, 0.0, 0
-    for wp in waypoints:
-        count += 1
-        cum_lat += wp["latitude"]
-        cum_lon += wp["longitude"]
-
-    return cum_lat / count, cum_lon / count
+    rv = {}
+    for p, stats in zip(paths, results):
+        if stats is None or not stats.count:
+            print("Failing file: " + str(p))
+            sys.exit()
+        rv[p.stem] = stats
+    return rv
 
 
-def gen_waypoints_js(in_dir: Path, out_path: Path) -> None:
+def gen_waypoints_js(stats: Dict[str, WaypointStats], out_path: Path) -> None:
     """Generate http://download.xcsoar.org/waypoints/waypoints.js"""
     rv = {}
-    for p in sorted(in_dir.glob("*.cup")):
-        rv[p.stem] = {
-            "size": file_length(p),
-            "average": waypoint_mean(p),
+    for stem, s in stats.items():
+        rv[stem] = {
+            "size": s.lines,
+            "average": s.mean(),
         }
 
     with open(out_path, "w") as f:
@@ -70,11 +125,11 @@ def gen_waypoints_js(in_dir: Path, out_path: Path) -> None:
     print(f"Created: {out_path}")
 
 
-def gen_waypoints_compact_js(in_dir: Path, out_path: Path) -> None:
+def gen_waypoints_compact_js(stats: Dict[str, WaypointStats], out_path: Path) -> None:
     """Generate http://download.xcsoar.org/waypoints/waypoints_compact.js"""
     rv = {}
-    for p in sorted(in_dir.glob("*.cup")):
-        rv[p.stem] = file_length(p)
+    for stem, s in stats.items():
+        rv[stem] = s.lines
 
     with open(out_path, "w") as f:
         f.write("var WAYPOINTS = ")  # TODO: Use json rather than js.
@@ -86,6 +141,14 @@ def gen_waypoints_compact_js(in_dir: Path, out_path: Path) -> None:
     print(f"Created: {out_path}")
 
 
+def gen_waypoints_stats_json(stats: Dict[str, WaypointStats], out_path: Path) -> None:
+    """Generate waypoints_stats.json: per-file lines, waypoints, mean, bbox, styles and elevation range."""
+    rv = {stem: s.as_json() for stem, s in stats.items()}
+    with open(out_path, "w") as f:
+        json.dump(rv, f, indent=2)
+    print(f"Created: {out_path}")
+
+
 def guess_area(name: str) -> str:
     """From name (e.g. USA_PG_REG1-4), try to guess and return the ISO3166.1-alpha2 code, else empty string."""
     area = ""
@@ -98,9 +161,22 @@ def guess_area(name: str) -> str:
 
 
 if __name__ == "__main__":
-    wp_dir = Path(sys.argv[1])
-    gen_dir = Path(sys.argv[2])
-    gen_dir.mkdir(parents=True, exist_ok=True)
-
-    gen_waypoints_js(wp_dir, gen_dir / Path("waypoints.js"))
-    gen_waypoints_compact_js(wp_dir, gen_dir / Path("waypoints_compact.js"))
+    parser = argparse.ArgumentParser(description="Generate the waypoint web site artefacts.")
+    parser.add_argument("wp_dir", type=Path, help="Directory of the .cup files")
+    parser.add_argument("gen_dir", type=Path, help="Output directory")
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=os.cpu_count() or 1,
+        help="Worker processes (default: CPU count, 1: serial)",
+    )
+    parser.add_argument(
+        "--stats-json", action="store_true",
+        help="Also write waypoints_stats.json with the full per-file statistics",
+    )
+    args = parser.parse_args()
+    args.gen_dir.mkdir(parents=True, exist_ok=True)
+
+    stats = gather_stats(args.wp_dir, args.jobs)
+    gen_waypoints_js(stats, args.gen_dir / Path("waypoints.js"))
+    gen_waypoints_compact_js(stats, args.gen_dir / Path("waypoints_compact.js"))
+    if args.stats_json:
+        gen_waypoints_stats_json(stats, args.gen_dir / Path("waypoints_stats.json"))
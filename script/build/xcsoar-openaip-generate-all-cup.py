@@ -1,16 +1,29 @@
 #!/bin/env python3
 
-import requests
-import re
 import argparse
+import codecs
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import os
 import json
+import tempfile
+import time
+import requests
 from iso3166 import countries
 
+from http_pool import TIMEOUT, make_session
+from openaip_index import OPENAIP_URL, OpenAIPIndex
+
 # Function to parse command line arguments
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Process OpenAIP data files.")
     parser.add_argument("output", help="Directory to save the files to")
+    parser.add_argument("--openaip-url", default=OPENAIP_URL, help="OpenAIP bucket URL")
+    parser.add_argument("--jobs", type=int, default=8, help="Concurrent downloads")
+    parser.add_argument(
+        "--max-inflight-mb", type=int, default=64,
+        help="Memory cap (MiB) for downloaded bodies not yet written (larger ones spill to disk)",
+    )
     return parser.parse_args()
 
 # Function to ensure directories exist
@@ -18,72 +31,167 @@ def ensure_directories(output_dir, metajson_dir):
     os.makedirs(output_dir, exist_ok=True)
     os.makedirs(metajson_dir, exist_ok=True)
 
-# Function to fetch data from the server with pagination
-def fetch_data(base_url):
-    url = base_url
-    openaip_index = ""
-    while True:
-        response = requests.get(url)
-        xml_data = response.text
-        openaip_index += xml_data
-
-        # Search for the NextMarker tag in the XML data
-        match = re.search(r"<NextMarker>(.*?)</NextMarker>", xml_data)
-        if not match:
-            break
-        next_marker = match.group(1)
-        url = f"{base_url}?marker={next_marker}"
-
-    return openaip_index
-
-# Function to process a single content block
-def process_content_block(content, base_url, output_dir, metajson_dir):
-    key = re.search(r"<Key>(.*?)</Key>", content)
-    if not key or not re.search(r"\.cup$", key.group(1)):
+# Result of downloading one index entry: body is a spooled file, or None on error
+Download = namedtuple("Download", "entry body encoding size seconds error")
+
+# Function to download one index entry into a spooled buffer, retrying broken transfers
+def download_entry(entry, index, spool_size, attempts=3, backoff=1.0):
+    start = time.monotonic()
+    error = None
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        # Kept in memory up to spool_size bytes, then on disk
+        body = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        try:
+            with index.session.get(index.url(entry), timeout=TIMEOUT, stream=True) as response:
+                if response.status_code != 200:
+                    # Connection errors and 429/5xx are already retried by the session
+                    body.close()
+                    return Download(entry, None, None, 0, time.monotonic() - start, f"HTTP {response.status_code}")
+                size = 0
+                for chunk in response.iter_content(1 << 16):
+                    body.write(chunk)
+                    size += len(chunk)
+                body.seek(0)
+                return Download(entry, body, response.encoding, size, time.monotonic() - start, None)
+        except requests.RequestException as e:
+            body.close()
+            error = str(e)
+    return Download(entry, None, None, 0, time.monotonic() - start, error)
+
+# Function to download index entries concurrently, yielding them in index order
+def download_all(entries, index, jobs, max_inflight_bytes):
+    # At most `window` downloads are running or waiting to be written, each holding
+    # at most `spool_size` bytes in memory.
+    window = 2 * jobs
+    spool_size = max(max_inflight_bytes // window, 1 << 16)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for entry in entries:
+            pending.append(pool.submit(download_entry, entry, index, spool_size))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+# Function to process a single downloaded index entry
+def process_download(download, writer, metajson_dir):
+    if download.body is None:
+        print(f"Warning: Could not download {download.entry.key}: {download.error}")
         return
 
-    country_code = key.group(1)[:2]
-    file_url = base_url + key.group(1)
-    cup_file_path = os.path.join(
-        output_dir, f"{country_code.upper()}-WPT-National-OpenAIP.cup"
-    )
-
-    # Download file content
-    file_content = requests.get(file_url).text
+    country_code = download.entry.key[:2]
 
-    # Write or append to the `.cup` file, filtering header lines
-    write_cup_file(cup_file_path, file_content)
+    # Stream the file content into the country's `.cup` file, filtering header lines
+    with download.body:
+        chunks = iter(lambda: download.body.read(1 << 16), b"")
+        writer.write(country_code, decode_chunks(chunks, download.encoding))
 
     # Create metadata JSON if applicable
     create_metadata(country_code, metajson_dir)
 
-# Function to write or append to a `.cup` file, filtering redundant headers
+# Function to decode a streamed response body with the charset the response
+# declares (`response.encoding`), else as UTF-8, which OpenAIP's files are in.
+# Unlike `response.text`, it does not guess a missing charset from the content
+# (`apparent_encoding`): that would need the whole body before decoding.
+def decode_chunks(chunks, encoding):
+    decoder = codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+# Function to print per-object timing and byte counts
+def print_report(downloads):
+    print(f"{'seconds':>8} {'bytes':>10}  object")
+    for d in downloads:
+        status = "" if d.error is None else f"  FAILED: {d.error}"
+        print(f"{d.seconds:8.2f} {d.size:10d}  {d.entry.key}{status}")
+    failed = sum(d.error is not None for d in downloads)
+    print(
+        f"Downloaded {len(downloads) - failed}/{len(downloads)} objects, "
+        f"{sum(d.size for d in downloads)} bytes, {sum(d.seconds for d in downloads):.1f} s total"
+    )
 
-def write_cup_file(file_path, content):
+# Function to split streamed text into lines, like `str.splitlines()` on the whole text
+def iter_lines(chunks):
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + chunk).splitlines(keepends=True)
+        pending = ""
+        # Keep an unterminated last line, or a "\r" that may start a "\r\n"
+        if lines and (lines[-1].endswith("\r") or lines[-1] == lines[-1].splitlines()[0]):
+            pending = lines.pop()
+        for line in lines:
+            yield line.splitlines()[0]
+    yield from pending.splitlines()
+
+class CupCountryWriter:
     """
-    Ensures that the header line ("name,code,country,lat,lon,...") appears only once
-    at the top of the .cup file, with the rest of the content appended below it.
-    """
-    header = "name,code,country,lat,lon,elev,style,rwdir,rwlen,rwwidth,freq,desc"
-    all_lines = []
-
-    # Read existing content from the file if it exists
-    if os.path.exists(file_path):
-        with open(file_path) as file:
-            all_lines = file.readlines()
+    Streams waypoint lines into one `.cup` file per country.
 
-    # Remove any existing headers from the file's content
-    all_lines = [line for line in all_lines if not line.startswith(header)]
+    Each file gets the header line ("name,code,country,lat,lon,...") once at the top,
+    with the content of all its chunks appended below it, minus their own headers.
+    Files are written to a temporary name and renamed into place by close();
+    if the `with` block raises, discard() deletes them and the old files stay.
+    """
 
-    # Parse new content, filtering out headers
-    new_lines = [
-        line for line in content.splitlines() if not line.startswith(header)
-    ]
+    header = "name,code,country,lat,lon,elev,style,rwdir,rwlen,rwwidth,freq,desc"
 
-    # Write the combined content back, starting with the header
-    with open(file_path, "w") as file:
-        file.write(header + "\n")
-        file.writelines(all_lines + [line + "\n" for line in new_lines])
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        # country file path -> (temporary path, open file)
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def path(self, country_code):
+        return os.path.join(
+            self.output_dir, f"{country_code.upper()}-WPT-National-OpenAIP.cup"
+        )
+
+    def _open(self, file_path):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix=".tmp")
+        file = os.fdopen(fd, "w")
+        file.write(self.header + "\n")
+        # Keep the content of a file left by a previous run
+        if os.path.exists(file_path):
+            with open(file_path) as existing:
+                file.writelines(line for line in existing if not line.startswith(self.header))
+        self.files[file_path] = (tmp_path, file)
+        return file
+
+    def write(self, country_code, chunks):
+        """Append the lines of the text chunks to the country's file."""
+        file_path = self.path(country_code)
+        file = self.files[file_path][1] if file_path in self.files else self._open(file_path)
+        for line in iter_lines(chunks):
+            if not line.startswith(self.header):
+                file.write(line + "\n")
+
+    def close(self):
+        """Flush all files and atomically move them into place."""
+        umask = os.umask(0)
+        os.umask(umask)
+        for file_path, (tmp_path, file) in self.files.items():
+            file.close()
+            os.chmod(tmp_path, 0o666 & ~umask)
+            os.replace(tmp_path, file_path)
+        self.files = {}
+
+    def discard(self):
+        """Close and delete all temporary files, leaving the country files as they were."""
+        for tmp_path, file in self.files.values():
+            file.close()
+            os.unlink(tmp_path)
+        self.files = {}
 
 # Function to create metadata JSON for a country
 def create_metadata(country_code, metajson_dir):
@@ -106,14 +214,17 @@ def main():
     # Ensure directories exist
     ensure_directories(output_dir, metajson_dir)
 
-    # Fetch data
-    base_url = "https://storage.googleapis.com/29f98e10-a489-4c82-ae5e-489dbcd4912f/"
-    openaip_index = fetch_data(base_url)
-
-    # Process each content block
-    contents = re.findall(r"<Contents>(.*?)</Contents>", openaip_index)
-    for content in contents:
-        process_content_block(content, base_url, output_dir, metajson_dir)
+    # Download the `.cup` entries of the (shared, cached) OpenAIP index
+    session = make_session(pool_size=args.jobs)
+    index = OpenAIPIndex(args.openaip_url, session=session)
+    entries = (entry for entry in index if entry.key.endswith(".cup"))
+
+    downloads = []
+    with CupCountryWriter(output_dir) as writer:
+        for download in download_all(entries, index, args.jobs, args.max_inflight_mb << 20):
+            process_download(download, writer, metajson_dir)
+            downloads.append(download._replace(body=None))
+    print_report(downloads)
 
 if __name__ == "__main__":
     main()
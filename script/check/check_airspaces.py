@@ -1,7 +1,439 @@
 #!/bin/env python3
+"""
+Check OpenAir airspace files, and directories of them, in one run:
 
+    ./script/check/check_airspaces.py output/content/airspace/ --report check-airspaces.json
+
+Each file is parsed once by aerofiles, by a pool of worker processes (largest
+files first).  Besides parse errors, every airspace is checked for these
+errors:
+
+- no geometry, circles without radius, and circles mixed with polygons,
+- polygons with fewer than three distinct vertices (OpenAir closes polygons
+  implicitly, so these are the ones that cannot be closed),
+- polygons of zero area,
+- floors above ceilings (when both refer to the same datum);
+
+and for self-intersecting polygons, found with a Shamos-Hoey sweep line in
+O(n log n) per polygon instead of testing all pairs of edges.  XCSoar draws
+those all the same, and edges that only touch (e.g. along a border and back)
+are common, so they are warnings; --strict makes them errors.  Arcs are
+approximated by chords every ARC_STEP degrees; crossings at such chords are
+marked as approximate.
+
+Lines of record types aerofiles does not know (e.g. AP) are ignored with a
+warning, so the rest of their airspace is still checked.  Coordinates XCSoar
+reads but aerofiles does not (e.g. seconds in one half and decimal minutes in
+the other) are converted before parsing, with a warning.  --report writes the
+per-file and per-airspace results as JSON.  Files unchanged since their last check are
+not parsed again, unless --full; see validation_ledger.py.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import math
+import os
+from pathlib import Path
+import re
 import sys
-from aerofiles.openair.reader import Reader as OpenAirReader
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aerofiles.openair.patterns import LOCATION_FORMAT_1, LOCATION_FORMAT_2
+from aerofiles.openair.reader import LowLevelReader, Reader as OpenAirReader
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "build"))
+
+from openair_scan import NM_PER_DEG, _bearing_distance, _bearing_point  # noqa: E402
+from validation_ledger import ValidationLedger, validator_version  # noqa: E402
+
+# Bump when the checks change: results of other versions are not reused
+VALIDATOR_VERSION = 2
+
+# Degrees between the chords approximating an arc
+ARC_STEP = 1.0
+
+# Polygons smaller than this (square nautical miles, about 3.4 m²) have zero area
+MIN_AREA = 1e-6
+
+# Feet per metre
+FT_PER_M = 3.28084
+
+RE_ALTITUDE = re.compile(
+    r"(?:FL\s*(?P<fl>\d+(?:\.\d+)?)"
+    r"|(?P<value>\d+(?:\.\d+)?)\s*(?P<unit>FT|F|M)?)"
+    r"\s*(?P<datum>MSL|AMSL|AGL|AGND|ASFC|SFC|GND|STD)?$",
+    re.IGNORECASE,
+)
+
+# Records whose value is a coordinate (DB: two of them), and V X=
+COORDINATE_RECORDS = ("DP", "DB", "DY")
+
+# A coordinate as XCSoar reads it: each half DD:MM[.mmm][:SS[.sss]], hemisphere in any case
+_LENIENT_HALF = r"(\d+):(\d+(?:\.\d*)?)(?::(\d+(?:\.\d*)?))?\s*([{}])"
+RE_LENIENT_COORDINATE = re.compile(_LENIENT_HALF.format("NSns") + r"\s*" + _LENIENT_HALF.format("EWew"))
+
+Point = Tuple[float, float]
+
+
+def parse_altitude(value: Optional[str]) -> Optional[Tuple[float, str]]:
+    """Return (feet, datum) of an AL/AH value; datum is MSL, AGL, GND or UNL.
+
+    Flight levels count as MSL, values without datum too.  None if value
+    cannot be read.
+    """
+    if not value:
+        return None
+    value = value.strip().upper()
+    if value in ("GND", "SFC") or value.startswith(("GND ", "SFC ")):
+        return 0.0, "GND"
+    if value.startswith("UNL"):
+        return math.inf, "UNL"
+    match = RE_ALTITUDE.match(value)
+    if match is None:
+        return None
+    if match["fl"] is not None:
+        return float(match["fl"]) * 100, "MSL"
+    feet = float(match["value"])
+    if match["unit"] == "M":
+        feet *= FT_PER_M
+    datum = match["datum"] or "MSL"
+    if datum in ("AGL", "AGND", "ASFC", "SFC", "GND"):
+        return feet, "GND" if feet == 0 else "AGL"
+    return feet, "MSL"
+
+
+def floor_above_ceiling(floor: Optional[str], ceiling: Optional[str]) -> bool:
+    """Return True if floor is known to be above ceiling."""
+    low, high = parse_altitude(floor), parse_altitude(ceiling)
+    if low is None or high is None or low[1] == "GND" or high[1] == "UNL":
+        return False
+    if low[1] == "UNL" or high[1] == "GND":
+        return low[0] > high[0] or low[1] != high[1]
+    return low[1] == high[1] and low[0] > high[0]
+
+
+def arc_points(center: Sequence[float], start: Sequence[float], end: Sequence[float], clockwise: bool) -> List[Point]:
+    """Return the points of the arc around center from start to end, every ARC_STEP degrees.
+
+    If start and end are at different distances from center, the radius
+    changes gradually, so the arc does not jump at its end.
+    """
+    first, radius = _bearing_distance(center, start)
+    last, end_radius = _bearing_distance(center, end)
+    sweep = (last - first) % 360 if clockwise else (first - last) % 360
+    steps = max(1, math.ceil(sweep / ARC_STEP))
+    direction = 1 if clockwise else -1
+    points = [tuple(start)]
+    points += [_bearing_point(center, radius + (end_radius - radius) * i / steps, first + direction * sweep * i / steps)
+               for i in range(1, steps)]
+    points.append(tuple(end))
+    return points
+
+
+def project(points: List[Point]) -> List[Point]:
+    """Return points as (x, y) nautical miles of a local equirectangular projection."""
+    coslat = math.cos(math.radians(sum(p[0] for p in points) / len(points)))
+    return [(lon * NM_PER_DEG * coslat, lat * NM_PER_DEG) for lat, lon in points]
+
+
+def polygon_area(xy: List[Point]) -> float:
+    """Return the (unsigned) area of the polygon xy."""
+    return abs(sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(xy, xy[1:] + xy[:1]))) / 2
+
+
+def _orientation(a: Point, b: Point, c: Point) -> float:
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+
+def _on_segment(a: Point, b: Point, p: Point) -> bool:
+    """Return True if p, collinear with a-b, lies within its bounding box."""
+    return min(a[0], b[0]) <= p[0] <= max(a[0], b[0]) and min(a[1], b[1]) <= p[1] <= max(a[1], b[1])
+
+
+def segments_intersect(a: Point, b: Point, c: Point, d: Point) -> bool:
+    """Return True if segments a-b and c-d have a point in common."""
+    o1, o2 = _orientation(a, b, c), _orientation(a, b, d)
+    o3, o4 = _orientation(c, d, a), _orientation(c, d, b)
+    if ((o1 > 0) != (o2 > 0) and o1 and o2) and ((o3 > 0) != (o4 > 0) and o3 and o4):
+        return True
+    return ((o1 == 0 and _on_segment(a, b, c)) or (o2 == 0 and _on_segment(a, b, d))
+            or (o3 == 0 and _on_segment(c, d, a)) or (o4 == 0 and _on_segment(c, d, b)))
+
+
+def self_intersection(xy: List[Point]) -> Optional[Tuple[int, int]]:
+    """Return the indexes of two edges of polygon xy that cross, None if it is simple.
+
+    Edge i runs from xy[i] to xy[i + 1] (the last one back to xy[0]).  Edges
+    are kept in a list ordered by y along a sweep line moving in x; only
+    edges that become neighbours in that order are tested (Shamos-Hoey).
+    """
+    n = len(xy)
+    edges = []
+    for i in range(n):
+        a, b = xy[i], xy[(i + 1) % n]
+        edges.append((a, b) if a <= b else (b, a))
+
+    def crossing(i: int, j: int) -> bool:
+        if (i + 1) % n == j or (j + 1) % n == i:
+            # Neighbouring edges share a vertex; they cross only if they fold back onto each other
+            first = i if (i + 1) % n == j else j
+            a, shared, c = xy[first], xy[(first + 1) % n], xy[(first + 2) % n]
+            return (_orientation(a, shared, c) == 0
+                    and (a[0] - shared[0]) * (c[0] - shared[0]) + (a[1] - shared[1]) * (c[1] - shared[1]) > 0)
+        return segments_intersect(*edges[i], *edges[j])
+
+    def key(i: int, x: float) -> Tuple[float, float]:
+        (x1, y1), (x2, y2) = edges[i]
+        if x1 == x2:
+            return y1, math.inf
+        slope = (y2 - y1) / (x2 - x1)
+        return y1 + slope * (x - x1), slope
+
+    events = sorted([(edges[i][0], 0, i) for i in range(n)] + [(edges[i][1], 1, i) for i in range(n)])
+    active: List[int] = []
+    for point, is_end, i in events:
+        if not is_end:
+            k = key(i, point[0])
+            lo, hi = 0, len(active)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if key(active[mid], point[0]) < k:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            pos = lo
+            active.insert(pos, i)
+            for j in active[max(pos - 1, 0):pos] + active[pos + 1:pos + 2]:
+                if crossing(i, j):
+                    return i, j
+        else:
+            pos = active.index(i)
+            if 0 < pos < len(active) - 1 and crossing(active[pos - 1], active[pos + 1]):
+                return active[pos - 1], active[pos + 1]
+            del active[pos]
+    return None
+
+
+def check_airspace(record: dict) -> Tuple[List[str], List[str]]:
+    """Return the (errors, warnings) of an aerofiles airspace record."""
+    problems = []
+    warnings = []
+    elements = record.get("elements", [])
+    if not elements:
+        return ["no geometry"], []
+
+    circles = [e for e in elements if e["type"] == "circle"]
+    points: List[Point] = []
+    # Points on arcs (chord ends)
+    on_arc = set()
+    for element in elements:
+        if element["type"] == "point":
+            points.append(tuple(element["location"]))
+        elif element["type"] == "arc":
+            arc = arc_points(element["center"], element["start"], element["end"], element["clockwise"])
+            points.extend(arc)
+            on_arc.update(arc)
+    if any(not c.get("radius") or c["radius"] <= 0 for c in circles):
+        problems.append("circle without radius")
+    if circles and (points or len(circles) > 1):
+        problems.append("circle mixed with other geometry")
+
+    if points:
+        # Drop repeated vertices, including an explicit closing one
+        ring = [p for k, p in enumerate(points) if p != points[k - 1]] or points[:1]
+        if len(set(ring)) < 3:
+            problems.append(f"unclosed polygon: {len(set(ring))} distinct vertices")
+        else:
+            xy = project(ring)
+            if polygon_area(xy) < MIN_AREA:
+                problems.append("zero-area polygon")
+            else:
+                edges = self_intersection(xy)
+                if edges is not None:
+                    lat, lon = ring[edges[0]]
+                    approximate = any(ring[k % len(ring)] in on_arc for e in edges for k in (e, e + 1))
+                    warnings.append(f"self-intersecting polygon at the edge from {lat:.5f},{lon:.5f}"
+                                    + (" (at an arc, approximated by chords)" if approximate else ""))
+
+    if floor_above_ceiling(record.get("floor"), record.get("ceiling")):
+        problems.append(f"floor {record['floor']} above ceiling {record['ceiling']}")
+    return problems, warnings
+
+
+def normalize_coordinate(value: str) -> Optional[str]:
+    """Return a coordinate XCSoar reads, but aerofiles does not, as DD:MM:SS.sss; None if it is not one.
+
+    E.g. "33:17:04 S 19:13.1702 E" (seconds in one half, decimal minutes in
+    the other) or "49:03:50.N 121:23:43.W".
+    """
+    match = RE_LENIENT_COORDINATE.fullmatch(value.strip())
+    if match is None:
+        return None
+    halves = []
+    for degrees, minutes, seconds, hemisphere in (match.groups()[:4], match.groups()[4:]):
+        total = int(degrees) * 3600 + float(minutes) * 60 + float(seconds or 0)
+        degrees, rest = divmod(round(total, 3), 3600)
+        minutes, seconds = divmod(rest, 60)
+        halves.append(f"{int(degrees):02d}:{int(minutes):02d}:{seconds:06.3f} {hemisphere.upper()}")
+    return " ".join(halves)
+
+
+def known_lines(fp, unknown: Dict[str, int], normalized: Optional[List[int]] = None) -> Iterator[str]:
+    """Yield the lines of fp, as aerofiles can read them.
+
+    Lines of record types aerofiles cannot read, and ";" comments, are
+    commented out; unknown counts the former per record type.  Coordinates
+    that only XCSoar reads are rewritten (see normalize_coordinate()), and
+    counted in normalized[0].
+    """
+    for line in fp:
+        content = line.split("*", 1)[0].strip()
+        if not content or content.startswith(";"):
+            yield "*" + line if content else line
+            continue
+        kind, _, value = content.partition(" ")
+        if not hasattr(LowLevelReader, f"handle_{kind}_record"):
+            unknown[kind] = unknown.get(kind, 0) + 1
+            line = "*" + line
+        elif kind in COORDINATE_RECORDS or (kind == "V" and value.lstrip().upper().startswith("X")):
+            line = _normalize_coordinates(kind, value, line, normalized)
+        yield line
+
+
+def _normalize_coordinates(kind: str, value: str, line: str, normalized: Optional[List[int]]) -> str:
+    prefix = ""
+    if kind == "V":
+        prefix, _, value = value.partition("=")
+        prefix += "="
+    parts = value.split(",") if kind == "DB" else [value]
+    if all(LOCATION_FORMAT_1.fullmatch(p) or LOCATION_FORMAT_2.fullmatch(p) for p in parts):
+        return line
+    fixed = [normalize_coordinate(p) for p in parts]
+    if None in fixed:
+        # Not readable by XCSoar either: let aerofiles report it
+        return line
+    if normalized is not None:
+        normalized[0] += 1
+    return f"{kind} {prefix}{','.join(fixed)}\n"
+
+
+def check_file(filename: Path) -> dict:
+    """Return the check result of one OpenAir file (without --strict)."""
+    start = time.perf_counter()
+    problems = []
+    warnings = []
+    airspaces = 0
+    unknown: Dict[str, int] = {}
+    normalized = [0]
+    try:
+        with filename.open(encoding="utf-8-sig", errors="replace") as fp:
+            for record, error in OpenAirReader(known_lines(fp, unknown, normalized)):
+                if error:
+                    problems.append({"line": getattr(error, "lineno", None), "name": None, "error": str(error)})
+                    continue
+                if record["type"] != "airspace":
+                    continue
+                if not record.get("elements") and not record.get("name"):
+                    # Settings only (e.g. a leading AC without name), nothing to draw
+                    continue
+                airspaces += 1
+                line = record["elements"][0]["lineno"] if record.get("elements") else None
+                errors, geometry_warnings = check_airspace(record)
+                for problem in errors:
+                    problems.append({"line": line, "name": record.get("name"), "error": problem})
+                for warning in geometry_warnings:
+                    warnings.append({"line": line, "name": record.get("name"), "error": warning, "geometry": True})
+    except OSError as e:
+        problems.append({"line": None, "name": None, "error": f"Unreadable: {e}"})
+    for kind, count in sorted(unknown.items()):
+        warnings.append({"line": None, "name": None, "error": f"ignored {count} lines of unknown record type {kind}"})
+    if normalized[0]:
+        warnings.append({"line": None, "name": None,
+                         "error": f"converted {normalized[0]} coordinates that only XCSoar reads"})
+    return {
+        "path": str(filename),
+        "valid": not problems,
+        "airspaces": airspaces,
+        "errors": problems,
+        "warnings": warnings,
+        "seconds": round(time.perf_counter() - start, 4),
+    }
+
+
+def find_openair_files(paths: List[Path]) -> List[Path]:
+    """Return the OpenAir files of paths (files, or directories searched recursively for *.txt)."""
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(sorted(path.rglob("*.txt")))
+        else:
+            files.append(path)
+    return files
+
+
+def check_files(files: List[Path], jobs: int, ledger: Optional[ValidationLedger] = None) -> List[dict]:
+    """Return the check results of files, in their order.
+
+    Results of files that did not change since they were checked are taken from ledger.
+    """
+    results = ledger.results(files) if ledger is not None else {}
+    # Start the largest files first: the pool is then busy until the slowest one is done
+    order = sorted((p for p in files if p not in results),
+                   key=lambda p: p.stat().st_size if p.exists() else 0, reverse=True)
+    if jobs > 1 and len(order) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results.update(zip(order, pool.map(check_file, order)))
+    else:
+        results.update((p, check_file(p)) for p in order)
+    return [results[p] for p in files]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check OpenAir airspace files (parsing and geometry).")
+    parser.add_argument("paths", nargs="+", type=Path, help="OpenAir files or directories of them")
+    parser.add_argument("--report", type=Path, help="Write the results as JSON to this file")
+    parser.add_argument("--full", action="store_true", help="Check all files, also those unchanged since the last run")
+    parser.add_argument("--strict", action="store_true", help="Treat self-intersecting polygons as errors")
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=os.cpu_count() or 1,
+        help="Worker processes (default: CPU count, 1: serial)",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    ledger = ValidationLedger.load("airspaces", validator_version(VALIDATOR_VERSION), args.full)
+    results = check_files(find_openair_files(args.paths), args.jobs, ledger)
+    elapsed = time.perf_counter() - start
+    ledger.record_all(results)
+    ledger.save()
+
+    for result in results:
+        if args.strict:
+            result["errors"] += [w for w in result["warnings"] if w.get("geometry")]
+            result["warnings"] = [w for w in result["warnings"] if not w.get("geometry")]
+            result["valid"] = not result["errors"]
+        for problem in result["errors"]:
+            print(f"{result['path']}:{problem['line'] or ''}: {problem['name'] or '-'}: {problem['error']}")
+        for warning in result["warnings"]:
+            where = f":{warning['line']}: {warning['name'] or '-'}" if warning["line"] else ""
+            print(f"Warning: {result['path']}{where}: {warning['error']}")
+        print(f"{'Valid' if result['valid'] else 'INVALID'}: {result['path']} "
+              f"({result['airspaces']} airspaces, {len(result['errors'])} errors, {len(result['warnings'])} warnings, "
+              + ("unchanged)" if result.get("cached") else f"{result['seconds']:.2f} s)"))
+    invalid = sum(not r["valid"] for r in results)
+    print(f"{len(results)} files checked in {elapsed:.2f} s, {invalid} invalid")
+
+    if args.report:
+        report = {
+            "valid": invalid == 0,
+            "files": results,
+            "seconds": round(elapsed, 4),
+            "jobs": args.jobs,
+            "strict": args.strict,
+        }
+        args.report.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"Created: {args.report}")
 
-openairfile = OpenAirReader()
-openairfile.read(open(str(sys.argv[1])))
+    sys.exit(0 if invalid == 0 else 1)
@@ -1,15 +1,65 @@
 #!/bin/env python3
-"""Check if all the repository URLs are working."""
+"""
+Check if all the repository URLs are working:
 
+    ./script/check/check_urls.py                      # http://download.xcsoar.org/repository
+    ./script/check/check_urls.py output/repository    # a local repository file
+
+URLs are checked concurrently on a pooled session, with at most --per-host
+requests in flight to one host and at least --delay seconds between the
+requests to it.  Connection errors and 429/5xx answers are retried with
+backoff (see http_pool.make_session).  Hosts that reject HEAD are asked for
+the first byte with a ranged GET instead.  URLs that passed within the last
+--ttl seconds are not checked again (unless --full); their time is kept in
+the build cache (.cache/url-check.json).
+
+The cache only speeds up repeated local runs.  The scheduled CI check
+(.github/workflows/check_repo_urls.yml) starts from a clean checkout without
+.cache, and as it runs once a day a cached pass would have expired anyway:
+it always checks every URL, as a daily check should.
+"""
+
+import argparse
+from contextlib import contextmanager
+from pathlib import Path
 import sys
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
 import requests
-from typing import List
-from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "build"))
+
+from build_cache import cache_file, load_json, save_json  # noqa: E402
+from http_pool import TIMEOUT, make_session, map_ordered  # noqa: E402
+
+DEFAULT_REPOSITORY = "http://download.xcsoar.org/repository"
 
-def get_urls_from_www(repo_url: str) -> List[str]:
+CACHE_FORMAT = 1
+
+# Seconds a passed URL is not checked again
+CACHE_TTL = 3600
+
+# Concurrent requests in total and to a single host
+JOBS = 16
+PER_HOST = 4
+
+# Minimum seconds between the starts of two requests to the same host
+HOST_DELAY = 0.2
+
+# Some hosts answer HEAD (or non-browser Accept headers) with 415 or 405
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; xcsoar-data-content-url-check)",
+    "Accept": "*/*",
+}
+
+
+def get_urls_from_www(repo_url: str, session: Optional[requests.Session] = None) -> List[str]:
     """Extract all the URLs after "uri=" at repo_url."""
-    repo_req = requests.get(repo_url)
+    repo_req = (session or requests).get(repo_url, timeout=TIMEOUT)
+    repo_req.raise_for_status()
 
     urls = []
     for line in repo_req.iter_lines():
@@ -30,37 +80,152 @@ def get_urls_from_file(repo_file: Path) -> List[str]:
     return urls
 
 
-def check_urls(urls: List[str]) -> (bool, List[str]):
-    """Check (by an HTTP HEAD request) the URLs in urls."""
+class HostLimiter:
+    """Bounds the concurrent requests to, and the request rate of, each host."""
+
+    def __init__(self, per_host: int = PER_HOST, delay: float = HOST_DELAY):
+        self.per_host = per_host
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        # host -> earliest start time of its next request
+        self.next_start: Dict[str, float] = {}
+
+    @contextmanager
+    def slot(self, url: str) -> Iterator[None]:
+        """Wait until a request to the host of url may start."""
+        host = (urlsplit(url).hostname or "").lower()
+        with self.lock:
+            semaphore = self.semaphores.setdefault(host, threading.BoundedSemaphore(self.per_host))
+        with semaphore:
+            with self.lock:
+                now = time.monotonic()
+                start = max(now, self.next_start.get(host, now))
+                self.next_start[host] = start + self.delay
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+
+def check_url(session: requests.Session, limiter: HostLimiter, url: str) -> Tuple[Optional[int], str]:
+    """Return (HTTP status, error message) of url; status 200 or 206 means it works.
+
+    The status is None if no answer was received.
+    """
+    try:
+        with limiter.slot(url):
+            req = session.head(url, allow_redirects=True, timeout=TIMEOUT, headers=HEADERS)
+        if req.status_code == requests.codes.ok:
+            return req.status_code, ""
+        # Ask for the first byte only (many servers ignore Range and send 200)
+        with limiter.slot(url):
+            with session.get(url, allow_redirects=True, stream=True, timeout=TIMEOUT,
+                             headers={**HEADERS, "Range": "bytes=0-0"}) as req:
+                return req.status_code, ""
+    except requests.RequestException as e:
+        return None, str(e)
+
+
+class UrlCache:
+    """Times of the last successful check of URLs, kept in the build cache."""
+
+    def __init__(self, path: Optional[Path], ttl: float):
+        self.path = path
+        self.ttl = ttl
+        data = load_json(path, {})
+        if data.get("format") != CACHE_FORMAT:
+            data = {}
+        now = time.time()
+        # url -> time of the last successful check
+        self.passed: Dict[str, float] = {
+            url: t for url, t in data.get("passed", {}).items() if now - t < ttl
+        }
+
+    @classmethod
+    def load(cls, ttl: float = CACHE_TTL) -> "UrlCache":
+        """Return the cache stored in the build cache directory (disabled if ttl <= 0)."""
+        return cls(cache_file("url-check.json") if ttl > 0 else None, ttl)
+
+    def fresh(self, url: str) -> bool:
+        return url in self.passed
+
+    def add(self, url: str) -> None:
+        self.passed[url] = time.time()
+
+    def discard(self, url: str) -> None:
+        self.passed.pop(url, None)
+
+    def save(self) -> None:
+        save_json(self.path, {"format": CACHE_FORMAT, "passed": self.passed})
+
+
+def check_urls(urls: List[str], jobs: int = JOBS, per_host: int = PER_HOST, delay: float = HOST_DELAY,
+               cache: Optional[UrlCache] = None) -> Tuple[bool, List[str]]:
+    """Check (by an HTTP HEAD, else a ranged GET request) the URLs in urls."""
     rv = True
     failed_urls = []
+    cache = cache or UrlCache(None, 0)
+    session = make_session(pool_size=max(jobs, per_host))
+    limiter = HostLimiter(per_host, delay)
+    # A URL listed twice is checked once
+    unique = list(dict.fromkeys(u for u in urls if not cache.fresh(u)))
+    results = dict(zip(unique, map_ordered(lambda u: check_url(session, limiter, u), unique, jobs)))
 
     for i, url in enumerate(urls):
-        try:
-            req = requests.head(url, allow_redirects=True)
-            if req.status_code == requests.codes.ok:
-                print(f"{i}\tpass {req.status_code} {url}")
-            else:
-                print(f"{i}\tFAIL {req.status_code} {url}\t!!!")
-                failed_urls.append(url)
-                rv = False
-        except requests.RequestException as e:
-            print(f"{i}\tERROR {url}\t{e}\t!!!")
-            failed_urls.append(url)
-            rv = False
+        if url not in results:
+            print(f"{i}\tpass cached {url}")
+            continue
+        status, error = results[url]
+        if status in (requests.codes.ok, requests.codes.partial_content):
+            print(f"{i}\tpass {status} {url}")
+            cache.add(url)
+            continue
+        if status is None:
+            print(f"{i}\tERROR {url}\t{error}\t!!!")
+        else:
+            print(f"{i}\tFAIL {status} {url}\t!!!")
+        failed_urls.append(url)
+        cache.discard(url)
+        rv = False
 
+    cache.save()
     return rv, failed_urls
 
 
 if __name__ == "__main__":
-    # allow to specify the repository as argument
-    if len(sys.argv) > 1:
-        repo_url = sys.argv[1]
-    else:
-        repo_url = "http://download.xcsoar.org/repository"
+    parser = argparse.ArgumentParser(description="Check if all the repository URLs are working.")
+    parser.add_argument(
+        "repository", nargs="?", default=DEFAULT_REPOSITORY,
+        help=f"Repository file or URL (default: {DEFAULT_REPOSITORY})",
+    )
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=JOBS,
+        help=f"Concurrent requests (default: {JOBS}, 1: serial)",
+    )
+    parser.add_argument(
+        "--per-host", type=int, default=PER_HOST,
+        help=f"Concurrent requests to one host (default: {PER_HOST})",
+    )
+    parser.add_argument(
+        "--delay", type=float, default=HOST_DELAY,
+        help=f"Seconds between requests to one host (default: {HOST_DELAY})",
+    )
+    parser.add_argument(
+        "--ttl", type=float, default=CACHE_TTL,
+        help=f"Skip URLs that passed within this many seconds (default: {CACHE_TTL}, 0: check all)",
+    )
+    parser.add_argument("--full", action="store_true", help="Check all URLs, also those that passed recently")
+    args = parser.parse_args()
 
-    url_list = get_urls_from_www(repo_url)
-    all_passed, failed_urls = check_urls(urls=url_list)
+    repo_path = Path(args.repository)
+    if repo_path.is_file():
+        url_list = get_urls_from_file(repo_path)
+    else:
+        url_list = get_urls_from_www(args.repository)
+    cache = UrlCache.load(args.ttl)
+    if args.full:
+        cache.passed.clear()
+    all_passed, failed_urls = check_urls(url_list, args.jobs, args.per_host, args.delay, cache)
 
     if all_passed:
         print("PASS: All URIs downloaded successfully.")
@@ -1,8 +1,143 @@
 #!/bin/env python3
+"""
+Check .cup waypoint files, and directories of them, in one run:
 
+    ./script/check/check_waypoints.py output/content/waypoint/ --report check-waypoints.json
+
+Each file is parsed once by aerofiles, by a pool of worker processes (largest
+files first, so the run takes about as long as the slowest file).  Files in a
+"country" directory must also be named after a two-letter ISO 3166-1 alpha-2
+country code (e.g. DE-WPT-National-XCSoar.cup).  --report writes the results
+as JSON, with the parse time of each file.  Files unchanged since their
+last check are not parsed again, unless --full; see validation_ledger.py.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+from pathlib import Path
 import sys
+import time
+from typing import List, Optional
+
+from aerofiles import errors
 from aerofiles.seeyou.reader import Reader as CupFileReader
 
-cupfile = CupFileReader()
-print(sys.argv[1])
-cupfile.read(open(str(sys.argv[1])))
+from iso3166 import countries
+
+from validation_ledger import ValidationLedger, validator_version
+
+# Bump when the checks change: results of other versions are not reused
+VALIDATOR_VERSION = 1
+
+# Files in directories of this name must start with a country code
+COUNTRY_DIR = "country"
+
+
+def find_cup_files(paths: List[Path]) -> List[Path]:
+    """Return the .cup files of paths (files, or directories searched recursively)."""
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(sorted(path.rglob("*.cup")))
+        else:
+            files.append(path)
+    return files
+
+
+def country_code_error(filename: Path) -> Optional[str]:
+    """Return why filename does not start with a two-letter ISO 3166-1 alpha-2 code, None if it does."""
+    code = filename.stem.split("-")[0]
+    try:
+        country = countries.get(code)
+    except KeyError:
+        return f"INVALID ISO 3166-1 alpha-2 country code: {code}"
+    if country.alpha2.lower() != code.lower():
+        # Valid country/code, but not alpha2.
+        return f"INVALID two-letter ISO 3166-1 alpha-2 country code: {code}"
+    return None
+
+
+def check_file(filename: Path) -> dict:
+    """Return the check result of one .cup file."""
+    start = time.perf_counter()
+    problems = []
+    waypoints = None
+    if filename.parent.name == COUNTRY_DIR:
+        error = country_code_error(filename)
+        if error:
+            problems.append(error)
+    try:
+        with filename.open(encoding="utf-8") as f:
+            waypoints = len(CupFileReader().read(f)["waypoints"])
+    except (errors.ParserError, UnicodeDecodeError, ValueError, IndexError) as e:
+        problems.append(f"INVALID SeeYou .cup format: {type(e).__name__}: {e}")
+    except OSError as e:
+        problems.append(f"Unreadable: {e}")
+    return {
+        "path": str(filename),
+        "valid": not problems,
+        "errors": problems,
+        "waypoints": waypoints,
+        "seconds": round(time.perf_counter() - start, 4),
+    }
+
+
+def check_files(files: List[Path], jobs: int, ledger: Optional[ValidationLedger] = None) -> List[dict]:
+    """Return the check results of files, in their order.
+
+    Results of files that did not change since they were checked are taken from ledger.
+    """
+    results = ledger.results(files) if ledger is not None else {}
+    # Start the largest files first: the pool is then busy until the slowest one is done
+    order = sorted((p for p in files if p not in results),
+                   key=lambda p: p.stat().st_size if p.exists() else 0, reverse=True)
+    if jobs > 1 and len(order) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results.update(zip(order, pool.map(check_file, order)))
+    else:
+        results.update((p, check_file(p)) for p in order)
+    return [results[p] for p in files]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check .cup waypoint files (format and country code names).")
+    parser.add_argument("paths", nargs="+", type=Path, help=".cup files or directories of them")
+    parser.add_argument("--report", type=Path, help="Write the results as JSON to this file")
+    parser.add_argument("--full", action="store_true", help="Check all files, also those unchanged since the last run")
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=os.cpu_count() or 1,
+        help="Worker processes (default: CPU count, 1: serial)",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    ledger = ValidationLedger.load("waypoints", validator_version(VALIDATOR_VERSION), args.full)
+    results = check_files(find_cup_files(args.paths), args.jobs, ledger)
+    elapsed = time.perf_counter() - start
+    ledger.record_all(results)
+    ledger.save()
+
+    for result in results:
+        if result["valid"]:
+            print(f"Valid: {result['path']} ({result['waypoints']} waypoints, "
+                  + ("unchanged)" if result.get("cached") else f"{result['seconds']:.2f} s)"))
+        for error in result["errors"]:
+            print(f"{error} ({result['path']})")
+    invalid = sum(not r["valid"] for r in results)
+    slowest = max(results, key=lambda r: r["seconds"], default=None)
+    print(f"{len(results)} files checked in {elapsed:.2f} s, {invalid} invalid"
+          + (f"; slowest: {slowest['path']} ({slowest['seconds']:.2f} s)" if slowest else ""))
+
+    if args.report:
+        report = {
+            "valid": invalid == 0,
+            "files": results,
+            "seconds": round(elapsed, 4),
+            "jobs": args.jobs,
+        }
+        args.report.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"Created: {args.report}")
+
+    sys.exit(0 if invalid == 0 else 1)
@@ -1,14 +1,117 @@
 #!/bin/env python3
-"""Ensure that waypoints/countries are named correctly, and pass an Aerofiles check."""
+"""
+Ensure that waypoints/countries are named correctly and lie in their country:
 
+    ./script/check/check_waypoints_country.py output/content/waypoint/country/ --report check-country.json
+
+The country of a file is the ISO 3166-1 alpha-2 code its name starts with
+(as repository.py's guess_area() reads it, e.g. DE-WPT-National-XCSoar.cup).
+The coordinates of each file are loaded into NumPy arrays and tested in bulk:
+
+- waypoints outside the bounding boxes (from country_bbox.json, widened by
+  --buffer km) of the country and its TERRITORIES are errors, e.g. a
+  coordinate with the wrong sign, unless they lie in the box of one of the
+  country's NEIGHBOURS (border airfields, neighbouring countries in one
+  file): those are warnings.  Waypoints in ALLOWED_WAYPOINTS, checked
+  elsewhere by hand, are not reported;
+- waypoints farther from the file's median position than the median
+  distance plus --outlier-mads scaled median absolute deviations (and at
+  least --outlier-km) are reported as warnings: remote islands are
+  legitimate outliers.
+
+With --format, the files must also pass an Aerofiles check.  Locations of
+files unchanged since their last check (with the same bounding boxes and
+thresholds) are not checked again, unless --full; see validation_ledger.py.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
 from pathlib import Path
+import re
 import sys
+import time
+from typing import Dict, List, Optional, Tuple
 
+from aerofiles.seeyou.common import SeeYouFileFormat
 from aerofiles.seeyou.reader import Reader as CupReader
 from aerofiles import errors
 
 from iso3166 import countries
 
+import numpy as np
+
+from validation_ledger import ValidationLedger, validator_version
+
+# Bump when the checks change: results of other versions are not reused
+VALIDATOR_VERSION = 3
+
+# Country code -> [min_lon, min_lat, max_lon, max_lat]; min_lon > max_lon if
+# the box crosses the antimeridian
+COUNTRY_BBOX_FILE = Path(__file__).with_name("country_bbox.json")
+
+# Country code -> codes of its overseas territories and dependencies, whose
+# waypoints may be in the country's file
+TERRITORIES = {
+    "ar": ["aq"],
+    "au": ["aq", "nf"],
+    "dk": ["fo", "gl"],
+    "fr": ["gf", "gp", "mq", "nc", "pm", "re", "yt"],
+    "no": ["aq", "sj"],
+    "us": ["pr"],
+}
+
+# Country code -> codes of the neighbouring countries whose waypoints the
+# country's file lists (waypoints there are warnings, not errors)
+NEIGHBOURS = {
+    "ch": ["at", "de", "fr", "it", "li"],
+    "cz": ["at", "de", "pl", "sk"],
+    "ma": ["dz", "eh"],
+    "ru": ["az", "by", "cn", "ee", "fi", "ge", "kp", "kz", "lt", "lv", "mn", "no", "pl", "ua"],
+    "sd": ["cf", "eg", "er", "et", "ly", "ss", "td"],
+    "us": ["ca", "mx"],
+    "uz": ["af", "kg", "kz", "tj", "tm"],
+    "za": ["bw", "ls", "mz", "na", "sz", "zw"],
+}
+
+# Country code -> names of waypoints known to lie outside the country and
+# its neighbours
+ALLOWED_WAYPOINTS = {
+    # Papua New Guinea
+    "au": ["Nomad River Pap"],
+    # Lebanon (LB)
+    "li": ["Beirut", "Kleyate Rene", "Rayak"],
+    # Nepal (NP)
+    "ne": ["Kathmandu Tribhu", "Lukla Nepal", "Manang Prv", "Simara"],
+    "no": ["Nordpol"],
+    # Armenia
+    "ru": ["Yerevan Erebuni", "Yerevan Zvartnot"],
+    # Chile
+    "us": ["Puerto Montt El", "Puerto Varas Mir"],
+}
+
+# Kilometres the country bounding boxes are widened by
+BUFFER_KM = 50.0
+
+# Outliers are farther from the median position than the median distance
+# plus this many scaled median absolute deviations, and than OUTLIER_KM
+OUTLIER_MADS = 10.0
+OUTLIER_KM = 500.0
+
+# Mean earth radius in km
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG = np.pi * EARTH_RADIUS_KM / 180
+
+# Scales a median absolute deviation to a standard deviation (normal distribution)
+MAD_SCALE = 1.4826
+
+TASK_SECTION = ["-----Related Tasks-----"]
+
+# Same patterns as aerofiles.seeyou.reader
+RE_LATITUDE = re.compile(r"^\d{4}\.\d{3}[NS]$", re.I)
+RE_LONGITUDE = re.compile(r"^\d{5}\.\d{3}[EW]$", re.I)
+
 
 def is_valid_cup(filename: Path) -> bool:
     """Return True if filename is in a valid SeeYou .cup format, else false."""
@@ -22,9 +125,14 @@ def is_valid_cup(filename: Path) -> bool:
     return True
 
 
+def country_code(filename: Path) -> str:
+    """Return the country code part of filename, where guess_area() finds it."""
+    return filename.name.split(".")[0].split("-")[0]
+
+
 def is_name_country_code(filename: Path) -> bool:
-    """Return True if filename.stem is a valid two-letter country code (ISO 3166-1 alpha-2), else return False."""
-    name = filename.stem
+    """Return True if filename starts with a valid two-letter country code (ISO 3166-1 alpha-2), else return False."""
+    name = country_code(filename)
 
     try:
         country = countries.get(name)
@@ -42,18 +150,179 @@ def is_name_country_code(filename: Path) -> bool:
     return True
 
 
-def main(in_dir: Path) -> int:
+def load_country_bboxes(path: Path = COUNTRY_BBOX_FILE) -> Dict[str, List[float]]:
+    with path.open(encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _decode(values: List[str], negative: str) -> np.ndarray:
+    """Decode DDMM.mmm[NS] / DDDMM.mmm[EW] values (already validated) to degrees."""
+    raw = np.array([float(v[:-1]) for v in values])
+    degrees = np.floor(raw / 100)
+    decoded = degrees + (raw - degrees * 100) / 60
+    return np.where(np.array([v[-1].upper() == negative for v in values], dtype=bool), -decoded, decoded)
+
+
+def read_coordinates(filename: Path) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """Return (names, latitudes, longitudes) of the waypoints of a .cup file.
+
+    Rows are skipped like aerofiles does; rows with malformed coordinates
+    too (reporting them is the format check's job).
+    """
+    names, lats, lons = [], [], []
+    columns = {name: i for i, name in enumerate(SeeYouFileFormat.HEADER_11)}
+    with filename.open(encoding="utf-8", errors="replace", newline="") as fp:
+        for fields in csv.reader(fp):
+            if fields == TASK_SECTION:
+                break
+            if all(f in fields for f in SeeYouFileFormat.HEADER_11):
+                columns = {name: fields.index(name) for name in fields}
+                continue
+            if not fields or fields[0].startswith("*"):
+                continue
+            try:
+                lat = fields[columns["lat"]].strip()
+                lon = fields[columns["lon"]].strip()
+            except IndexError:
+                continue
+            if RE_LATITUDE.match(lat) and RE_LONGITUDE.match(lon):
+                names.append(fields[columns["name"]])
+                lats.append(lat)
+                lons.append(lon)
+    if not names:
+        return names, np.empty(0), np.empty(0)
+    return names, _decode(lats, "S"), _decode(lons, "W")
+
+
+def outside_bbox(lat: np.ndarray, lon: np.ndarray, bbox: List[float], buffer_km: float) -> np.ndarray:
+    """Return the mask of the points outside bbox widened by buffer_km."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    lat_buffer = buffer_km / KM_PER_DEG
+    lon_buffer = buffer_km / (KM_PER_DEG * max(np.cos(np.radians(max(abs(min_lat), abs(max_lat)))), 0.01))
+    inside_lon = (lon >= min_lon - lon_buffer) & (lon <= max_lon + lon_buffer)
+    if min_lon > max_lon:
+        inside_lon = (lon >= min_lon - lon_buffer) | (lon <= max_lon + lon_buffer)
+    return ~(inside_lon & (lat >= min_lat - lat_buffer) & (lat <= max_lat + lat_buffer))
+
+
+def foreign_countries(lat: float, lon: float, bboxes: Dict[str, List[float]], buffer_km: float) -> List[str]:
+    """Return the codes of the countries whose bounding box (widened by buffer_km) contains the point."""
+    point_lat, point_lon = np.array([lat]), np.array([lon])
+    return sorted(code for code, bbox in bboxes.items() if not outside_bbox(point_lat, point_lon, bbox, buffer_km)[0])
+
+
+def centroid_distances(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Return the great circle distances (km) of the points from their median position."""
+    phi, lam = np.radians(lat), np.radians(lon)
+    # Take the median longitude on the side of the antimeridian most points are on
+    lam_wrapped = np.where(lam < 0, lam + 2 * np.pi, lam)
+    center_lam = np.median(lam_wrapped if np.ptp(lam_wrapped) < np.ptp(lam) else lam)
+    center_phi = np.median(phi)
+    a = (np.sin((phi - center_phi) / 2) ** 2
+         + np.cos(phi) * np.cos(center_phi) * np.sin((lam - center_lam) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def centroid_outliers(lat: np.ndarray, lon: np.ndarray, mads: float, min_km: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (outlier mask, distances from the median position in km) of the points."""
+    distances = centroid_distances(lat, lon)
+    median = np.median(distances)
+    mad = np.median(np.abs(distances - median)) * MAD_SCALE
+    return (distances > median + mads * mad) & (distances > min_km), distances
+
+
+def check_location(filename: Path, bboxes: Dict[str, List[float]], buffer_km: float = BUFFER_KM,
+                   outlier_mads: float = OUTLIER_MADS, outlier_km: float = OUTLIER_KM) -> dict:
+    """Return the location check result of one .cup file."""
+    start = time.perf_counter()
+    code = country_code(filename).lower()
+    names, lat, lon = read_coordinates(filename)
+    result = {"path": str(filename), "country": code, "waypoints": len(names), "errors": [], "warnings": []}
+    bbox = bboxes.get(code)
+    if bbox is None:
+        result["warnings"].append({"error": f"no bounding box for country {code}"})
+    elif names:
+        outside = outside_bbox(lat, lon, bbox, buffer_km)
+        for territory in TERRITORIES.get(code, []):
+            outside &= outside_bbox(lat, lon, bboxes[territory], buffer_km)
+        allowed = set(ALLOWED_WAYPOINTS.get(code, []))
+        neighbours = set(NEIGHBOURS.get(code, []))
+        for i in np.flatnonzero(outside):
+            if names[i] in allowed:
+                continue
+            problem = {"name": names[i], "lat": round(float(lat[i]), 5), "lon": round(float(lon[i]), 5)}
+            others = foreign_countries(lat[i], lon[i], bboxes, buffer_km)
+            area = "/".join(o.upper() for o in others)
+            if neighbours.intersection(others):
+                problem["error"] = f"outside {code.upper()}, in the area of neighbouring {area}"
+                result["warnings"].append(problem)
+            elif others:
+                problem["error"] = f"outside {code.upper()} and its neighbours, in the area of {area}"
+                result["errors"].append(problem)
+            else:
+                problem["error"] = f"outside {code.upper()} and any other country"
+                result["errors"].append(problem)
+    if len(names) >= 3:
+        outliers, distances = centroid_outliers(lat, lon, outlier_mads, outlier_km)
+        for i in np.flatnonzero(outliers):
+            result["warnings"].append({"name": names[i], "lat": round(float(lat[i]), 5), "lon": round(float(lon[i]), 5),
+                                       "error": f"{distances[i]:.0f} km from the median position"})
+    result["seconds"] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def main(in_dir: Path, buffer_km: float = BUFFER_KM, outlier_mads: float = OUTLIER_MADS,
+         outlier_km: float = OUTLIER_KM, check_format: bool = False, report: Optional[Path] = None,
+         full: bool = False) -> int:
     """Check all the .cup files in the in_dir."""
     ok = True
-    for p in sorted(in_dir.glob("*.cup")):
+    bboxes = load_country_bboxes()
+    results = []
+    start = time.perf_counter()
+    files = sorted(in_dir.glob("*.cup"))
+    bbox_digest = hashlib.sha256(COUNTRY_BBOX_FILE.read_bytes()).hexdigest()[:16]
+    ledger = ValidationLedger.load(
+        "country", validator_version(VALIDATOR_VERSION, bbox_digest, buffer_km, outlier_mads, outlier_km), full,
+    )
+    unchanged = ledger.results(files)
+    for p in files:
         ok = is_name_country_code(p) and ok
-        ok = is_valid_cup(p) and ok
+        if check_format:
+            ok = is_valid_cup(p) and ok
+        result = unchanged.get(p) or check_location(p, bboxes, buffer_km, outlier_mads, outlier_km)
+        for problem in result["errors"]:
+            print(f"INVALID location: {problem['name']} at {problem['lat']},{problem['lon']}: {problem['error']} ({p})")
+        for problem in result["warnings"]:
+            where = f"{problem['name']} at {problem['lat']},{problem['lon']}: " if "name" in problem else ""
+            print(f"Warning: {where}{problem['error']} ({p})")
+        ok = not result["errors"] and ok
+        results.append(result)
+    elapsed = time.perf_counter() - start
+    ledger.record_all(results)
+    ledger.save()
+    print(f"{len(results)} files, {sum(r['waypoints'] for r in results)} waypoints checked in {elapsed:.2f} s")
+
+    if report is not None:
+        data = {"valid": ok, "files": results, "seconds": round(elapsed, 4)}
+        report.write_text(json.dumps(data, indent=2) + "\n", encoding="utf-8")
+        print(f"Created: {report}")
     return ok
 
 
 if __name__ == "__main__":
-    wp_dir = Path(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Check the country codes and waypoint locations of national .cup files.")
+    parser.add_argument("wp_dir", type=Path, help="Directory of XX-*.cup files")
+    parser.add_argument("--buffer", type=float, default=BUFFER_KM,
+                        help=f"Widen the country bounding boxes by this many km (default: {BUFFER_KM:g})")
+    parser.add_argument("--outlier-mads", type=float, default=OUTLIER_MADS,
+                        help=f"Outlier threshold in median absolute deviations (default: {OUTLIER_MADS:g})")
+    parser.add_argument("--outlier-km", type=float, default=OUTLIER_KM,
+                        help=f"Minimum distance of outliers from the median position (default: {OUTLIER_KM:g})")
+    parser.add_argument("--format", action="store_true", help="Also run the Aerofiles format check")
+    parser.add_argument("--report", type=Path, help="Write the results as JSON to this file")
+    parser.add_argument("--full", action="store_true", help="Check all files, also those unchanged since the last run")
+    args = parser.parse_args()
 
-    if main(wp_dir):
+    if main(args.wp_dir, args.buffer, args.outlier_mads, args.outlier_km, args.format, args.report, args.full):
         sys.exit(0)
     sys.exit(1)
@@ -0,0 +1,106 @@
+"""
+Results of previous check runs, to re-check only files that changed.
+
+The ledger is one JSON file in the build cache (.cache/validation-ledger.json),
+loaded once per check script.  For each validator it keeps, per file, the
+content hash, the validator version and the result of the last check.  A
+result is reused while the file's SHA-256 and the validator version are the
+same; a validator changes its version whenever its checks (or their
+parameters) change.  Hashes are reused while mtime and size match, so an
+unchanged tree is not even read.  With full=True (the scripts' --full)
+nothing is reused, but the ledger is still updated.
+
+The ledger speeds up repeated local runs of check.sh only: CI does not run
+the checks, and a job starting without .cache (or XCSOAR_CACHE_DIR) checks
+every file.  A CI job that runs them should restore that directory (e.g.
+with actions/cache) to benefit.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from importlib.metadata import PackageNotFoundError, version as package_version
+from pathlib import Path
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "build"))
+
+from build_cache import cache_file, load_json, save_json  # noqa: E402
+from file_hash import HASH_JOBS, mmap_sha256  # noqa: E402
+
+LEDGER_FORMAT = 1
+
+
+def validator_version(*parts: object) -> str:
+    """Return a version string of parts, with the installed aerofiles version."""
+    try:
+        aerofiles = package_version("aerofiles")
+    except PackageNotFoundError:
+        aerofiles = "unknown"
+    return ":".join([*(str(p) for p in parts), f"aerofiles-{aerofiles}"])
+
+
+class ValidationLedger:
+    """The results of one validator, keyed by file path and validated by content hash."""
+
+    def __init__(self, path: Optional[Path], validator: str, version: str, full: bool = False):
+        self.path = path
+        self.validator = validator
+        self.version = version
+        self.full = full
+        data = load_json(path, {})
+        if data.get("format") != LEDGER_FORMAT:
+            data = {}
+        self.data = data
+        # path -> [mtime_ns, size, sha256, version, result]
+        self.entries: Dict[str, list] = data.setdefault("validators", {}).get(validator, {})
+        # path -> (mtime_ns, size, sha256) of the files of this run
+        self.stats: Dict[str, Tuple[int, int, str]] = {}
+        self.reused = 0
+
+    @classmethod
+    def load(cls, validator: str, version: str, full: bool = False) -> "ValidationLedger":
+        """Return the ledger of validator stored in the build cache directory."""
+        return cls(cache_file("validation-ledger.json"), validator, version, full)
+
+    def _stat(self, path: Path) -> Tuple[int, int, str]:
+        stat = path.stat()
+        entry = self.entries.get(str(path))
+        if entry and entry[:2] == [stat.st_mtime_ns, stat.st_size]:
+            return stat.st_mtime_ns, stat.st_size, entry[2]
+        return stat.st_mtime_ns, stat.st_size, mmap_sha256(path)
+
+    def results(self, paths: Iterable[Path]) -> Dict[Path, dict]:
+        """Return {path: result} of the paths whose previous result is still valid."""
+        paths = [p for p in paths if p.is_file()]
+        with ThreadPoolExecutor(max_workers=HASH_JOBS) as pool:
+            self.stats = dict(zip((str(p) for p in paths), pool.map(self._stat, paths)))
+        if self.full:
+            return {}
+        reusable = {}
+        for p in paths:
+            entry = self.entries.get(str(p))
+            if entry and entry[2] == self.stats[str(p)][2] and entry[3] == self.version:
+                reusable[p] = {**entry[4], "cached": True}
+        self.reused = len(reusable)
+        return reusable
+
+    def record(self, path: Path, result: dict) -> None:
+        """Store the result of checking path (a file passed to results())."""
+        stat = self.stats.get(str(path))
+        if stat is not None:
+            self.entries[str(path)] = [*stat, self.version, result]
+
+    def record_all(self, results: List[dict]) -> None:
+        """Store results that have their file in result["path"]."""
+        for result in results:
+            self.record(Path(result["path"]), {k: v for k, v in result.items() if k != "cached"})
+
+    def save(self) -> None:
+        """Drop entries of missing files and write the ledger back to disk."""
+        for key in [k for k in self.entries if not Path(k).exists()]:
+            del self.entries[key]
+        print(f"validation ledger ({self.validator}): {self.reused} of {len(self.stats)} files unchanged"
+              + (" (--full: all checked)" if self.full else ""))
+        self.data["format"] = LEDGER_FORMAT
+        self.data["validators"][self.validator] = self.entries
+        save_json(self.path, self.data)